@@ -0,0 +1,123 @@
+#!/usr/bin/env python
+# -*- coding: UTF_8 -*-
+
+""" Compression benchmark of the recording chunk codecs.
+
+Profiles are measured on a simulated device, then encoded and decoded by
+chunks with each codec and level. For each point the compression ratio and
+the encode/decode rates (MB/s of raw profiles) are reported. Results are
+written in a JSON file.
+
+The profiles of the simulator are synthetic (smooth profiles with noise) :
+the ratios obtained on field data depend on the flow and the configuration.
+
+run with :
+
+	python3 ./benchmarks/bench_codec.py --output bench_codec.json
+"""
+
+# Add path to the lib folder
+import sys, os
+lib_path = os.path.abspath(__file__).split('/benchmarks/')[0]
+sys.path.insert(0, lib_path)
+#-------------------------------------
+
+import argparse
+import json
+import platform
+from time import perf_counter
+from datetime import datetime
+
+from peacock_uvp.apf04_driver import Apf04Driver
+from peacock_uvp.apf04_addr_cmd import get_addr_dict
+from peacock_uvp.apf04_recording import encode_chunk, decode_chunk, CODEC_RAW, CODEC_DELTA_ZLIB, CODEC_DELTA_LZMA
+from peacock_uvp.apf04_simulator import Apf04Simulator, LoopbackSerial, DEFAULT_SETTINGS
+
+F_SYS = 36e6
+
+CODEC_NAMES = {CODEC_RAW: "raw", CODEC_DELTA_ZLIB: "delta+zlib", CODEC_DELTA_LZMA: "delta+lzma"}
+
+def record_profiles(_n_vol, _count):
+	""" measure _count profiles on a simulated device (no waiting)
+	@return list of raw profiles
+	"""
+	simulator = Apf04Simulator(F_SYS, _time_scale=0.)
+	apf = Apf04Driver(None, F_SYS, "simulator")
+	apf.ser = LoopbackSerial(simulator, 750000, _time_scale=0.)
+	apf.addr = get_addr_dict(apf.read_version()[1])
+	config = apf.new_config().set(dict(DEFAULT_SETTINGS, n_vol=_n_vol))
+	apf.write_config(config, 0)
+	apf.select_config(0)
+	profiles = []
+	for _ in range(_count):
+		apf.act_meas_profile()
+		profiles.append(apf.read_profile(config.n_vol))
+	return profiles
+
+def bench_point(_profiles, _chunk_profiles, _codec, _level, _repeat):
+	""" encode and decode the profiles by chunks
+	@return dict of results
+	"""
+	profile_size = len(_profiles[0])
+	chunks = [b"".join(_profiles[i:i+_chunk_profiles]) for i in range(0, len(_profiles), _chunk_profiles)]
+	raw_size = sum(len(chunk) for chunk in chunks)
+
+	start = perf_counter()
+	for _ in range(_repeat):
+		encoded = [encode_chunk(chunk, profile_size, _codec, _level) for chunk in chunks]
+	encode_time = (perf_counter()-start)/_repeat
+	start = perf_counter()
+	for _ in range(_repeat):
+		decoded = [decode_chunk(chunk, profile_size, _codec) for chunk in encoded]
+	decode_time = (perf_counter()-start)/_repeat
+	assert [bytes(chunk) for chunk in decoded] == chunks
+
+	encoded_size = sum(len(chunk) for chunk in encoded)
+	return {
+		"codec": CODEC_NAMES[_codec],
+		"level": _level,
+		"chunk_profiles": _chunk_profiles,
+		"raw_bytes": raw_size,
+		"encoded_bytes": encoded_size,
+		"ratio": raw_size/encoded_size,
+		"encode_mb_per_s": raw_size/encode_time/1e6,
+		"decode_mb_per_s": raw_size/decode_time/1e6,
+	}
+
+def main():
+	parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+	parser.add_argument("--n-vol", type=int, nargs="+", default=[50, 250])
+	parser.add_argument("--count", type=int, default=1024, help="number of profiles")
+	parser.add_argument("--chunk-profiles", type=int, nargs="+", default=[64, 256])
+	parser.add_argument("--zlib-levels", type=int, nargs="+", default=[1, 6, 9])
+	parser.add_argument("--lzma-levels", type=int, nargs="+", default=[0, 6])
+	parser.add_argument("--repeat", type=int, default=3)
+	parser.add_argument("--output", default="bench_codec.json")
+	args = parser.parse_args()
+
+	points = [(CODEC_RAW, None)] + [(CODEC_DELTA_ZLIB, level) for level in args.zlib_levels] \
+		+ [(CODEC_DELTA_LZMA, level) for level in args.lzma_levels]
+	results = []
+	for n_vol in args.n_vol:
+		profiles = record_profiles(n_vol, args.count)
+		for chunk_profiles in args.chunk_profiles:
+			for codec, level in points:
+				result = bench_point(profiles, chunk_profiles, codec, level, args.repeat)
+				result["n_vol"] = n_vol
+				results.append(result)
+				print("n_vol %3d chunk %4d %-10s level %4s : ratio %5.2f, encode %7.1f MB/s, decode %7.1f MB/s" \
+					%(n_vol, chunk_profiles, result["codec"], level, result["ratio"], \
+					result["encode_mb_per_s"], result["decode_mb_per_s"]))
+
+	with open(args.output, "w") as output:
+		json.dump({
+			"date": datetime.utcnow().isoformat(),
+			"python": platform.python_version(),
+			"machine": platform.machine(),
+			"count": args.count,
+			"results": results,
+		}, output, indent=2)
+	print("results written in %s"%args.output)
+
+if __name__ == '__main__':
+	main()
@@ -0,0 +1,106 @@
+#!/usr/bin/env python
+# -*- coding: UTF_8 -*-
+
+""" Sustained IQ acquisition rate on a simulated device.
+
+For each baudrate, IQ blocks (n_tir shots x n_vol cells) are measured and
+streamed to a file with Apf04IQRecorder (the file is written while the next
+block is acquired). The IQ MB/s, the blocks/s and the share of the line
+capacity used by the IQ samples are reported, with the decode rate of the
+blocks (complex64 conversion). Results are written in a JSON file.
+
+run with :
+
+	python3 ./benchmarks/bench_iq.py --output bench_iq.json
+"""
+
+# Add path to the lib folder
+import sys, os
+lib_path = os.path.abspath(__file__).split('/benchmarks/')[0]
+sys.path.insert(0, lib_path)
+#-------------------------------------
+
+import argparse
+import json
+import platform
+import tempfile
+from time import perf_counter
+from datetime import datetime
+
+from peacock_uvp.apf04_driver import Apf04Driver
+from peacock_uvp.apf04_iq import Apf04IQRecorder, read_iq_file, decode_iq
+from peacock_uvp.apf04_simulator import Apf04Simulator, LoopbackSerial, DEFAULT_SETTINGS
+
+F_SYS = 36e6
+ADDR_IQ = 0x1000
+
+def bench_point(_baudrate, _n_tir, _n_vol, _count, _directory):
+	""" record _count IQ blocks
+	@return dict of results
+	"""
+	simulator = Apf04Simulator(F_SYS, _addr_iq=ADDR_IQ, _size_iq=2*_n_tir*_n_vol)
+	apf = Apf04Driver(None, F_SYS, "simulator")
+	apf.ser = LoopbackSerial(simulator, _baudrate)
+	apf.addr = simulator.addr
+	apf.read_version()
+	config = apf.new_config().set(dict(DEFAULT_SETTINGS, n_ech=_n_tir, n_vol=_n_vol))
+	apf.write_config(config, 0)
+	apf.select_config(0)
+
+	path = os.path.join(_directory, "bench.iq")
+	start = perf_counter()
+	with Apf04IQRecorder(apf, config, path) as recorder:
+		recorder.record(_count)
+	elapsed = perf_counter() - start
+	block_size = 4*config.n_tir*config.n_vol
+
+	blocks = read_iq_file(path)[2]
+	start = perf_counter()
+	decode_iq(blocks["iq"], config.n_tir, config.n_vol)
+	decode_time = perf_counter() - start
+	del blocks
+
+	return {
+		"baudrate": _baudrate,
+		"n_tir": config.n_tir,
+		"n_vol": config.n_vol,
+		"count": _count,
+		"block_bytes": block_size,
+		"measure_time": config.get_bloc_duration()/config.n_avg,
+		"blocks_per_s": _count/elapsed,
+		"iq_mb_per_s": _count*block_size/elapsed/1e6,
+		# the line carries baudrate/10 bytes per second (8N1)
+		"line_usage": _count*block_size/elapsed/(_baudrate/10.),
+		"io_wait_time": recorder.io_wait_time,
+		"decode_mb_per_s": _count*block_size/decode_time/1e6,
+	}
+
+def main():
+	parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+	parser.add_argument("--baudrates", type=int, nargs="+", default=[57600, 115200, 230400, 750000])
+	parser.add_argument("--n-tir", type=int, default=64)
+	parser.add_argument("--n-vol", type=int, default=100)
+	parser.add_argument("--count", type=int, default=5, help="number of IQ blocks per baudrate")
+	parser.add_argument("--output", default="bench_iq.json")
+	args = parser.parse_args()
+
+	results = []
+	with tempfile.TemporaryDirectory() as directory:
+		for baudrate in args.baudrates:
+			result = bench_point(baudrate, args.n_tir, args.n_vol, args.count, directory)
+			results.append(result)
+			print("baudrate %6d : %6.3f MB/s IQ, %5.2f blocks/s of %d bytes, line usage %3.0f %%, decode %7.1f MB/s" \
+				%(baudrate, result["iq_mb_per_s"], result["blocks_per_s"], result["block_bytes"], \
+				100*result["line_usage"], result["decode_mb_per_s"]))
+
+	with open(args.output, "w") as output:
+		json.dump({
+			"date": datetime.utcnow().isoformat(),
+			"python": platform.python_version(),
+			"machine": platform.machine(),
+			"results": results,
+		}, output, indent=2)
+	print("results written in %s"%args.output)
+
+if __name__ == '__main__':
+	main()
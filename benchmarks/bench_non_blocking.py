@@ -0,0 +1,120 @@
+#!/usr/bin/env python
+# -*- coding: UTF_8 -*-
+
+""" Blocking versus non blocking measurements on a simulated RS485 bus.
+
+Several simulated devices share one serial line. Each cycle measures one
+profile with each device :
+
+- blocking : act_meas_profile then read_profile, one device after the other
+  (the line is held during each measurement),
+- non blocking : Apf04Bus.measure (act_start_profile on all the devices, then
+  wait_profile and read_profile in the order of the expected ends).
+
+For each point the profiles/s and the share of the cycle during which the line
+is free (neither a frame nor a blocking measurement) are reported. Results are
+written in a JSON file.
+
+With --poll-action, the end of the non blocking measurements is read in the
+devices (Apf04Driver.poll_action) instead of being taken at the expected end.
+
+run with :
+
+	python3 ./benchmarks/bench_non_blocking.py --output bench_non_blocking.json
+"""
+
+# Add path to the lib folder
+import sys, os
+lib_path = os.path.abspath(__file__).split('/benchmarks/')[0]
+sys.path.insert(0, lib_path)
+#-------------------------------------
+
+import argparse
+import json
+import platform
+from time import perf_counter
+from datetime import datetime
+
+from peacock_uvp.apf04_bus import Apf04Bus
+from peacock_uvp.apf04_simulator import Apf04Simulator, LoopbackSerial, DEFAULT_SETTINGS, frame_duration
+
+F_SYS = 36e6
+
+def bench_point(_baudrate, _n_devices, _n_vol, _n_avg, _non_blocking, _cycles, _poll_action=False):
+	""" measure _cycles profiles with each device
+	@return dict of results
+	"""
+	slave_addrs = list(range(4, 4+_n_devices))
+	line = LoopbackSerial([Apf04Simulator(F_SYS, _slave_addr=slave_addr) for slave_addr in slave_addrs], _baudrate)
+	bus = Apf04Bus("simulator", _baudrate, F_SYS, slave_addrs, line)
+	for slave_addr, device in bus.devices.items():
+		bus.configure(slave_addr, device.new_config().set(dict(DEFAULT_SETTINGS, n_vol=_n_vol, n_profile=_n_avg)))
+		device.poll_action = _poll_action
+	bloc_duration = bus.devices[4].config.get_bloc_duration()
+
+	bytes_0 = line.bytes_read + line.bytes_written
+	start = perf_counter()
+	for _ in range(_cycles):
+		if _non_blocking:
+			profiles = bus.measure()
+		else:
+			profiles = {}
+			for slave_addr, device in bus.devices.items():
+				device.act_meas_profile()
+				profiles[slave_addr] = device.read_profile(_n_vol)
+		assert len(profiles) == _n_devices
+	elapsed = perf_counter() - start
+
+	# the line is busy while the frames are transmitted, and during the blocking measurements
+	busy = frame_duration(line.bytes_read + line.bytes_written - bytes_0, _baudrate)
+	if not _non_blocking:
+		busy += _cycles*_n_devices*bloc_duration
+	return {
+		"mode": "non_blocking" if _non_blocking else "blocking",
+		"poll_action": _poll_action,
+		"baudrate": _baudrate,
+		"n_devices": _n_devices,
+		"n_vol": _n_vol,
+		"n_avg": _n_avg,
+		"cycles": _cycles,
+		"bloc_duration": bloc_duration,
+		"profiles_per_s": _cycles*_n_devices/elapsed,
+		"cycle_time": elapsed/_cycles,
+		"line_free": max(0., 1. - busy/elapsed),
+	}
+
+def main():
+	parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+	parser.add_argument("--baudrates", type=int, nargs="+", default=[115200, 750000])
+	parser.add_argument("--n-devices", type=int, nargs="+", default=[1, 2, 4])
+	parser.add_argument("--n-vol", type=int, default=120)
+	parser.add_argument("--n-avg", type=int, nargs="+", default=[1, 4])
+	parser.add_argument("--cycles", type=int, default=10, help="number of profiles per device and point")
+	parser.add_argument("--poll-action", action="store_true", help="read the end of the non blocking measurements in the devices")
+	parser.add_argument("--output", default="bench_non_blocking.json")
+	args = parser.parse_args()
+
+	results = []
+	for baudrate in args.baudrates:
+		for n_avg in args.n_avg:
+			for n_devices in args.n_devices:
+				for non_blocking in [False, True]:
+					result = bench_point(baudrate, n_devices, args.n_vol, n_avg, non_blocking, args.cycles, args.poll_action)
+					results.append(result)
+					print("baudrate %6d n_avg %2d devices %d %-12s : %6.2f profiles/s, cycle %6.1f ms (bloc %5.1f ms), line free %3.0f %%" \
+						%(baudrate, n_avg, n_devices, result["mode"], result["profiles_per_s"], 1e3*result["cycle_time"], \
+						1e3*result["bloc_duration"], 100*result["line_free"]))
+
+	with open(args.output, "w") as output:
+		json.dump({
+			"date": datetime.utcnow().isoformat(),
+			"python": platform.python_version(),
+			"machine": platform.machine(),
+			"n_vol": args.n_vol,
+			"poll_action": args.poll_action,
+			"results": results,
+		}, output, indent=2)
+	print("results written in %s"%args.output)
+
+if __name__ == '__main__':
+	main()
@@ -0,0 +1,132 @@
+#!/usr/bin/env python
+# -*- coding: UTF_8 -*-
+
+""" End to end throughput benchmark on a simulated device.
+
+Sweeps the baudrate, n_vol, n_avg and modbus segment size, and measures for
+each point the frames/s, bytes/s, the latency of each stage of a profile
+(trigger, device processing, transfer, byte swap, decode) and the CPU time
+per profile. Results are written in a JSON file.
+
+The simulated device runs in the same process, so the CPU time includes the
+simulator and the transfer latencies are the simulated line timings.
+
+run with :
+
+	python3 ./benchmarks/bench_throughput.py --count 10 --output bench_throughput.json
+"""
+
+# Add path to the lib folder
+import sys, os
+lib_path = os.path.abspath(__file__).split('/benchmarks/')[0]
+sys.path.insert(0, lib_path)
+#-------------------------------------
+
+import argparse
+import json
+import platform
+from time import perf_counter, process_time
+from datetime import datetime
+
+import numpy as np
+
+from peacock_uvp.apf04_driver import Apf04Driver
+from peacock_uvp.apf04_measures import extract_measures
+from peacock_uvp.apf04_addr_cmd import get_addr_dict
+from peacock_uvp.apf04_simulator import Apf04Simulator, LoopbackSerial, DEFAULT_SETTINGS
+
+F_SYS = 36e6
+
+def bench_point(_baudrate, _n_vol, _n_avg, _seg_size, _count, _time_scale):
+	""" measure _count profiles with the given settings
+	@return dict of results
+	"""
+	simulator = Apf04Simulator(F_SYS, _time_scale=_time_scale)
+	line = LoopbackSerial(simulator, _baudrate, _time_scale=_time_scale)
+	apf = Apf04Driver(None, F_SYS, "simulator")
+	apf.ser = line
+	apf.max_read_seg_size = _seg_size
+	apf.addr = get_addr_dict(apf.read_version()[1])
+
+	settings = dict(DEFAULT_SETTINGS, n_vol=_n_vol, n_profile=_n_avg)
+	config = apf.new_config().set(settings)
+	apf.write_config(config, 0)
+	apf.select_config(0)
+	device_time = config.get_bloc_duration()*_time_scale
+
+	stages = {"trigger": [], "transfer": [], "swap": [], "decode": []}
+	frames_0, bytes_0 = simulator.n_frames, line.bytes_read + line.bytes_written
+	start, cpu_start = perf_counter(), process_time()
+	for _ in range(_count):
+		t0 = perf_counter()
+		apf.act_meas_profile(_duration=device_time)
+		t1 = perf_counter()
+		raw, dtype = apf.read_profile(config.n_vol, _swap=False)
+		t2 = perf_counter()
+		# same in place swap as read_profile
+		data = bytearray(raw)
+		np.frombuffer(data, dtype=np.int16, offset=6).byteswap(inplace=True)
+		t3 = perf_counter()
+		extract_measures(bytes(data), config, _as_array=True)
+		t4 = perf_counter()
+		stages["trigger"].append(t1-t0)
+		stages["transfer"].append(t2-t1)
+		stages["swap"].append(t3-t2)
+		stages["decode"].append(t4-t3)
+	elapsed, cpu = perf_counter()-start, process_time()-cpu_start
+
+	frames = simulator.n_frames - frames_0
+	n_bytes = line.bytes_read + line.bytes_written - bytes_0
+	result = {
+		"baudrate": _baudrate,
+		"n_vol": _n_vol,
+		"n_avg": _n_avg,
+		"seg_size": _seg_size,
+		"count": _count,
+		"profiles_per_s": _count/elapsed,
+		"frames_per_s": frames/elapsed,
+		"bytes_per_s": n_bytes/elapsed,
+		"frames_per_profile": frames/_count,
+		"cpu_per_profile": cpu/_count,
+		# device processing is given by the configuration, the remaining part of the trigger is overhead
+		"device_processing": device_time,
+	}
+	for stage, values in stages.items():
+		result[stage] = float(np.mean(values))
+	result["trigger_overhead"] = result["trigger"] - device_time
+	return result
+
+def main():
+	parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+	parser.add_argument("--baudrates", type=int, nargs="+", default=[57600, 115200, 230400, 750000])
+	parser.add_argument("--n-vol", type=int, nargs="+", default=[30, 120, 250])
+	parser.add_argument("--n-avg", type=int, nargs="+", default=[1, 4])
+	parser.add_argument("--seg-size", type=int, nargs="+", default=[64, 125], help="number of words read per modbus frame")
+	parser.add_argument("--count", type=int, default=10, help="number of profiles per point")
+	parser.add_argument("--time-scale", type=float, default=1., help="factor applied to the simulated timings (0 : no waiting)")
+	parser.add_argument("--output", default="bench_throughput.json")
+	args = parser.parse_args()
+
+	results = []
+	for baudrate in args.baudrates:
+		for n_vol in args.n_vol:
+			for n_avg in args.n_avg:
+				for seg_size in args.seg_size:
+					result = bench_point(baudrate, n_vol, n_avg, seg_size, args.count, args.time_scale)
+					results.append(result)
+					print("baudrate %6d n_vol %3d n_avg %2d seg %3d : %6.2f profiles/s, %7.0f bytes/s, transfer %6.1f ms, decode %5.2f ms, cpu %5.2f ms/profile" \
+						%(baudrate, n_vol, n_avg, seg_size, result["profiles_per_s"], result["bytes_per_s"], \
+						1e3*result["transfer"], 1e3*result["decode"], 1e3*result["cpu_per_profile"]))
+
+	with open(args.output, "w") as output:
+		json.dump({
+			"date": datetime.utcnow().isoformat(),
+			"python": platform.python_version(),
+			"machine": platform.machine(),
+			"time_scale": args.time_scale,
+			"results": results,
+		}, output, indent=2)
+	print("results written in %s"%args.output)
+
+if __name__ == '__main__':
+	main()
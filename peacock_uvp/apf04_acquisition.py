@@ -0,0 +1,269 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# @copyright  this code is the property of Ubertone.
+# You may use this code for your personal, informational, non-commercial purpose.
+# You may not distribute, transmit, display, reproduce, publish, license, create derivative works from, transfer or sell any information, software, products or services based on this code.
+# @author Stéphane Fischer
+
+import threading
+import logging
+from time import perf_counter
+
+from .apf04_exception import apf04_exception
+
+# overflow policies of the ring buffer
+OVERFLOW_DROP_OLDEST = "drop_oldest" # the oldest profile is overwritten
+OVERFLOW_DROP_NEWEST = "drop_newest" # the new profile is discarded
+OVERFLOW_BLOCK = "block"             # the producer waits for a free slot
+
+# after an error, the acquisition waits ERROR_BACKOFF before the next measurement,
+# doubled at each consecutive error up to MAX_ERROR_BACKOFF
+ERROR_BACKOFF = 0.01
+MAX_ERROR_BACKOFF = 1.
+# number of consecutive errors stopping the acquisition
+MAX_CONSECUTIVE_ERRORS = 10
+
+class ProfileRingBuffer ():
+	""" @brief bounded ring buffer of raw profiles
+
+	The memory is allocated once (n_slots slots of slot_size bytes). The
+	buffer is thread safe (one producer, one or several consumers).
+	"""
+	def __init__(self, _n_slots, _slot_size, _overflow=OVERFLOW_DROP_OLDEST):
+		""" @brief allocate the ring buffer
+		@param _n_slots : number of profiles that can be stored
+		@param _slot_size : maximum size of a profile (in bytes)
+		@param _overflow : policy when the buffer is full (OVERFLOW_DROP_OLDEST, OVERFLOW_DROP_NEWEST or OVERFLOW_BLOCK)
+		"""
+		assert _overflow in [OVERFLOW_DROP_OLDEST, OVERFLOW_DROP_NEWEST, OVERFLOW_BLOCK]
+		self.n_slots = _n_slots
+		self.slot_size = _slot_size
+		self.overflow = _overflow
+
+		self._buf = bytearray(_n_slots*_slot_size)
+		self._view = memoryview(self._buf)
+		self._sizes = [0]*_n_slots
+		self._first = 0 # index of the oldest profile
+		self._count = 0 # number of profiles stored
+		self._closed = False
+		self._cond = threading.Condition()
+
+		# counters
+		self.pushed = 0
+		self.popped = 0
+		self.dropped = 0
+
+	def __len__(self):
+		return self._count
+
+	def push(self, _data, _timeout=None):
+		""" @brief store a profile
+		@param _data : raw profile (bytes-like)
+		@param _timeout : maximum waiting time with the OVERFLOW_BLOCK policy (None : wait forever)
+		@return True if the profile is stored, False if it is dropped
+		"""
+		size = len(_data)
+		assert size <= self.slot_size, "profile size %d is bigger than the slot size %d"%(size, self.slot_size)
+		with self._cond:
+			if self._closed:
+				self.dropped += 1
+				return False
+			if self._count == self.n_slots:
+				if self.overflow == OVERFLOW_BLOCK:
+					if not self._cond.wait_for(lambda: self._count < self.n_slots or self._closed, _timeout) or self._closed:
+						self.dropped += 1
+						return False
+				elif self.overflow == OVERFLOW_DROP_NEWEST:
+					self.dropped += 1
+					return False
+				else:
+					self._first = (self._first+1)%self.n_slots
+					self._count -= 1
+					self.dropped += 1
+
+			slot = (self._first+self._count)%self.n_slots
+			self._view[slot*self.slot_size:slot*self.slot_size+size] = _data
+			self._sizes[slot] = size
+			self._count += 1
+			self.pushed += 1
+			self._cond.notify_all()
+		return True
+
+	def pop(self, _timeout=None):
+		""" @brief get the oldest profile
+		@param _timeout : maximum waiting time (None : wait forever)
+		@return raw profile (bytes) or None if there is no profile (timeout or buffer closed)
+		"""
+		with self._cond:
+			if not self._cond.wait_for(lambda: self._count or self._closed, _timeout) or not self._count:
+				return None
+			slot = self._first
+			data = bytes(self._view[slot*self.slot_size:slot*self.slot_size+self._sizes[slot]])
+			self._first = (self._first+1)%self.n_slots
+			self._count -= 1
+			self.popped += 1
+			self._cond.notify_all()
+		return data
+
+	def close(self):
+		""" @brief wake up the waiting producer and consumers. No more profile
+		is accepted, but the profiles stored can still be read
+		"""
+		with self._cond:
+			self._closed = True
+			self._cond.notify_all()
+
+	def reopen(self):
+		""" @brief accept the profiles again after close (the profiles stored are kept)
+		"""
+		with self._cond:
+			self._closed = False
+
+
+class Apf04Acquisition ():
+	""" @brief continuous acquisition of profiles in a dedicated thread
+
+	The thread only triggers the measurements and fetches the raw profiles
+	(act_meas_profile + read_profile), which are pushed in a ring buffer.
+	The profiles are consumed either by iterating on the instance, or by a
+	callback called from another thread.
+
+	The configuration must already be written and selected in the device.
+	"""
+	def __init__(self, _driver, _config, _n_slots=64, _overflow=OVERFLOW_DROP_OLDEST, _callback=None, _max_errors=MAX_CONSECUTIVE_ERRORS):
+		""" @brief create the acquisition engine
+		@param _driver : Apf04Driver instance (connected, with its address dict)
+		@param _config : ConfigHw of the selected configuration
+		@param _n_slots : number of profiles in the ring buffer
+		@param _overflow : overflow policy of the ring buffer
+		@param _callback : function called with each raw profile (in a dedicated thread)
+		@param _max_errors : number of consecutive errors (apf04_exception) stopping the acquisition
+		  (None : never stopped)
+		"""
+		self.driver = _driver
+		self.config = _config
+		# timestamp (3 words) + header + cells
+		slot_size = 2*(3 + _driver.addr["SIZE_PROFILE_HEADER"] + 4*_config.n_vol)
+		self.ring = ProfileRingBuffer(_n_slots, slot_size, _overflow)
+		self.callback = _callback
+
+		self.max_errors = _max_errors
+		self.errors = 0
+		self.consecutive_errors = 0
+		self.error = None # exception which stopped the acquisition
+		# time spent by the acquisition thread in each step (in seconds)
+		self.trigger_time = 0. # act_meas_profile (device measuring)
+		self.fetch_time = 0.   # read_profile (transfer)
+		self.io_idle_time = 0. # waiting for a free slot in the ring buffer
+		self.backoff_time = 0. # waiting after the errors
+		self.start_time = None
+		self.stop_time = None
+		self._running = threading.Event()
+		self._stopping = threading.Event()
+		self._threads = []
+
+	@property
+	def acquired(self):
+		""" @brief number of profiles fetched from the device """
+		return self.ring.pushed
+
+	@property
+	def dropped(self):
+		""" @brief number of profiles lost because of an overflow """
+		return self.ring.dropped
+
+	@property
+	def running(self):
+		return self._running.is_set()
+
+	def start(self):
+		""" @brief start the acquisition thread (and the callback thread if any)
+		An acquisition stopped can be started again, the counters go on.
+		"""
+		assert not self._threads, "acquisition already started"
+		self.ring.reopen()
+		self.start_time = perf_counter()
+		self.stop_time = None
+		self.consecutive_errors = 0
+		self.error = None
+		self._stopping.clear()
+		self._running.set()
+		self._threads.append(threading.Thread(target=self._acquire, name="apf04_acquisition", daemon=True))
+		if self.callback:
+			self._threads.append(threading.Thread(target=self._dispatch, name="apf04_dispatch", daemon=True))
+		for thread in self._threads:
+			thread.start()
+
+	def stop(self):
+		""" @brief stop the acquisition, the profiles already stored can still be read
+		(a profile being fetched while stopping is counted as dropped)
+		"""
+		self._running.clear()
+		# release the acquisition thread if it waits for a free slot or after an error
+		self._stopping.set()
+		self.ring.close()
+		for thread in self._threads:
+			thread.join()
+		self._threads = []
+		self.stop_time = perf_counter()
+
+	@property
+	def elapsed(self):
+		""" @brief duration of the acquisition (in seconds) """
+		if self.start_time is None:
+			return 0.
+		return (self.stop_time or perf_counter()) - self.start_time
+
+	def __enter__(self):
+		self.start()
+		return self
+
+	def __exit__(self, *args):
+		self.stop()
+
+	def __iter__(self):
+		""" @brief iterate on the raw profiles, until the acquisition is stopped and the buffer is empty
+		"""
+		while True:
+			data = self.ring.pop()
+			if data is None:
+				return
+			yield data
+
+	def _acquire(self):
+		n_vol = self.config.n_vol
+		try:
+			while self._running.is_set():
+				try:
+					t0 = perf_counter()
+					self.driver.act_meas_profile()
+					t1 = perf_counter()
+					data = self.driver.read_profile(n_vol)
+					t2 = perf_counter()
+				except apf04_exception as ae:
+					# occasional error (timeout ...), the acquisition goes on after a while
+					self.errors += 1
+					self.consecutive_errors += 1
+					if self.max_errors is not None and self.consecutive_errors >= self.max_errors:
+						raise
+					logging.info("acquisition: %s", ae)
+					t0 = perf_counter()
+					self._stopping.wait(min(ERROR_BACKOFF*2**(self.consecutive_errors-1), MAX_ERROR_BACKOFF))
+					self.backoff_time += perf_counter()-t0
+					continue
+				self.consecutive_errors = 0
+				self.ring.push(data)
+				self.trigger_time += t1-t0
+				self.fetch_time += t2-t1
+				self.io_idle_time += perf_counter()-t2
+		except Exception as e:
+			logging.error("acquisition stopped: %s", e)
+			self.error = e
+		finally:
+			self._running.clear()
+			self.ring.close()
+
+	def _dispatch(self):
+		for data in self:
+			self.callback(data)
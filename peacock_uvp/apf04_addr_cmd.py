@@ -9,7 +9,8 @@
 import os
 import json
 import logging
-logging.basicConfig(level=logging.DEBUG)
+from collections.abc import Mapping
+from functools import lru_cache
 
 ## Adresses et commandes de l'APF04
 
@@ -36,6 +37,17 @@ CMD_TEST_LED = 190
 # numéro de commande pour une mesure de température + pitch + roll 
 CMD_TEST_I2C = 195 
 
+# maximum processing time (in seconds) of the actions other than the profile measurements,
+# added to the answer time of the modbus frame (a profile measurement lasts ConfigHw.get_bloc_duration).
+# These are the timeouts of the first versions of the driver : upper bounds, not measured durations.
+# They can be changed for a driver instance (Apf04Driver.action_timeout).
+ACTION_TIMEOUT = {
+    CMD_STOP : 5.0,
+    CMD_CHECK_CONFIG : 0.2,
+    CMD_TEST_LED : 1.5,
+    CMD_TEST_I2C : 2.0,
+}
+
 # ces 5 adresses sont considérées comme fixes et qui ne changeront jamais.
 ADDR_ACTION = 0xFFFD
 
@@ -44,52 +56,96 @@ ADDR_VERSION_VHDL = 0xFFFE
 ADDR_MODEL_YEAR   = 0x0001
 ADDR_SERIAL_NUM   = 0x0002
 
+class AddrMap(Mapping):
+    """
+    Immutable address map of a firmware version.
+
+    The addresses are integers, available as attributes (addr.ADDR_CONFIG)
+    or as keys (addr["ADDR_CONFIG"]).
+    """
+
+    __slots__ = ("_addr",)
+
+    def __init__(self, addr_dict):
+        object.__setattr__(self, "_addr", {key: int(value, 16) if isinstance(value, str) and "x" in value else value
+            for key, value in addr_dict.items()})
+
+    def __getitem__(self, key):
+        return self._addr[key]
+
+    def __getattr__(self, key):
+        # _addr is not set yet when copy and pickle look for their hooks on a new instance
+        if key.startswith("_"):
+            raise AttributeError(key)
+        try:
+            return self._addr[key]
+        except KeyError:
+            raise AttributeError(key)
+
+    def __setattr__(self, key, value):
+        raise AttributeError("address map is read-only")
+
+    def __iter__(self):
+        return iter(self._addr)
+
+    def __len__(self):
+        return len(self._addr)
+
+    def __hash__(self):
+        return hash(tuple(self._addr.items()))
+
+    def __repr__(self):
+        return "AddrMap(%s)"%self._addr
+
+    def __reduce__(self):
+        return (AddrMap, (self._addr,))
+
+    def replace(self, **addresses):
+        """
+        Creates a new map with some addresses added or changed.
+        """
+        return AddrMap({**self._addr, **addresses})
+
+
+ADDR_JSON_DIR = os.path.dirname(os.path.abspath(__file__))
+
+@lru_cache(maxsize=None)
+def _load_addr_json(addr_json):
+    if not os.path.isfile(addr_json):
+        # TODO mb 20/10/2021 choisir si on veut mettre un comportement par défaut ou fonctionner par exception
+        logging.debug("WARNING: Unknown Addresses for this S-Firmware version.")
+        return None
+    with open(addr_json) as json_file:
+        addr_map = AddrMap(json.loads(json_file.read()))
+    logging.debug("addr json: %s", addr_json)
+    logging.debug("addr map: %s", addr_map)
+    return addr_map
+
+@lru_cache(maxsize=None)
 def get_addr_dict(version_c, addr_json=None):
     """
     Gets the addresses in RAM given the firmware version.
 
+    The json file of a version is read only once, the same map is returned by the next calls.
+
     Args:
         version_c: two digits number version
         addr_json: possible to give directly a json file
 
     Returns:
-        Dictionnary with the addresses names as keys and addresses in hexa as values.
+        Immutable map (AddrMap) with the addresses names as keys and addresses as integer values,
+        None if the version is unknown.
     """
 
     version_c = int(version_c)
 
-    if addr_json:
-        with open(addr_json) as json_file:
-            addr_dict = json.loads(json_file.read())
-    else:
+    if not addr_json:
         if version_c <= 52 and version_c >= 47:
-            addr_json = os.path.abspath(__file__).split('/peacock_uvp/')[0] + "/peacock_uvp/addr_S-Firmware-47.json"
+            addr_json = os.path.join(ADDR_JSON_DIR, "addr_S-Firmware-47.json")
         else:
-            addr_json = os.path.abspath(__file__).split('/peacock_uvp/')[0] + "/peacock_uvp/addr_S-Firmware-"+str(version_c)+".json"
-        if addr_json.split("/")[-1] in os.listdir(os.path.abspath(__file__).split('/peacock_uvp/')[0] + "/peacock_uvp/"):
-            with open(addr_json) as json_file:
-                addr_dict = json.loads(json_file.read())
-        else:
-            # TODO mb 20/10/2021 choisir si on veut mettre un comportement par défaut ou fonctionner par exception
-            logging.debug("WARNING: Unknown Addresses for this S-Firmware version.")
-            addr_dict = None
-    
-    logging.debug(os.listdir("."))
-    logging.debug("addr json: %s"%addr_json)
-    logging.debug("addr dict: %s"%addr_dict)
-
-    print(addr_dict)
-
-    # conversion of haxa strings to hexa number
-    if addr_dict:
-        for key,value in addr_dict.items():
-            if isinstance(value, str):
-                if "x" in value:
-                    addr_dict.update({key:int(value, 16)})
-
-    logging.debug("addr dict converted: %s"%addr_dict)
-
-    return addr_dict
+            addr_json = os.path.join(ADDR_JSON_DIR, "addr_S-Firmware-"+str(version_c)+".json")
+
+    return _load_addr_json(os.path.abspath(addr_json))
 
 # ===============================================
 # DESCRIPTION OF AVAILABLE ADDRESSES IN THE DICT:
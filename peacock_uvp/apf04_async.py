@@ -0,0 +1,422 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# @copyright  this code is the property of Ubertone.
+# You may use this code for your personal, informational, non-commercial purpose.
+# You may not distribute, transmit, display, reproduce, publish, license, create derivative works from, transfer or sell any information, software, products or services based on this code.
+# @author Stéphane Fischer
+
+import asyncio
+import struct
+import logging
+from datetime import datetime
+
+from .apf04_exception import apf04_error, apf04_exception
+from .apf04_modbus import build_read_query, build_write_query, DEFAULT_TIMEOUT, DEFAULT_LATENCY
+from .apf04_driver import Apf04DriverBase
+from .apf04_read_plan import plan_reads
+from .modbus_crc import crc16
+from .apf04_addr_cmd import *
+from .apf04_config_hw import ConfigHw
+
+# after a timeout, the rest of a late answer is discarded : it is waited for DRAIN_TIMEOUT,
+# then read until the line is silent for DRAIN_SILENCE
+DRAIN_TIMEOUT = 0.1
+DRAIN_SILENCE = 0.01
+
+class MemoryStreamWriter ():
+	""" @brief in-memory transport : each frame written is given to a handler
+	and its answer is fed to the associated StreamReader.
+
+	Used to run the asyncio layer without hardware (e.g. with a simulated device).
+	"""
+	def __init__(self, _reader, _handler, _delay=0.):
+		self.reader = _reader
+		self.handler = _handler
+		self.delay = _delay
+
+	def write(self, _frame):
+		answer = self.handler(bytes(_frame))
+		if not answer:
+			return
+		# the handler may return (answer, delay of the answer in seconds)
+		delay = self.delay
+		if isinstance(answer, tuple):
+			answer, delay = answer
+		if delay:
+			asyncio.get_running_loop().call_later(delay, self.reader.feed_data, answer)
+		else:
+			self.reader.feed_data(answer)
+
+	async def drain(self):
+		pass
+
+	def close(self):
+		self.reader.feed_eof()
+
+	async def wait_closed(self):
+		pass
+
+def open_memory_connection(_handler, _delay=0.):
+	""" @brief create an in-memory (reader, writer) pair
+	@param _handler : function called with each frame written, returning the answer (bytes or None),
+	  or (answer, delay) to delay this answer
+	@param _delay : delay of the answers (in seconds)
+	"""
+	reader = asyncio.StreamReader()
+	return reader, MemoryStreamWriter(reader, _handler, _delay)
+
+async def open_serial_connection(_dev, _baudrate):
+	""" @brief create a (reader, writer) pair on a serial port (requires pyserial-asyncio)
+	@param _dev : serial port (e.g. /dev/ttyUSB0)
+	@param _baudrate : communication speed
+	"""
+	try:
+		import serial_asyncio
+	except ImportError:
+		raise apf04_error(1006, "pyserial-asyncio is needed to open a serial port with asyncio.")
+	return await serial_asyncio.open_serial_connection(url=_dev, baudrate=_baudrate, \
+		bytesize=8, parity='N', stopbits=1, xonxoff=0, rtscts=0)
+
+
+class Apf04AsyncModbus ():
+	"""	@brief Modbus communication layer (asyncio)
+
+	Same protocol as Apf04Modbus, on any asyncio (reader, writer) pair. Several
+	instances (one per device) can be driven concurrently by a single event loop.
+	The transactions of an instance are serialized.
+	"""
+	def __init__(self, _reader, _writer, _slave_addr=0x04, _baudrate=None):
+		""" @brief Initialisation of the communication layer
+		@param _reader : asyncio.StreamReader (or any object with an async readexactly method)
+		@param _writer : asyncio.StreamWriter (or any object with write and async drain methods)
+		@param _slave_addr : modbus address of the device
+		@param _baudrate : communication speed, to know when the answers are expected
+		  (None for an in-memory transport)
+		"""
+		self.reader = _reader
+		self.writer = _writer
+		self.apf04_addr = _slave_addr
+		self.baudrate = _baudrate
+		# answer latency allowed for each read (see Apf04Modbus)
+		self.latency = DEFAULT_LATENCY
+		# Modbus limite les blocs à un maximum de 123 mots en ecriture et 125 mots en lecture
+		self.max_seg_size = 123
+		self.max_read_seg_size = 125
+		self._lock = asyncio.Lock()
+
+	async def close(self):
+		self.writer.close()
+		await self.writer.wait_closed()
+
+	def frame_time(self, _n_bytes):
+		""" @brief transmission time of bytes on the serial line (8N1 : 10 bits per byte)
+		"""
+		return 10.*_n_bytes/self.baudrate if self.baudrate else 0.
+
+	async def _read(self, _size, _timeout=0.0, _start=None):
+		""" @brief Low level read method
+		@param _size number of bytes to read
+		@param _timeout additional time allowed to the device to answer
+		@param _start expected time (loop time) of the first byte, now by default
+
+		The answer is expected at _start plus its transmission time at the baudrate. It
+		fails at this time plus the latency (self.latency) and _timeout (see Apf04Modbus).
+		"""
+		now = asyncio.get_running_loop().time()
+		expected_end = (now if _start is None else _start) + self.frame_time(_size)
+		try:
+			return await asyncio.wait_for(self.reader.readexactly(_size), \
+				max(now, expected_end) - now + self.latency + _timeout)
+		except asyncio.TimeoutError:
+			logging.debug("WARNING timeout, no answer from device")
+			# the answer received later would be taken as the answer of the next request
+			await self._drain()
+			raise apf04_exception(2003, "timeout : device do not answer (please check cable connexion, timeout or baudrate)")
+		except asyncio.IncompleteReadError as e:
+			raise apf04_error(1010, "Hardware apparently disconnected (%d/%d)."%(len(e.partial), _size))
+
+	async def _drain(self):
+		""" @brief discard the bytes received (partial answer, late answer) until the line is silent
+		"""
+		read = getattr(self.reader, "read", None)
+		timeout = DRAIN_TIMEOUT
+		# a device which does not stop sending is not waited for more than DEFAULT_TIMEOUT
+		deadline = asyncio.get_running_loop().time() + DEFAULT_TIMEOUT
+		while asyncio.get_running_loop().time() < deadline:
+			try:
+				if read is not None:
+					data = await asyncio.wait_for(read(256), timeout)
+				else:
+					data = await asyncio.wait_for(self.reader.readexactly(1), timeout)
+			except (asyncio.TimeoutError, asyncio.IncompleteReadError):
+				return
+			if not data:
+				# end of stream
+				return
+			logging.debug("discarding %d bytes", len(data))
+			timeout = DRAIN_SILENCE
+
+	async def _send(self, _frame):
+		""" @brief send a request
+		@return expected time (loop time) of the first byte of the answer
+		"""
+		sent = asyncio.get_running_loop().time()
+		self.writer.write(_frame)
+		await self.writer.drain()
+		return sent + self.frame_time(len(_frame))
+
+	############## Read functions ###############################################
+
+	async def read_i16 (self, _addr):
+		""" @brief Read one word (signed 16 bits)
+		@param _addr : data address (given in bytes)
+		@return : integer
+		"""
+		return struct.unpack(">h", await self.read_seg_16(_addr, 1))[0]
+
+	async def read_list_i16(self, _addr, _size):
+		""" @brief Read several words (signed 16 bits)
+		@param _addr : data address (given in bytes)
+		@param _size : number of word to read
+		@return : list of integers
+		"""
+		return struct.unpack(">%dh"%_size, await self.read_buf_i16(_addr, _size))
+
+	async def read_seg_16(self, _addr, _size):
+		""" @brief Low level read (in a single modbus frame)
+		@param _addr : data address (given in bytes)
+		@param _size : number of word to read
+		@return : byte array
+		"""
+		assert (_size <= self.max_read_seg_size)
+		async with self._lock:
+			start = await self._send(build_read_query(self.apf04_addr, _addr, _size))
+			head = await self._read(3, _start=start)
+			if head[1] & 0x80:
+				# exception answer : exception code + crc
+				await self._read(2)
+				raise apf04_exception(2006, "device answered with exception code %d"%head[2])
+			if head[1] != 3 or head[2] != 2*_size:
+				logging.info("WARNING error while reading %s", head)
+				await self._read(head[2]+2)
+				raise apf04_exception(2005, "unexpected answer from device (function %d, %d bytes)"%(head[1], head[2]))
+			answer = await self._read(2*_size+2)
+
+		assert (crc16(head + answer[:-2]) == struct.unpack(">H", answer[-2:])[0])
+		return answer[:-2]
+
+	async def read_buf_i16 (self, _addr, _size):
+		""" @brief Read buffer
+		@param _addr : data address (given in bytes)
+		@param _size : number of word to read
+		@return : byte array
+
+		Note : data are transmitted in big endian
+		"""
+		data = bytearray(2*_size)
+		offset = 0
+		while offset < 2*_size:
+			seg_size = min(_size - offset//2, self.max_read_seg_size)
+			data[offset:offset+2*seg_size] = await self.read_seg_16(_addr + offset//2, seg_size)
+			offset += 2*seg_size
+		return bytes(data)
+
+	############## Write functions ##############################################
+
+	async def write_i16 (self, _value, _addr, _timeout=0.0, _delay=0.0):
+		""" @brief Write one word (signed 16 bits)
+		@param _value : value of the word
+		@param _addr : destination data address (given in bytes)
+		@param _timeout : additional time allowed to the device to answer
+		@param _delay : expected processing time of the device before its answer (e.g. action)
+		"""
+		await self.write_buf_i16([_value], _addr, _timeout, _delay)
+
+	async def write_buf_i16 (self, _data, _addr, _timeout=0.0, _delay=0.0):
+		""" @brief Write buffer
+		@param _data : list of words (max size : 123 words)
+		@param _addr : data address (given in bytes)
+		@param _timeout : additional time allowed to the device to answer
+		@param _delay : expected processing time of the device before its answer (e.g. action)
+		"""
+		assert (len(_data)<=self.max_seg_size)
+		async with self._lock:
+			start = await self._send(build_write_query(self.apf04_addr, _addr, _data))
+			slave_response = await self._read(2, _timeout, start+_delay)
+			if slave_response[1] == 16:
+				await self._read(6)
+			else:
+				# exception answer : exception code + crc
+				code = (await self._read(3))[0]
+				raise apf04_exception(3002, "write_buf_i16 : device answered with exception code %d"%code)
+
+
+class Apf04AsyncDriver (Apf04AsyncModbus, Apf04DriverBase):
+	""" @brief APF04 instrument (asyncio)
+
+	Same actions as Apf04Driver, with the same shadow of the settings and the same
+	processing times (see Apf04DriverBase). While a device measures (act_meas_profile),
+	the event loop can drive other devices.
+	"""
+	def __init__(self, _reader, _writer, _f_sys, _addr_dict=None, _slave_addr=0x04, _baudrate=None):
+		self._init_driver(_f_sys, _addr_dict)
+		Apf04AsyncModbus.__init__(self, _reader, _writer, _slave_addr, _baudrate)
+
+	@classmethod
+	async def open(cls, _dev, _baudrate, _f_sys, _addr_dict=None, _slave_addr=0x04):
+		""" @brief create a driver on a serial port (requires pyserial-asyncio)
+		"""
+		reader, writer = await open_serial_connection(_dev, _baudrate)
+		return cls(reader, writer, _f_sys, _addr_dict, _slave_addr, _baudrate)
+
+	async def read_config (self, _id_config=0, _cached=False):
+		""" @brief read the parameters of a configuration
+		    @param _id_config : configuration id [0..2]
+		    @param _cached : if True, the parameters are taken from the shadow when they are known
+		"""
+		self.config = ConfigHw(self.f_sys)
+		self.config.id_config = _id_config
+		addr = self.config_addr(_id_config)
+		if _cached:
+			words = await self.read_cached(addr, self.addr.SIZE_CONFIG)
+		else:
+			words = list(await self.read_list_i16(addr, self.addr.SIZE_CONFIG))
+			self.shadow.update(addr, words)
+		self.config.from_list(words)
+		return self.config
+
+	async def write_config (self, _config, _id_config):
+		""" @brief write the parameters of a configuration
+		    @param _config : configuration (ConfigHw)
+		    @param _id_config : configuration id [0..2]
+		"""
+		await self.write_cached(_config.to_list(), self.config_addr(_id_config))
+
+	async def select_config (self, _id_config):
+		await self.write_cached([_id_config], self.addr.ADDR_CONFIG_ID)
+
+	async def read_version (self):
+		""" @brief read the C and VHDL versions
+		"""
+		return self.set_versions(await self.read_registers({"vhdl":ADDR_VERSION_VHDL, "c":ADDR_VERSION_C, \
+			"model_year":ADDR_MODEL_YEAR, "serial_num":ADDR_SERIAL_NUM}))
+
+	async def write_sound_speed (self, sound_speed=1480, sound_speed_auto=False):
+		""" @brief Writing of the sound speed global parameter in RAM
+		"""
+		for data, addr in self.sound_speed_words(sound_speed, sound_speed_auto):
+			await self.write_cached(data, addr)
+
+	############## Shadow of the settings ######################################
+
+	async def write_buf_i16 (self, _data, _addr, _timeout=0.0, _delay=0.0):
+		""" @brief Write buffer (see Apf04AsyncModbus.write_buf_i16), the shadow is updated
+		"""
+		try:
+			await Apf04AsyncModbus.write_buf_i16(self, _data, _addr, _timeout, _delay)
+		except:
+			# the words may or may not have been written
+			self.shadow.invalidate(_addr, len(_data))
+			raise
+		self.shadow_written(_data, _addr)
+
+	async def write_cached (self, _data, _addr):
+		""" @brief write only the words which differ from the shadow (see Apf04Driver.write_cached)
+		"""
+		runs = self.shadow.diff(_addr, _data, _max_size=self.max_seg_size)
+		for offset, size in runs:
+			await self.write_buf_i16(_data[offset:offset+size], _addr+offset)
+		return len(runs)
+
+	async def read_cached (self, _addr, _size):
+		""" @brief read words from the shadow, or from the device if one of them is unknown (see Apf04Driver.read_cached)
+		"""
+		data = self.shadow.get(_addr, _size)
+		if data is None:
+			data = list(await self.read_list_i16(_addr, _size))
+			self.shadow.update(_addr, data)
+		return data
+
+	async def read_registers (self, _registers):
+		""" @brief read several registers with the fewest modbus frames (see Apf04Driver.read_registers)
+		"""
+		registers = {name: self.addr[register] if isinstance(register, str) else register \
+			for name, register in _registers.items()}
+		values = {}
+		for addr, size, names in plan_reads(registers, _max_words=self.max_read_seg_size):
+			words = struct.unpack(">%dh"%size, await self.read_seg_16(addr, size))
+			for name, offset, n_words in names:
+				values[name] = words[offset] if n_words == 1 else words[offset:offset+n_words]
+		return values
+
+	############## Actions ######################################################
+
+	async def _action_cmd(self, _cmd, _timeout=None, _delay=None):
+		""" @brief generic action function (see Apf04Driver.__action_cmd__)
+		@param _delay : expected processing time (a measurement), None if it is not known
+		@param _timeout : additional time allowed (see action_margin by default)
+		"""
+		if _timeout is None:
+			_timeout = self.action_margin(_cmd, _delay)
+		try:
+			await self.write_i16(_cmd, ADDR_ACTION, _timeout, _delay or 0.)
+		except apf04_exception as ae:
+			logging.info("apf04_exception catched with command %s with timeout %e", _cmd, _timeout)
+			raise ae
+		if _cmd == CMD_INIT_SETTINGS:
+			# the settings are reset by the device
+			self.shadow.invalidate()
+
+	async def act_stop (self):
+		await self._action_cmd(CMD_STOP, self.stop_timeout())
+
+	async def act_meas_I2C (self):
+		await self._action_cmd(CMD_TEST_I2C)
+
+	async def act_test_led (self):
+		await self._action_cmd(CMD_TEST_LED)
+
+	async def act_meas_IQ (self):
+		duration = self.iq_duration()
+		self.timestamp_iq = datetime.utcnow()
+		await self._action_cmd(CMD_PROFILE_IQ, _delay=duration)
+
+	async def act_meas_profile (self, _timeout=None, _duration=None):
+		""" @brief start to measure a block of profils (see Apf04Driver.act_meas_profile)
+		    @param _timeout additional delay allowed to the board, beyond the block duration
+		      of the selected configuration (by default, see answer_margin)
+		    @param _duration expected duration of the block (by default, from the selected configuration)
+		"""
+		delay = self.bloc_duration() if _duration is None else _duration
+		self.timestamp_profile = datetime.utcnow()
+		await self._action_cmd(CMD_PROFILE_BLOCKING, _timeout, delay)
+
+	async def act_check_config (self):
+		await self._action_cmd(CMD_CHECK_CONFIG)
+		self.shadow_checked()
+
+	async def act_start_auto_mode (self):
+		await self._action_cmd(CMD_START_AUTO)
+
+	async def read_temp (self):
+		return await self.read_i16(self.addr.ADDR_TEMP_MOY)
+
+	async def read_pitch (self):
+		return await self.read_i16(self.addr.ADDR_TANGAGE)
+
+	async def read_roll (self):
+		return await self.read_i16(self.addr.ADDR_ROULIS)
+
+	async def read_sensors (self):
+		""" @brief read pitch, roll and temperature (in a single modbus frame)
+		@return dict "pitch", "roll", "temp"
+		"""
+		return await self.read_registers({"pitch":"ADDR_TANGAGE", "roll":"ADDR_ROULIS", "temp":"ADDR_TEMP_MOY"})
+
+	async def read_profile (self, _n_vol, _swap=True):
+		""" @brief read the profile measured by act_meas_profile (same format as Apf04Driver.read_profile)
+		"""
+		data, offset, size = self.profile_buffer(_n_vol)
+		data[offset:] = await self.read_buf_i16(self.addr.ADDR_PROFILE_HEADER, size)
+		return self.decode_profile(data, offset, _n_vol, _swap)
@@ -0,0 +1,228 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# @copyright  this code is the property of Ubertone.
+# You may use this code for your personal, informational, non-commercial purpose.
+# You may not distribute, transmit, display, reproduce, publish, license, create derivative works from, transfer or sell any information, software, products or services based on this code.
+# @author Stéphane Fischer
+
+import struct
+import logging
+from datetime import datetime, timedelta
+from time import perf_counter, sleep
+
+import numpy as np
+
+from .apf04_exception import apf04_exception
+from .apf04_driver import PROFILE_POLL_PERIOD
+from .apf04_read_plan import MAX_READ_WORDS, DEFAULT_MAX_GAP
+from .apf_timestamp import encode_timestamp
+
+# modbus bytes of a read frame : query, then answer without the data
+READ_FRAME_BYTES = 8 + 5
+# reads of a profile which changed while it was read, before giving up
+MAX_READ_ATTEMPTS = 3
+
+class Apf04AutoStream ():
+	""" @brief consumer of the profiles measured continuously by the device (auto mode)
+
+	In auto mode (CMD_START_AUTO) the device measures the blocks of profiles one
+	after the other, each profile overwriting the previous one in the RAM. The
+	stream reads the device at the expected end of each block and yields each
+	profile once (same format as Apf04Driver.read_profile), without any trigger.
+
+	A new profile is recognized by the sequence register of the firmware
+	(ADDR_PROFILE_COUNT in the address dict) if there is one, read in the first
+	frame of the profile when it is close enough. Otherwise a profile is new if
+	its content changed : two consecutive profiles with the same content are
+	seen as one (read_next then ends with the timeout 2007). The profiles
+	overwritten before being read are counted in missed (from the sequence
+	register, or from the time elapsed).
+
+	A profile of several frames can be overwritten while it is read. The
+	sequence register (or the profile header without it) is read again after
+	the last frame, and the profile is read again if it changed. Without
+	sequence register, a new block with the same header is not detected.
+	Reading a profile must be faster than a block (apf04_exception 2008).
+
+	The timestamp of a profile is the estimated start of its block.
+	"""
+	def __init__(self, _driver, _config, _max_gap=DEFAULT_MAX_GAP):
+		""" @brief create the stream
+		@param _driver : Apf04Driver instance (connected, with its address dict)
+		@param _config : ConfigHw of the selected configuration
+		@param _max_gap : maximum number of unused words read to get the sequence register with the profile
+		"""
+		self.driver = _driver
+		self.config = _config
+		self.period = _config.get_bloc_duration()
+		addr = _driver.addr
+		self.profile_addr = addr.ADDR_PROFILE_HEADER
+		self.profile_size = addr.SIZE_PROFILE_HEADER + 4*_config.n_vol
+		self.sequence_addr = addr.get("ADDR_PROFILE_COUNT")
+
+		# words read at each poll : the profile, with the sequence register if it does not cost a frame
+		# (the sequence register must be in the first frame, read before the rest of the profile)
+		self.read_addr, self.read_size = self.profile_addr, self.profile_size
+		self.sequence_apart = False
+		if self.sequence_addr is not None:
+			if self.sequence_addr < self.profile_addr and self.profile_addr-self.sequence_addr-1 <= _max_gap \
+					and -(-(self.profile_size+self.profile_addr-self.sequence_addr)//MAX_READ_WORDS) == -(-self.profile_size//MAX_READ_WORDS):
+				self.read_addr, self.read_size = self.sequence_addr, self.profile_size+self.profile_addr-self.sequence_addr
+			else:
+				self.sequence_apart = True
+		self._buf = bytearray(2*self.read_size)
+		self._profile = memoryview(self._buf)[2*(self.profile_addr-self.read_addr):][:2*self.profile_size]
+		self._header = self._profile[:2*addr.SIZE_PROFILE_HEADER]
+		self._header_after = bytearray(len(self._header))
+		# a single frame is answered from one block : nothing to check
+		self.n_frames = -(-self.read_size//MAX_READ_WORDS)
+
+		# words transferred for each profile (with the check after the last frame)
+		self.read_duration = _driver.frame_time(self.n_frames*READ_FRAME_BYTES + 2*self.read_size)
+		if self.n_frames > 1:
+			check_size = 1 if self.sequence_addr is not None else addr.SIZE_PROFILE_HEADER
+			self.read_duration += _driver.frame_time(READ_FRAME_BYTES + 2*check_size)
+		if self.sequence_apart:
+			self.read_duration += _driver.frame_time(READ_FRAME_BYTES + 2)
+		if self.read_duration >= self.period:
+			raise apf04_exception(2008, "auto mode : reading a profile (%.1f ms) takes longer than a block (%.1f ms)" \
+				%(1e3*self.read_duration, 1e3*self.period))
+
+		# counters
+		self.received = 0
+		self.missed = 0
+		self.polls = 0 # reads without a new profile
+		self.rereads = 0 # profiles read again (overwritten while they were read)
+		self._next = None # expected end of the block (perf_counter)
+		self._last = None # sequence number or content of the last profile
+
+	def start (self):
+		""" @brief start the auto mode of the device
+		"""
+		# the profile in the RAM before the start is not new
+		self._last = self._read_sequence() if self.sequence_addr is not None else self._read_content()
+		self.driver.act_start_auto_mode()
+		self._next = perf_counter() + self.period
+
+	def stop (self):
+		""" @brief stop the auto mode (the block in progress is finished first)
+		"""
+		self._next = None
+		self.driver.act_stop()
+
+	def __enter__(self):
+		self.start()
+		return self
+
+	def __exit__(self, *args):
+		self.stop()
+
+	def __iter__(self):
+		""" @brief iterate on the new raw profiles, until the stream is stopped
+		"""
+		while self._next is not None:
+			yield self.read_next()
+
+	def read_next (self, _timeout=None):
+		""" @brief wait for the next profile
+		@param _timeout : additional delay allowed to the device, beyond the expected end of the block
+		  (by default, see Apf04Driver.answer_margin)
+		@return raw profile (see Apf04Driver.read_profile)
+		"""
+		if _timeout is None:
+			_timeout = self.driver.answer_margin(self.period)
+		deadline = self._next + self.driver.latency + _timeout
+		polled = False
+		while True:
+			now = perf_counter()
+			if now < self._next:
+				sleep(self._next - now)
+			read_time = perf_counter()
+			missed = self._poll(read_time)
+			if missed is not None:
+				break
+			polled = True
+			self.polls += 1
+			now = perf_counter()
+			if now >= deadline:
+				raise apf04_exception(2007, "timeout : no new profile in auto mode")
+			sleep(min(max(PROFILE_POLL_PERIOD, 0.1*(now-self._next)), deadline - now))
+
+		if polled:
+			# the block ended later than expected : the next ones are expected from now
+			self._next = read_time
+		self._next += missed*self.period
+		if missed:
+			logging.info("auto mode: %d profile(s) missed", missed)
+		self.missed += missed
+		self.received += 1
+		# start of the block of the profile
+		timestamp = datetime.utcnow() - timedelta(seconds=perf_counter()-self._next+self.period)
+		self._next += self.period
+		return self._profile_data(timestamp)
+
+	def _poll (self, _read_time):
+		""" @brief read the device
+		@return number of profiles missed if a new profile was read, None otherwise
+		"""
+		for _ in range(MAX_READ_ATTEMPTS):
+			start = perf_counter()
+			if self.sequence_apart:
+				sequence = self._read_sequence()
+				if sequence == self._last:
+					return None
+			self.driver.read_buf_i16_into(self.read_addr, self.read_size, self._buf)
+			if self.sequence_addr is None:
+				if self._profile == self._last:
+					return None
+			elif not self.sequence_apart:
+				sequence = struct.unpack_from(">H", self._buf, 0)[0]
+				if sequence == self._last:
+					return None
+			if self._unchanged(sequence if self.sequence_addr is not None else None):
+				break
+			# a block ended while the frames were read : they may come from two blocks
+			if perf_counter() - start >= self.period:
+				raise apf04_exception(2008, "auto mode : reading a profile (%.1f ms) takes longer than a block (%.1f ms)" \
+					%(1e3*(perf_counter() - start), 1e3*self.period))
+			logging.debug("auto mode: profile overwritten while read")
+			self.rereads += 1
+		else:
+			raise apf04_exception(2008, "auto mode : profile overwritten during each read")
+
+		if self.sequence_addr is None:
+			self._last = bytes(self._profile)
+			# the blocks ended between the expected end and the read
+			return max(0, int((_read_time-self._next)/self.period))
+		missed = (sequence-self._last-1) & 0xFFFF
+		self._last = sequence
+		return missed
+
+	def _unchanged (self, _sequence):
+		""" @brief check that no block ended since the first frame of the profile
+		@param _sequence : sequence number read before the profile (None without sequence register)
+		"""
+		if self.n_frames == 1:
+			return True
+		if _sequence is not None:
+			return self._read_sequence() == _sequence
+		self.driver.read_buf_i16_into(self.profile_addr, len(self._header)//2, self._header_after)
+		return self._header == self._header_after
+
+	def _read_sequence (self):
+		return self.driver.read_i16(self.sequence_addr) & 0xFFFF
+
+	def _read_content (self):
+		self.driver.read_buf_i16_into(self.read_addr, self.read_size, self._buf)
+		return bytes(self._profile)
+
+	def _profile_data (self, _timestamp):
+		""" @brief raw profile from the words read (timestamp + header + cells in little endian)
+		"""
+		timestamp = encode_timestamp(_timestamp)
+		data = bytearray(len(timestamp) + 2*self.profile_size)
+		data[:len(timestamp)] = timestamp
+		data[len(timestamp):] = self._profile
+		np.frombuffer(data, dtype=np.int16, offset=len(timestamp)).byteswap(inplace=True)
+		return bytes(data)
@@ -0,0 +1,141 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# @copyright  this code is the property of Ubertone.
+# You may use this code for your personal, informational, non-commercial purpose.
+# You may not distribute, transmit, display, reproduce, publish, license, create derivative works from, transfer or sell any information, software, products or services based on this code.
+# @author Stéphane Fischer
+
+import threading
+import logging
+
+from .apf04_modbus import Apf04Modbus
+from .apf04_driver import Apf04Driver
+from .apf04_addr_cmd import *
+from .apf04_exception import apf04_exception
+
+class Apf04Bus ():
+	""" @brief several devices sharing one serial port (RS485 multi-drop)
+
+	Each device has its own modbus address. A measurement cycle triggers all
+	the devices (non blocking measurement), then collects the profiles in the
+	order they are ready : the measurement times of the devices overlap and
+	the cycle lasts about the longest measurement plus the transfers.
+
+	An instance must be used by one thread at a time.
+	"""
+	def __init__(self, _dev, _baudrate, _f_sys, _slave_addrs, _ser=None):
+		""" @brief open the bus and identify the devices
+		@param _dev : serial port
+		@param _baudrate : communication speed
+		@param _f_sys : system frequency of the devices
+		@param _slave_addrs : list of the modbus addresses of the devices
+		@param _ser : already opened serial port (serial.Serial or compatible), _dev and _baudrate are then not used
+		  (the port is not closed by the bus)
+		"""
+		self.dev = _dev
+		if _ser is None:
+			# the port is opened and owned by the bus
+			self._port = Apf04Modbus(_baudrate, _dev)
+		else:
+			self._port = Apf04Modbus(_dev=_dev, _ser=_ser)
+
+		self.devices = {}
+		for slave_addr in _slave_addrs:
+			device = Apf04Driver(None, _f_sys, _dev, _slave_addr=slave_addr, _ser=self._port.ser)
+			device.addr = get_addr_dict(device.read_version()[1])
+			device.config = None
+			self.devices[slave_addr] = device
+
+	def read_configs (self):
+		""" @brief read the configuration selected in each device
+		"""
+		for device in self.devices.values():
+			device.read_config(device.read_i16(device.addr["ADDR_CONFIG_ID"]))
+
+	def configure (self, _slave_addr, _config, _id_config=0):
+		""" @brief write and select a configuration in a device
+		"""
+		device = self.devices[_slave_addr]
+		device.write_config(_config, _id_config)
+		device.select_config(_id_config)
+		device.act_check_config()
+		device.read_config(_id_config)
+
+	def measure (self):
+		""" @brief measure one profile with each device
+		@return dict slave address -> raw profile (see Apf04Driver.read_profile), without the devices which failed
+		"""
+		ready = {}
+		for slave_addr, device in self.devices.items():
+			try:
+				ready[slave_addr] = device.act_start_profile()
+			except apf04_exception as ae:
+				logging.info("device %d: %s", slave_addr, ae)
+
+		profiles = {}
+		for slave_addr in sorted(ready, key=ready.get):
+			device = self.devices[slave_addr]
+			try:
+				device.wait_profile()
+				profiles[slave_addr] = device.read_profile(device.config.n_vol)
+			except apf04_exception as ae:
+				logging.info("device %d: %s", slave_addr, ae)
+				self._cancel(slave_addr)
+		return profiles
+
+	def _cancel (self, _slave_addr):
+		""" @brief stop the measurement of a device which failed, so that it is ready for the next cycle
+		"""
+		try:
+			self.devices[_slave_addr].act_stop()
+		except apf04_exception as ae:
+			logging.info("device %d: %s", _slave_addr, ae)
+
+
+class Apf04Poller ():
+	""" @brief continuous measurements on several buses, one thread per bus
+
+	The buses work in parallel, so the throughput grows with the number of buses.
+	"""
+	def __init__(self, _buses, _callback):
+		""" @brief create the poller
+		@param _buses : list of Apf04Bus (with their configurations read or written)
+		@param _callback : function called with (bus, slave address, raw profile), from the thread of the bus
+		"""
+		self.buses = _buses
+		self.callback = _callback
+		self.cycles = [0]*len(_buses)
+		self.profiles = [0]*len(_buses)
+		self._running = threading.Event()
+		self._threads = []
+
+	def start (self):
+		self._running.set()
+		self._threads = [threading.Thread(target=self._poll, args=(i,), name="apf04_bus_%d"%i, daemon=True) for i in range(len(self.buses))]
+		for thread in self._threads:
+			thread.start()
+
+	def stop (self):
+		""" @brief stop after the current measurement cycles
+		"""
+		self._running.clear()
+		for thread in self._threads:
+			thread.join()
+		self._threads = []
+
+	def __enter__(self):
+		self.start()
+		return self
+
+	def __exit__(self, *args):
+		self.stop()
+
+	def _poll (self, _index):
+		bus = self.buses[_index]
+		while self._running.is_set():
+			profiles = bus.measure()
+			self.cycles[_index] += 1
+			self.profiles[_index] += len(profiles)
+			for slave_addr, data in profiles.items():
+				self.callback(bus, slave_addr, data)
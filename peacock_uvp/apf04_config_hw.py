@@ -7,6 +7,7 @@
 # @author Marie Burckbuchler, Stéphane Fischer
 
 import logging
+import struct
 from math import ceil
 
 from .apf04_gain import convert_dB_m2code, convert_code2dB_m, convert_code2dB, convert_dB2code, APF04_CODE_MAX_APPLIED
@@ -15,33 +16,33 @@ from .apf_type import cast_int16, cast_uint16
 
 #ap_protocol_error(3300, "Warning: v_min has to be in [-Nyquist_Range, 0].")
 
+# @brief parameters of a configuration, in the order of the device memory (cf. dt_protocole de l'APF04)
+CONFIG_FIELDS = ['div_f0', 'n_tir', 'c_prf', 'n_em', 'n_vol', 'c_vol1', 'c_dvol', 'gain_ca0', 'gain_ca1', \
+	'tr', 'phi_min', 'method', 'reserved1', 'reserved2', 'n_avg', 'blind_ca0', 'blind_ca1']
+CONFIG_SIZE = len(CONFIG_FIELDS)
+
+def _word_property(_index):
+	def getter(self):
+		return self._words[_index]
+	def setter(self, _value):
+		self._words[_index] = _value
+		self._bytes = None
+	return property(getter, setter)
+
 class ConfigHw ():
 	# @brief To instantiate an object of this class, you can give no parameter to get attributes set to zero, or you can give a settings, the ID of the config and the sound_speed to use.
-	# TODO (san 21/04/2020) il serait surement plus approprié, plus propre (et plus compact) de stocker la configHW dans un dict 
-	#      accompagné d'une liste donnant l'ordre des valeurs en mémoire :
-	#      order = ['div_f0', 'n_tir', 'c_prf', 'n_em', 'n_vol', 'c_vol1', 'c_dvol' ...]  
+	# The parameters are stored in a list of words, in the order of the device memory (CONFIG_FIELDS),
+	# and are available as attributes (config.n_vol ...).
+	__slots__ = ("f_sys", "id_config", "burst_mode", "phase_coding", "static_echo_filter", "gain_auto", "_words", "_bytes")
+
 	def __init__(self, _f_sys):
 		
-		logging.debug("f_sys = %.1e"%_f_sys)
+		logging.debug("f_sys = %.1e", _f_sys)
 		self.f_sys = _f_sys
 		
-		self.div_f0 = 0
-		self.n_tir = 0
-		self.c_prf = 0
-		self.n_em = 0
-		self.n_vol = 0
-		self.c_vol1 = 0
-		self.c_dvol = 0
-		self.gain_ca0 = 0
-		self.gain_ca1 = 0
-		self.tr = 0
-		self.phi_min = 0
-		self.method = 0
-		self.reserved1 = 0
-		self.reserved2 = 0
-		self.n_avg = 0
-		self.blind_ca0 = 0
-		self.blind_ca1 = 0
+		self._words = [0]*CONFIG_SIZE
+		# words packed in little endian (see to_bytes), None when a parameter changed
+		self._bytes = None
 
 		
 	def set(self, _config_data, _sound_speed=1480, _gain_blind_zone=None):
@@ -143,22 +144,12 @@ class ConfigHw ():
 	# @param _param_table : tableau des valeurs dans l'ordre indiqué ci-dessous. cf. aussi dt_protocole de l'APF04.
 	def from_list(self, _param_table):
 		logging.debug("start import list")
-		if len(_param_table)==17:
-			self.div_f0 = _param_table[0]
-			self.n_tir = _param_table[1]
-			self.c_prf = _param_table[2]
-			self.n_em = _param_table[3]
-			self.n_vol = _param_table[4]
-			self.c_vol1 = _param_table[5]
-			self.c_dvol = _param_table[6]
-			self.gain_ca0 = _param_table[7]
-			self.gain_ca1 = _param_table[8]
-			self.tr = _param_table[9]
-			self.phi_min = _param_table[10]
-			self.method = _param_table[11]
-			self.n_avg = _param_table[14]
-			self.blind_ca0 = _param_table[15]
-			self.blind_ca1 = _param_table[16]
+		if len(_param_table)==CONFIG_SIZE:
+			# the reserved words are not read
+			reserved = self._words[12:14]
+			self._words[:] = _param_table
+			self._words[12:14] = reserved
+			self._bytes = None
 
 			# Other useful parameters (coded in method bits array) :
 			if (self.method & 0x0001) == 0:
@@ -256,29 +247,19 @@ class ConfigHw ():
 
 
 	def to_list(self):
-		buf=[]
-		buf.append(self.div_f0)
-		buf.append(self.n_tir)
-		buf.append(self.c_prf)
-		buf.append(self.n_em)
-		buf.append(self.n_vol)
-		buf.append(self.c_vol1)
-		buf.append(self.c_dvol)
-		buf.append(self.gain_ca0)
-		buf.append(self.gain_ca1)
-		buf.append(self.tr)
-		buf.append(self.phi_min)
-		buf.append(self.method)
-		buf.append(self.reserved1)
-		buf.append(self.reserved2)
-		buf.append(self.n_avg)
-		buf.append(self.blind_ca0)
-		buf.append(self.blind_ca1)
-		return buf
+		# copy : modifying the list does not modify the config
+		return list(self._words)
+
+	def to_bytes(self):
+		""" @brief words of the configuration (16 bits, little endian), computed once until a parameter changes
+		"""
+		if self._bytes is None:
+			self._bytes = struct.pack("<%dH"%CONFIG_SIZE, *[word & 0xFFFF for word in self._words])
+		return self._bytes
 	
 
 	def __str__(self): 
-		return str(self.__dict__)
+		return str(dict(zip(CONFIG_FIELDS, self._words), f_sys=self.f_sys))
 
 
 	def __eq__(self, other):
@@ -286,8 +267,18 @@ class ConfigHw ():
 			logging.info("NOT IMPLEMENTED")
 			return NotImplemented
 		
-		return ((self.div_f0, self.tr, self.method, self.c_prf, self.phi_min, self.n_tir, self.c_vol1, self.c_dvol, self.n_em, self.n_vol, self.reserved1, self.reserved2, self.n_avg, self.gain_ca0, self.gain_ca1, self.blind_ca0, self.blind_ca1) == (other.div_f0, other.tr, other.method, other.c_prf, other.phi_min, other.n_tir, other.c_vol1, other.c_dvol, other.n_em, other.n_vol, other.reserved1, other.reserved2, other.n_avg, other.gain_ca0, other.gain_ca1, other.blind_ca0, other.blind_ca1))
+		return self._words == other._words
+
+
+	def __hash__(self):
+		# same parameters, same hash (the config must not be modified while used as a key)
+		return hash(tuple(self._words))
 
 
 	def __ne__(self, other):
 		return not self == other
+
+
+for _index, _name in enumerate(CONFIG_FIELDS):
+	setattr(ConfigHw, _name, _word_property(_index))
+del _index, _name
@@ -0,0 +1,206 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# @copyright  this code is the property of Ubertone.
+# You may use this code for your personal, informational, non-commercial purpose.
+# You may not distribute, transmit, display, reproduce, publish, license, create derivative works from, transfer or sell any information, software, products or services based on this code.
+# @author Stéphane Fischer
+
+import numpy as np
+
+from .apf04_config_hw import ConfigHw
+
+# user settings which can be searched (keys of the settings dict, see ConfigHw.from_dict)
+SEARCH_KEYS = ['f0', 'prf', 'n_ech', 'n_vol', 'r_vol1', 'r_dvol', 'r_em', 'n_profile']
+
+# hardware codes computed as in ConfigHw.from_dict
+CODE_KEYS = ['div_f0', 'c_prf', 'n_tir', 'n_em', 'n_vol_code', 'c_vol1', 'c_dvol', 'n_avg']
+
+METRIC_KEYS = ['bloc_duration', 'transfer_time', 'profile_rate', 'r_vol1_q', 'r_dvol_q', 'range_max', 'v_nyquist']
+
+CANDIDATE_DTYPE = np.dtype([(key, 'f8') for key in SEARCH_KEYS] \
+	+ [(key, 'i4') for key in CODE_KEYS] \
+	+ [(key, 'f8') for key in METRIC_KEYS] \
+	+ [('valid', '?')])
+
+# objectives of the Pareto front : (field, 1 to maximize or -1 to minimize)
+DEFAULT_OBJECTIVES = [('profile_rate', 1), ('range_max', 1), ('r_dvol_q', -1), ('v_nyquist', 1)]
+
+# modbus frames (bytes) : read query, read answer without the data, write query of one word, write answer
+READ_QUERY_SIZE = 8
+READ_ANSWER_SIZE = 5
+WRITE_QUERY_SIZE = 11
+WRITE_ANSWER_SIZE = 8
+
+def _cast_int16(_value):
+	""" @brief vectorized cast_int16 (rounding half to even, as round) """
+	return np.clip(np.rint(_value), -32768, 32767).astype(np.int32)
+
+def _cast_uint16(_value):
+	""" @brief vectorized cast_uint16 """
+	return np.clip(np.rint(_value), 0, 65535).astype(np.int32)
+
+def transfer_time(_n_vol, _baudrate, _size_header=8, _max_read_seg_size=125, _frame_latency=0.):
+	""" @brief time needed to trigger a measurement and read a profile on the serial line
+	@param _n_vol : number of cells (scalar or array)
+	@param _baudrate : communication speed
+	@param _size_header : number of words of the profile header (SIZE_PROFILE_HEADER)
+	@param _max_read_seg_size : number of words read per modbus frame
+	@param _frame_latency : answer delay of the device for each frame (in seconds)
+	@return time in seconds (8N1 : 10 bits per byte)
+	"""
+	words = _size_header + 4*np.asarray(_n_vol)
+	n_frames = -(-words//_max_read_seg_size)
+	n_bytes = WRITE_QUERY_SIZE + WRITE_ANSWER_SIZE + n_frames*(READ_QUERY_SIZE + READ_ANSWER_SIZE) + 2*words
+	return 10.*n_bytes/_baudrate + (n_frames+1)*_frame_latency
+
+def evaluate_settings(_settings, _grid, _f_sys, _baudrate, _sound_speed=1480, _size_header=8, _max_read_seg_size=125):
+	""" @brief evaluate all the combinations of a grid of settings
+	@param _settings : base settings (dict as given to ConfigHw.from_dict)
+	@param _grid : dict key -> list of values, for keys of SEARCH_KEYS (the other keys keep the base value)
+	@param _f_sys : system frequency of the device
+	@param _baudrate : communication speed
+	@param _sound_speed : sound speed used for the conversions
+	@return candidates (structured array of CANDIDATE_DTYPE, one per combination)
+
+	The hardware codes are quantized as in ConfigHw.from_dict. The metrics are computed
+	from the quantized codes : profile rate (measurement + transfer), maximum range (end of
+	the last cell), cell size and Nyquist velocity. Candidates with invalid codes, or a
+	range beyond the unambiguous range c/(2 prf), are not valid.
+	"""
+	for key in _grid:
+		assert key in SEARCH_KEYS, "%s can not be searched"%key
+	values = [np.asarray(_grid.get(key, [_settings[key]]), dtype=np.float64) for key in SEARCH_KEYS]
+	mesh = np.meshgrid(*values, indexing='ij')
+	candidates = np.zeros(mesh[0].size, dtype=CANDIDATE_DTYPE)
+	for key, array in zip(SEARCH_KEYS, mesh):
+		candidates[key] = array.reshape(-1)
+	f0, prf, n_ech, n_vol, r_vol1, r_dvol, r_em, n_profile = (candidates[key] for key in SEARCH_KEYS)
+	c = _sound_speed
+
+	with np.errstate(divide='ignore', invalid='ignore'):
+		div_f0 = _cast_int16(_f_sys/f0 - 1)
+		f0_q = _f_sys/(div_f0+1)
+		c_prf = _cast_int16(f0_q/prf)
+		n_tir = _cast_int16(n_ech)
+		# n_em is equal to 0 only if r_em = 0. If not, n_em is at least equal to 1.
+		n_em = np.where(r_em == 0, 0, np.maximum(_cast_int16(2./c*f0_q*r_em), 1))
+		r_em_q = c/(2.*f0_q)*n_em
+		n_vol_code = _cast_int16(n_vol)
+		c_vol1 = _cast_uint16(2./c*f0_q*(r_vol1 - r_em_q/2.))
+		r_vol1_q = c/(2.*f0_q)*c_vol1 + r_em_q/2.
+		# constraint from APF04 hardware
+		c_dvol = np.maximum(_cast_int16(2./c*f0_q*r_dvol), 2)
+		r_dvol_q = c/(2.*f0_q)*c_dvol
+		n_avg = _cast_int16(n_profile)
+
+		prf_q = f0_q/c_prf
+		candidates['bloc_duration'] = n_tir*n_avg*(div_f0+1.)*c_prf/_f_sys
+		candidates['transfer_time'] = transfer_time(n_vol_code, _baudrate, _size_header, _max_read_seg_size)
+		candidates['profile_rate'] = 1./(candidates['bloc_duration'] + candidates['transfer_time'])
+		candidates['r_vol1_q'] = r_vol1_q
+		candidates['r_dvol_q'] = r_dvol_q
+		candidates['range_max'] = r_vol1_q + n_vol_code*r_dvol_q
+		candidates['v_nyquist'] = c*prf_q/(4.*f0_q)
+
+	for key, array in zip(CODE_KEYS, [div_f0, c_prf, n_tir, n_em, n_vol_code, c_vol1, c_dvol, n_avg]):
+		candidates[key] = array
+	candidates['valid'] = (div_f0 >= 0) & (c_prf > 0) & (n_tir > 0) & (n_vol_code > 0) & (n_avg > 0) \
+		& (candidates['range_max'] < c/(2.*prf_q))
+	return candidates
+
+def pareto_front(_candidates, _objectives=DEFAULT_OBJECTIVES, _block_size=2048, _max_grid_size=1<<22):
+	""" @brief candidates which are not dominated by another one
+	@param _candidates : structured array of candidates
+	@param _objectives : list of (field, 1 to maximize or -1 to minimize)
+	@param _block_size : number of candidates processed at once
+	@param _max_grid_size : maximum size of the dominance grid (see below)
+	@return indices of the Pareto-optimal candidates (the first of each group of equal objectives)
+
+	The candidates are processed by decreasing scores : a candidate can only be
+	dominated by the previous ones. The objectives with few distinct values (e.g.
+	cell size, Nyquist velocity) index a grid holding the best value of another
+	objective among the candidates already processed, so that each candidate is
+	checked against all the previous ones with a single lookup. If the grid would be
+	too big, the candidates are compared to the front found so far.
+	"""
+	scores = np.stack([sign*_candidates[field] for field, sign in _objectives], axis=1)
+	# candidates with the same objectives (e.g. settings quantized to the same codes) are evaluated once
+	scores, first = np.unique(scores, axis=0, return_index=True)
+	n_distinct = [len(np.unique(column)) for column in scores.T]
+	dims = list(np.argsort(n_distinct, kind='stable'))
+	# the objective with the most distinct values is the first key of the sort (the last one for lexsort) :
+	# the candidates of the previous blocks are not worse on it, the next one is looked up
+	order = np.lexsort(-scores[:, dims].T)
+	scores = scores[order]
+
+	query = dims[-2] if len(dims) > 1 else None
+	grid_dims = dims[:-2]
+	shape = tuple(n_distinct[dim] for dim in grid_dims)
+	use_grid = query is not None and np.prod(shape, dtype=np.float64) <= _max_grid_size
+	if use_grid:
+		ranks = tuple(np.unique(scores[:, dim], return_inverse=True)[1].reshape(-1) for dim in grid_dims)
+		# best value of the query objective of the candidates processed, at each rank / with greater ranks
+		best = np.full(shape, -np.inf)
+		best_above = best.copy()
+	front = np.zeros((0, scores.shape[1]))
+
+	kept = []
+	for start in range(0, len(scores), _block_size):
+		alive = np.arange(start, min(start+_block_size, len(scores)))
+		if use_grid:
+			alive = alive[best_above[tuple(rank[alive] for rank in ranks)] < scores[alive, query]]
+		else:
+			for front_start in range(0, len(front), _block_size):
+				alive = alive[~np.all(front[front_start:front_start+_block_size, np.newaxis] >= scores[alive], axis=2).any(axis=0)]
+		# the scores are unique : greater or equal on all the objectives means dominating
+		# (a candidate dominated by a previous one can not dominate a candidate which is not)
+		inner = np.all(scores[alive, np.newaxis] >= scores[alive], axis=2)
+		np.fill_diagonal(inner, False)
+		alive = alive[~inner.any(axis=0)]
+		kept.extend(first[order[alive]])
+
+		if use_grid:
+			block = slice(start, start+_block_size)
+			np.maximum.at(best, tuple(rank[block] for rank in ranks), scores[block, query])
+			best_above = best
+			for axis in range(len(shape)):
+				best_above = np.flip(np.maximum.accumulate(np.flip(best_above, axis), axis=axis), axis)
+		else:
+			front = np.concatenate((front, scores[alive]))
+	return np.array(kept, dtype=np.int64)
+
+def optimize_settings(_settings, _grid, _f_sys, _baudrate, _sound_speed=1480, _constraints=None, _objectives=DEFAULT_OBJECTIVES, **_kwargs):
+	""" @brief Pareto-optimal settings of a grid
+	@param _constraints : dict field -> (min, max) on the candidates (None : no bound), e.g. {"profile_rate": (10, None)}
+	@param _objectives : list of (field, 1 to maximize or -1 to minimize)
+	(see evaluate_settings for the other parameters)
+	@return Pareto-optimal candidates, sorted by decreasing profile rate
+	"""
+	candidates = evaluate_settings(_settings, _grid, _f_sys, _baudrate, _sound_speed, **_kwargs)
+	selected = candidates['valid']
+	for field, (low, high) in (_constraints or {}).items():
+		if low is not None:
+			selected &= candidates[field] >= low
+		if high is not None:
+			selected &= candidates[field] <= high
+	candidates = candidates[selected]
+	if not len(candidates):
+		return candidates
+	front = candidates[pareto_front(candidates, _objectives)]
+	return front[np.argsort(-front['profile_rate'], kind='stable')]
+
+def candidate_settings(_candidate, _settings):
+	""" @brief settings dict of a candidate (for ConfigHw.set)
+	"""
+	settings = dict(_settings)
+	for key in SEARCH_KEYS:
+		settings[key] = _candidate[key].item()
+	for key in ['n_ech', 'n_vol', 'n_profile']:
+		settings[key] = int(settings[key])
+	return settings
+
+def candidate_config(_candidate, _settings, _f_sys, _sound_speed=1480):
+	""" @brief ConfigHw of a candidate
+	"""
+	return ConfigHw(_f_sys).set(candidate_settings(_candidate, _settings), _sound_speed)
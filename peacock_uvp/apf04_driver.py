@@ -7,25 +7,56 @@
 # @author Stéphane Fischer
 
 from datetime import datetime
-import struct
+from time import perf_counter, sleep
 import logging
 
-from .apf04_modbus import Apf04Modbus
+import numpy as np
+
+from .apf04_modbus import Apf04Modbus, DEFAULT_TIMEOUT
 from .apf04_addr_cmd import *
+from .apf04_addr_cmd import AddrMap
 from .apf04_config_hw import ConfigHw
+from .apf04_measures import profile_dtype
+from .apf04_read_plan import read_registers, ADDR_RAM_END
+from .apf04_shadow import RegisterShadow
 from .apf_timestamp import encode_timestamp
-from .apf04_exception import apf04_exception
+from .apf04_iq import decode_iq
+from .apf04_exception import apf04_error, apf04_exception
 
 # TODO gérer ici les erreur spécifiques au HW
 
-class Apf04Driver (Apf04Modbus):
-	""" @brief gère l'instrument APF04
+# time allowed to the device beyond the expected end of a measurement : DELAY_TOLERANCE of its
+# duration, at least MIN_MARGIN (the serial timeout of the first versions of the driver)
+DELAY_TOLERANCE = 0.2
+MIN_MARGIN = DEFAULT_TIMEOUT
+# minimum period of the polling of a non blocking measurement later than expected
+PROFILE_POLL_PERIOD = 0.001
+
+class Apf04DriverBase ():
+	""" @brief part of the APF04 driver which does not depend on the communication layer
+
+	Shared by Apf04Driver (serial port) and Apf04AsyncDriver (asyncio) : address map,
+	shadow of the settings, processing time of the actions and decoding of the answers.
 	"""
-	# TODO : tester la com dans un init par une lecture de la version 
-	def __init__(self, _baudrate, _f_sys, _dev=None, _addr_dict=None):
+	def _init_driver (self, _f_sys, _addr_dict):
 		self.f_sys=_f_sys
-		Apf04Modbus.__init__(self, _baudrate, _dev)
 		self.addr = _addr_dict
+		# copy of the RAM words written (and of the settings read), to skip the unchanged words
+		self.shadow = RegisterShadow()
+		# maximum processing time of the actions (see ACTION_TIMEOUT), e.g. to adapt to a firmware
+		self.action_timeout = dict(ACTION_TIMEOUT)
+
+	@property
+	def addr(self):
+		""" @brief address map of the firmware (AddrMap, see get_addr_dict) """
+		return self._addr
+
+	@addr.setter
+	def addr(self, _addr_dict):
+		# a plain dict is compiled once (integer addresses, attribute access)
+		if _addr_dict is not None and not isinstance(_addr_dict, AddrMap):
+			_addr_dict = AddrMap(_addr_dict)
+		self._addr = _addr_dict
 
 	def new_config (self):
 		"""  @brief create an empty config
@@ -33,38 +64,97 @@ class Apf04Driver (Apf04Modbus):
 		# TODO pourrait aussi s'appeler create_config ou empty_config @marie : un avis ?
 		return ConfigHw(self.f_sys)
 
-	def read_config (self, _id_config=0):
-		""" @brief lecture des paramètres d'une configuration
-		    @param _id_config : identifiant de la configuration [0..2] (par défaut la config n°1/3) 
-				
-				principalement utilisé pour relire la config après un check_config
-				"""
-		self.config = ConfigHw(self.f_sys)
-		self.config.id_config = _id_config
-		#	tous les paramètres des settings sont en signé
-		self.config.from_list(self.read_list_i16(int(self.addr["ADDR_CONFIG"])+_id_config*int(self.addr["OFFSET_CONFIG"]), int(self.addr["SIZE_CONFIG"]))) # en mots
-		return self.config
-	
-	# TODO .to_list() à faire par l'appelant ? APF04Driver ne connait pas config_hw ou passer config_hw en self.config (actuellement au niveau au dessus) ?
-	def write_config (self, _config, _id_config):
-		""" @brief écriture des paramètres d'une configuration
-		    @param _config : configuration (de type ConfigHw)
+	def config_addr (self, _id_config):
+		""" @brief address of the parameters of a configuration
 		    @param _id_config : identifiant de la configuration [0..2]
 		"""
-		logging.debug("%s"%(_config.to_list()))
-		self.write_buf_i16(_config.to_list(), self.addr["ADDR_CONFIG"]+_id_config*self.addr["OFFSET_CONFIG"])
+		return self.addr.ADDR_CONFIG+_id_config*self.addr.OFFSET_CONFIG
 
-	# DEFINI LA CONFIG 0 UTILISEE PAR L'APPAREIL
-	# _config = [0..2]
-	def select_config (self, _id_config):
-		logging.debug("selecting config %d [0..N-1]"%(_id_config))
-		self.write_i16(_id_config, self.addr["ADDR_CONFIG_ID"])
+	def selected_config (self):
+		""" @brief configuration selected in the device, as known by the host
+		@return ConfigHw, None if the selected configuration is not known
 
-	def read_version (self):
-		""" @brief Lecture des versions C et VHDL
+		The configuration is taken from the shadow if the selection was written or
+		read, else it is the last configuration read (read_config).
+		"""
+		id_config = self.shadow.get(self.addr.ADDR_CONFIG_ID, 1)
+		if id_config is not None:
+			words = self.shadow.get(self.config_addr(id_config[0]), self.addr.SIZE_CONFIG)
+			if words is not None:
+				config = ConfigHw(self.f_sys)
+				config.from_list(words)
+				return config
+		return getattr(self, "config", None)
+
+	def answer_margin (self, _duration):
+		""" @brief time allowed to the device beyond the expected end of a measurement
+		@param _duration : expected duration of the measurement (in seconds)
+		@return DELAY_TOLERANCE of the duration, at least MIN_MARGIN
+		"""
+		return max(DELAY_TOLERANCE*_duration, MIN_MARGIN)
+
+	def bloc_duration (self):
+		""" @brief duration of a block of profiles with the selected configuration
+		@return duration in seconds, None if the selected configuration is not known
+		"""
+		config = self.selected_config()
+		return None if config is None else config.get_bloc_duration()
+
+	def action_margin (self, _cmd, _delay=None):
+		""" @brief time allowed to the device to answer to an action, beyond its expected processing time
+		@param _cmd : command of the action
+		@param _delay : expected processing time (a measurement), None if it is not known
+		@return answer_margin of the processing time, else action_timeout of the command
+		  (DEFAULT_TIMEOUT for the other commands)
+		"""
+		if _delay is not None:
+			return self.answer_margin(_delay)
+		return self.action_timeout.get(_cmd, DEFAULT_TIMEOUT)
+
+	def stop_timeout (self):
+		""" @brief time allowed to the device to answer to CMD_STOP
 		"""
-		self.version_vhdl = self.read_i16(ADDR_VERSION_VHDL)
-		self.version_c = self.read_i16(ADDR_VERSION_C)
+		# the block of profiles in progress may be finished first : the answer comes
+		# at any time of the block
+		timeout = self.action_timeout[CMD_STOP]
+		duration = self.bloc_duration()
+		if duration is not None:
+			timeout = max(timeout, duration + self.answer_margin(duration))
+		return timeout
+
+	def iq_duration (self):
+		""" @brief expected duration of the IQ measurement (act_meas_IQ), None if not known
+		"""
+		# the n_tir shots of a profile, without averaging
+		config = self.selected_config()
+		return None if config is None else config.get_bloc_duration()/config.n_avg
+
+	def __sound_speed_addr__(self):
+		addr_ss_auto = self.addr.ADDR_SOUND_SPEED_AUTO
+		addr_ss_set = self.addr.ADDR_SOUND_SPEED_SET
+		# fix for firmware prior to 45
+		if self.version_c < 45:
+			addr_ss_auto -= 2
+			addr_ss_set -= 2
+		return addr_ss_auto, addr_ss_set
+
+	def sound_speed_words (self, sound_speed=1480, sound_speed_auto=False):
+		""" @brief words to write for the sound speed global parameter
+		@return list of (words, address)
+		"""
+		addr_ss_auto, addr_ss_set = self.__sound_speed_addr__()
+		if sound_speed_auto:
+			return [([1], addr_ss_auto)]
+		elif addr_ss_set == addr_ss_auto+1:
+			return [([0, sound_speed], addr_ss_auto)]
+		return [([0], addr_ss_auto), ([sound_speed], addr_ss_set)]
+
+	def set_versions (self, _versions):
+		""" @brief decode the versions read by read_version
+		@param _versions : dict "vhdl", "c", "model_year", "serial_num"
+		"""
+		self.version_vhdl = _versions["vhdl"]
+		self.version_c = _versions["c"]
 		logging.debug("Version VHDL=%s", self.version_vhdl)
 		logging.debug("Version C=%s", self.version_c)
 		if self.version_c < 45:
@@ -73,105 +163,385 @@ class Apf04Driver (Apf04Modbus):
 			self.year = 2018
 			self.serial_num = 0
 		else :
-			model_year = self.read_i16(ADDR_MODEL_YEAR)
+			model_year = _versions["model_year"]
 			self.model = (model_year & 0xFF00)>>8
 			self.year = 2000 + (model_year & 0x00FF)
 
 			if self.model == 0x01 :
 				logging.debug("Model is Peacock UVP")
 			else :
-				logging.info("Warning, model (id %s) is not defined"%self.model)	
+				logging.info("Warning, model (id %s) is not defined", self.model)	
 			logging.debug("Year of production = %s", self.year)
 			
-			self.serial_num = self.read_i16(ADDR_SERIAL_NUM)
+			self.serial_num = _versions["serial_num"]
 			logging.debug("Serial number=%s", self.serial_num)
 		
 		return self.version_vhdl, self.version_c
 
+	def shadow_written (self, _data, _addr):
+		""" @brief update the shadow with words written in the device
+		"""
+		if _addr <= ADDR_RAM_END:
+			self.shadow.update(_addr, _data)
+
+	def shadow_checked (self):
+		""" @brief forget the configurations in the shadow after CMD_CHECK_CONFIG
+		"""
+		# the device may correct the selected configuration
+		id_config = self.shadow.get(self.addr.ADDR_CONFIG_ID, 1)
+		id_configs = id_config if id_config else range(3)
+		for id_config in id_configs:
+			self.shadow.invalidate(self.config_addr(id_config), self.addr.SIZE_CONFIG)
+
+	def invalidate_shadow (self):
+		""" @brief forget the shadow (after a reboot of the device, or if the RAM was modified by another host)
+		"""
+		self.shadow.invalidate()
+
+	def profile_buffer (self, _n_vol):
+		""" @brief buffer of a raw profile, with the timestamp of the measurement
+		@return (buffer, offset of the words read in the device, number of words to read)
+		"""
+		timestamp = encode_timestamp(self.timestamp_profile)
+		size = self.addr.SIZE_PROFILE_HEADER + _n_vol*4
+		data = bytearray(len(timestamp) + 2*size)
+		data[:len(timestamp)] = timestamp
+		return data, len(timestamp), size
+
+	def decode_profile (self, _data, _offset, _n_vol, _swap=True):
+		""" @brief raw profile read in the buffer of profile_buffer (see Apf04Driver.read_profile)
+		"""
+		if not _swap:
+			return bytes(_data), profile_dtype(_n_vol, '>')
+
+		# on passe en litte endian (les données initiales sont en big endian)
+		# the words are swapped in place in the buffer (no intermediate python objects)
+		np.frombuffer(_data, dtype=np.int16, offset=_offset).byteswap(inplace=True)
+		return bytes(_data)
+
+
+class Apf04Driver (Apf04Modbus, Apf04DriverBase):
+	""" @brief gère l'instrument APF04
+	"""
+	# TODO : tester la com dans un init par une lecture de la version 
+	def __init__(self, _baudrate, _f_sys, _dev=None, _addr_dict=None, _slave_addr=0x04, _ser=None):
+		self._init_driver(_f_sys, _addr_dict)
+		Apf04Modbus.__init__(self, _baudrate, _dev, _slave_addr, _ser)
+		# expected end (perf_counter) and duration of the non blocking measurement in progress
+		self.profile_end = None
+		self._profile_duration = None
+		# the end of a non blocking measurement is read in ADDR_ACTION (see poll_profile),
+		# else it is taken at its expected end
+		self.poll_action = False
+
+	def connect (self, _baudrate):
+		""" @brief open the serial port (see Apf04Modbus.connect), the shadow is forgotten
+		"""
+		# the device may have been changed, rebooted or configured by another host meanwhile
+		self.invalidate_shadow()
+		Apf04Modbus.connect(self, _baudrate)
+
+	def attach_port (self, _ser):
+		""" @brief use a serial port opened elsewhere (see Apf04Modbus.attach_port), the shadow is forgotten
+		"""
+		self.invalidate_shadow()
+		Apf04Modbus.attach_port(self, _ser)
+
+	def read_config (self, _id_config=0, _cached=False):
+		""" @brief lecture des paramètres d'une configuration
+		    @param _id_config : identifiant de la configuration [0..2] (par défaut la config n°1/3) 
+		    @param _cached : if True, the parameters are taken from the shadow when they are known
+				
+				principalement utilisé pour relire la config après un check_config
+				"""
+		self.config = ConfigHw(self.f_sys)
+		self.config.id_config = _id_config
+		addr = self.config_addr(_id_config)
+		#	tous les paramètres des settings sont en signé
+		if _cached:
+			words = self.read_cached(addr, self.addr.SIZE_CONFIG)
+		else:
+			words = list(self.read_list_i16(addr, self.addr.SIZE_CONFIG)) # en mots
+			self.shadow.update(addr, words)
+		self.config.from_list(words)
+		return self.config
+	
+	# TODO .to_list() à faire par l'appelant ? APF04Driver ne connait pas config_hw ou passer config_hw en self.config (actuellement au niveau au dessus) ?
+	def write_config (self, _config, _id_config):
+		""" @brief écriture des paramètres d'une configuration
+		    @param _config : configuration (de type ConfigHw)
+		    @param _id_config : identifiant de la configuration [0..2]
+		"""
+		data = _config.to_list()
+		logging.debug("%s", data)
+		self.write_cached(data, self.config_addr(_id_config))
+
+	# DEFINI LA CONFIG 0 UTILISEE PAR L'APPAREIL
+	# _config = [0..2]
+	def select_config (self, _id_config):
+		logging.debug("selecting config %d [0..N-1]", _id_config)
+		self.write_cached([_id_config], self.addr.ADDR_CONFIG_ID)
+
+	def read_version (self):
+		""" @brief Lecture des versions C et VHDL
+		"""
+		# VHDL version alone, C version, model/year and serial number in a single frame
+		versions = read_registers(self, {"vhdl":ADDR_VERSION_VHDL, "c":ADDR_VERSION_C, "model_year":ADDR_MODEL_YEAR, "serial_num":ADDR_SERIAL_NUM})
+		return self.set_versions(versions)
+
 	def write_sound_speed (self, sound_speed=1480, sound_speed_auto=False):
 		""" @brief Writing of the sound speed global parameter in RAM
 		"""
-		addr_ss_auto = self.addr["ADDR_SOUND_SPEED_AUTO"]
-		addr_ss_set = self.addr["ADDR_SOUND_SPEED_SET"]
-		# fix for firmware prior to 45
-		if self.version_c < 45:
-			addr_ss_auto -= 2
-			addr_ss_set -= 2
+		for data, addr in self.sound_speed_words(sound_speed, sound_speed_auto):
+			self.write_cached(data, addr)
 
-		if sound_speed_auto:
-			self.write_i16(1, addr_ss_auto)
-		else:
-			self.write_i16(0, addr_ss_auto)
-			self.write_i16(sound_speed, addr_ss_set)
+	############## Shadow of the settings ######################################
+
+	def write_buf_i16 (self, _data, _addr, _timeout=0.0, _delay=0.0):
+		""" @brief Write buffer (see Apf04Modbus.write_buf_i16), the shadow is updated
+		"""
+		try:
+			Apf04Modbus.write_buf_i16(self, _data, _addr, _timeout, _delay)
+		except:
+			# the words may or may not have been written
+			self.shadow.invalidate(_addr, len(_data))
+			raise
+		self.shadow_written(_data, _addr)
 
-	def __action_cmd__(self, _cmd, _timeout=0.0):
+	def write_cached (self, _data, _addr):
+		""" @brief write only the words which differ from the shadow
+		@param _data : list of words (signed 16 bits)
+		@param _addr : data address
+		@return number of modbus frames sent
+		"""
+		runs = self.shadow.diff(_addr, _data, _max_size=self.max_seg_size)
+		for offset, size in runs:
+			self.write_buf_i16(_data[offset:offset+size], _addr+offset)
+		return len(runs)
+
+	def read_cached (self, _addr, _size):
+		""" @brief read words from the shadow, or from the device if one of them is unknown
+		@param _addr : data address
+		@param _size : number of words
+		@return list of words (signed 16 bits)
+
+		Only for the settings : the words modified by the device (measures ...) are not updated in the shadow.
+		"""
+		data = self.shadow.get(_addr, _size)
+		if data is None:
+			data = list(self.read_list_i16(_addr, _size))
+			self.shadow.update(_addr, data)
+		return data
+
+	def refresh_shadow (self, _n_configs=3):
+		""" @brief read the settings (configurations, selected configuration and sound speed) in the shadow
+
+		To be called after a reconnection : the configuration can then be written again
+		with only the words which changed.
+		"""
+		self.shadow.invalidate()
+		size_config = self.addr.SIZE_CONFIG
+		registers = {"config_%d"%id_config: (self.config_addr(id_config), size_config) \
+			for id_config in range(_n_configs)}
+		registers["config_id"] = self.addr.ADDR_CONFIG_ID
+		registers["sound_speed_auto"], registers["sound_speed_set"] = self.__sound_speed_addr__()
+		values = self.read_registers(registers)
+		for name, register in registers.items():
+			if isinstance(register, tuple):
+				self.shadow.update(register[0], values[name])
+			else:
+				self.shadow.update(register, [values[name]])
+
+	def __action_cmd__(self, _cmd, _timeout=None, _delay=None):
 		""" @brief generic action function 
 		send a command asking for a given action. Unless specific case,
-		the function is released when the action is finished. The timeout 
-		should be set consequently. """
+		the function is released when the action is finished.
+		@param _delay : expected processing time (a measurement), None if it is not known
+		@param _timeout : additional time allowed (answer_margin of the processing time by default,
+		  else action_timeout of the command, DEFAULT_TIMEOUT for the other commands)
+		"""
+		if _timeout is None:
+			_timeout = self.action_margin(_cmd, _delay)
 		try:
-			self.write_i16(_cmd, ADDR_ACTION, _timeout)
+			self.write_i16(_cmd, ADDR_ACTION, _timeout, _delay or 0.)
 		except apf04_exception as ae:
-			logging.info("apf04_exception catched with command %s with timeout %e"%(_cmd, _timeout))
+			logging.info("apf04_exception catched with command %s with timeout %e", _cmd, _timeout)
 			raise ae
+		if _cmd == CMD_INIT_SETTINGS:
+			# the settings are reset by the device
+			self.shadow.invalidate()
 
 	def act_stop (self):
 		""" @brief Stop the measurement (only in non blocking mode)"""
-		self.__action_cmd__(CMD_STOP, 5.0)
+		self.__action_cmd__(CMD_STOP, self.stop_timeout())
+		self.profile_end = None
 
 	def act_meas_I2C (self):
 		""" @brief Make one measure of pitch, roll and temp. Those values are then updated in the RAM.
 		"""
-		self.__action_cmd__(CMD_TEST_I2C, 2.0)
+		self.__action_cmd__(CMD_TEST_I2C)
 
 	def act_test_led (self):
-		self.__action_cmd__(CMD_TEST_LED, 1.5)
-		# timeout set to 1.5 seconds to let the Led blink
+		# the answer comes once the Led has blinked
+		self.__action_cmd__(CMD_TEST_LED)
 		
 	def act_meas_IQ (self):
-		self.__action_cmd__(CMD_PROFILE_IQ) # TODO timeout
+		""" @brief measure the IQ samples of the shots of the selected configuration (read with read_IQ)
+		"""
+		duration = self.iq_duration()
+		self.timestamp_iq = datetime.utcnow()
+		self.__action_cmd__(CMD_PROFILE_IQ, _delay=duration)
 		
-	def act_meas_profile (self, _timeout=0.):
+	def act_meas_profile (self, _timeout=None, _duration=None):
 		""" @brief start to measure a block of profils
-		    @param _timeout maximum delay to get an answer from the board 
+		    @param _timeout additional delay allowed to the board, beyond the block duration
+		      of the selected configuration (by default, see answer_margin)
+		    @param _duration expected duration of the block (by default, from the selected configuration)
 		"""
+		delay = self.bloc_duration() if _duration is None else _duration
 		# get UTC timestamp just before strating the measurements
 		self.timestamp_profile = datetime.utcnow()
 
-		logging.debug ("setting timeout to %f"%_timeout)
-		self.__action_cmd__(CMD_PROFILE_BLOCKING, _timeout)
-		
-		
+		self.__action_cmd__(CMD_PROFILE_BLOCKING, _timeout, delay)
+
+	def act_start_profile (self):
+		""" @brief start to measure a block of profiles, without waiting for its end (non blocking mode)
+		    @return expected end of the measurement (perf_counter)
+
+		The serial line is free during the measurement (e.g. for the other devices of
+		a bus). The end is detected with poll_profile or wait_profile, then the profile
+		is read with read_profile. The measurement is cancelled with act_stop.
+		"""
+		duration = self.bloc_duration()
+		if duration is None and not self.poll_action:
+			raise apf04_error(2009, "the end of the measurement is not known : read or select the configuration first")
+		self.timestamp_profile = datetime.utcnow()
+		self.__action_cmd__(CMD_PROFILE_NON_BLOCKING)
+		self._profile_duration = duration
+		self.profile_end = perf_counter() + (duration or 0.)
+		return self.profile_end
+
+	def poll_profile (self):
+		""" @brief check if the measurement started by act_start_profile is finished
+		    @return True if finished
+
+		The device is not read before the expected end of the measurement (block duration
+		of the selected configuration). By default the measurement is then finished, as
+		the answer to a blocking measurement comes at the end of the block.
+
+		If poll_action is set, the end is confirmed by reading ADDR_ACTION : the register
+		holds the action in progress and comes back to CMD_NULL, the idle loop of the
+		firmware (see apf04_addr_cmd), when the block is measured. This is the behaviour
+		of Apf04Simulator, it is not confirmed on the devices yet.
+		"""
+		if self.profile_end is not None and perf_counter() < self.profile_end:
+			return False
+		if not self.poll_action:
+			return True
+		return self.read_i16(ADDR_ACTION) == CMD_NULL
+
+	def wait_profile (self, _timeout=None):
+		""" @brief wait for the end of the measurement started by act_start_profile
+		    @param _timeout additional delay allowed to the board, beyond the expected end
+		      (by default, see answer_margin), if poll_action is set
+
+		The end is waited for, then confirmed if poll_action is set (see poll_profile) :
+		the device is polled with a period growing with the delay.
+		"""
+		if _timeout is None:
+			_timeout = self.answer_margin(self._profile_duration or 0.)
+		end = perf_counter() if self.profile_end is None else self.profile_end
+		deadline = end + self.latency + _timeout
+		while True:
+			now = perf_counter()
+			if now < end:
+				sleep(end - now)
+			elif not self.poll_action or self.read_i16(ADDR_ACTION) == CMD_NULL:
+				return
+			else:
+				now = perf_counter()
+				if now >= deadline:
+					raise apf04_exception(2007, "timeout : measurement not finished")
+				sleep(min(max(PROFILE_POLL_PERIOD, 0.1*(now-end)), deadline - now))
+
 	def act_check_config (self):
-		self.__action_cmd__(CMD_CHECK_CONFIG, 0.2)
+		self.__action_cmd__(CMD_CHECK_CONFIG)
+		self.shadow_checked()
 
 	def act_start_auto_mode (self):
-		self.__action_cmd__(CMD_START_AUTO) # TODO timeout
+		""" @brief start the continuous measurements (see Apf04AutoStream), stopped with act_stop """
+		self.__action_cmd__(CMD_START_AUTO)
 
 	def read_temp (self):
-		return self.read_i16(self.addr["ADDR_TEMP_MOY"])
+		return self.read_i16(self.addr.ADDR_TEMP_MOY)
 
 	def read_pitch (self):
-		return self.read_i16(self.addr["ADDR_TANGAGE"])
+		return self.read_i16(self.addr.ADDR_TANGAGE)
 
 	def read_roll (self):
-		return self.read_i16(self.addr["ADDR_ROULIS"])	
+		return self.read_i16(self.addr.ADDR_ROULIS)	
 
-	def read_profile (self, _n_vol):
-		logging.debug("timestamp: %s"%self.timestamp_profile)
+	def read_sensors (self):
+		""" @brief read pitch, roll and temperature (in a single modbus frame)
+		@return dict "pitch", "roll", "temp"
+		"""
+		return self.read_registers({"pitch":"ADDR_TANGAGE", "roll":"ADDR_ROULIS", "temp":"ADDR_TEMP_MOY"})
+
+	def read_registers (self, _registers):
+		""" @brief read several registers with the fewest modbus frames
+		@param _registers : dict name -> address key of the address dict (e.g. "ADDR_TEMP_MOY") or address
+		@return dict name -> value (signed 16 bits)
+		"""
+		return read_registers(self, {name: self.addr[register] if isinstance(register, str) else register \
+			for name, register in _registers.items()})
+
+	def read_IQ_raw (self, _n_tir, _n_vol, _buf=None):
+		""" @brief read the IQ samples measured by act_meas_IQ, as transmitted
+		    @param _n_tir : number of shots
+		    @param _n_vol : number of cells
+		    @param _buf : writable buffer of at least 4*_n_tir*_n_vol bytes (see read_buf_i16_into)
+		    @return memoryview on the words (big endian) : I and Q of each cell of each shot
+		"""
+		addr_iq = self.addr.get("ADDR_IQ")
+		if addr_iq is None:
+			raise apf04_error(5001, "the IQ buffer is not defined in the address dict (ADDR_IQ)")
+		size = 2*_n_tir*_n_vol
+		if size > self.addr.SIZE_IQ:
+			raise apf04_error(5002, "%d IQ samples do not fit in the IQ buffer (%d words)"%(_n_tir*_n_vol, self.addr.SIZE_IQ))
+		return self.read_buf_i16_into(addr_iq, size, _buf)
+
+	def read_IQ (self, _n_tir, _n_vol, _out=None):
+		""" @brief read the IQ samples measured by act_meas_IQ
+		    @param _n_tir : number of shots
+		    @param _n_vol : number of cells
+		    @param _out : complex64 array (_n_tir, _n_vol) to fill, allocated if None
+		    @return complex64 array (_n_tir, _n_vol)
+		"""
+		return decode_iq(self.read_IQ_raw(_n_tir, _n_vol), _n_tir, _n_vol, '>', _out)
+
+	def read_profile (self, _n_vol, _swap=True):
+		""" @brief read the profile measured by act_meas_profile
+		    @param _n_vol : number of cells of the profile
+		    @param _swap : if False, the data are returned as transmitted (big endian), 
+		      with the numpy dtype describing them (see profile_dtype), so that 
+		      the conversion can be done later on, only when needed
+		    @return raw profile (timestamp + header + cells in little endian) 
+		      or (raw profile in big endian, dtype) if _swap is False
+		"""
+		logging.debug("timestamp: %s", self.timestamp_profile)
 
 		#logging.debug("pitch: %s, roll: %s,"%(self.read_i16(self.addr["ADDR_TANGAGE"]), self.read_i16(self.addr["ADDR_ROULIS"])))
 		#logging.debug("pitch: %s, roll: %s, temps: %s, sound_speed: %s, ca0: %s, ca1: %s"%(self.read_i16(self.addr["ADDR_TANGAGE"]), self.read_i16(self.addr["ADDR_ROULIS"]), self.read_i16(self.addr["ADDR_TEMP_MOY"]), self.read_i16(self.addr["ADDR_SOUND_SPEED"]), self.read_i16(self.addr["ADDR_GAIN_CA0"]), self.read_i16(self.addr["ADDR_GAIN_CA1"])))
-		data_list = self.read_buf_i16(self.addr["ADDR_PROFILE_HEADER"], self.addr["SIZE_PROFILE_HEADER"] + _n_vol*4) 
+		data, offset, size = self.profile_buffer(_n_vol)
+		self.read_buf_i16_into(self.addr.ADDR_PROFILE_HEADER, size, memoryview(data)[offset:])
 
-		logging.debug("processing+transfert delay = %fs"%(datetime.utcnow()-self.timestamp_profile).total_seconds())
+		debug = logging.getLogger().isEnabledFor(logging.DEBUG)
+		if debug:
+			logging.debug("processing+transfert delay = %fs", (datetime.utcnow()-self.timestamp_profile).total_seconds())
 
-		# on passe en litte endian (les données initiales sont en big endian)
-		# traitement < 1ms pour 50 cellules sur macbook pro
-		data_packed = struct.pack('<%sh'%int(len(data_list)/2), \
-			*struct.unpack('>%sh'%int(len(data_list)/2), data_list))
-		logging.debug("pack string = '%s'"%'>%sh'%int(len(data_list)/2))
+		profile = self.decode_profile(data, offset, _n_vol, _swap)
 
-		logging.debug("processing+transfert+swap delay = %fs"%(datetime.utcnow()-self.timestamp_profile).total_seconds())
+		if debug and _swap:
+			logging.debug("processing+transfert+swap delay = %fs", (datetime.utcnow()-self.timestamp_profile).total_seconds())
 
-		return encode_timestamp(self.timestamp_profile) + data_packed
+		return profile
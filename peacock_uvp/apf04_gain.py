@@ -6,7 +6,9 @@
 # You may not distribute, transmit, display, reproduce, publish, license, create derivative works from, transfer or sell any information, software, products or services based on this code.
 # @author Stéphane Fischer, Alexandre Schaeffer, Marie Burckbuchler
 
-from math import pow
+from functools import lru_cache
+
+import numpy as np
 
 APF04_RECEPTION_CHAIN_CONSTANT_GAIN = 11.72 # dB (after DAC+LNA)
          # currently on hardware after 05/2021 the max value is 14.5 and depend on f0 (filter bandwidth)
@@ -17,6 +19,9 @@ APF04_CODE_MAX_USER = 4095
 APF04_CODE_MIN_USER = -4096
 APF04_CODE_MIN_APPLIED = 50
 
+# number of gain tables kept by gain_table (least recently used are evicted)
+GAIN_TABLE_CACHE_SIZE = 64
+
 
 def convert_dB_m2code(_gain_dB, _r_dvol):
     """Conversion of gain slope a1 (in dB) to code ca1.
@@ -102,22 +107,59 @@ def calc_gain(_n_vol, _gain_ca0, _gain_ca1, _gain_max_ca0, _gain_max_ca1):
         _gain_max_ca1(int): code of the blind zone gain limit slope
 
     Returns:
-        list of gains in dB to apply to each cell of the profile
+        list of gains in dB to apply to each cell of the profile (a new list at each call,
+        see gain_table and gain_tuple for the cached tables)
     
     """
-    tab_gain = []
-    i = 0
-    while i <= (_n_vol - 1):
-        G = _convert_code2dB_trunc(_gain_ca0 + (i * _gain_ca1) / 16.)
-        G_max = _convert_code2dB_trunc(_gain_max_ca0 + (i * _gain_max_ca1) / 16.)
-        if (G >= G_max):
-            tab_gain.append(pow(10, G_max / 20.))
-        else:
-            tab_gain.append(pow(10, G / 20.))
-        i = i + 1
+    return gain_table(_n_vol, _gain_ca0, _gain_ca1, _gain_max_ca0, _gain_max_ca1).tolist()
+
+
+def calc_gain_array(_n_vol, _gain_ca0, _gain_ca1, _gain_max_ca0, _gain_max_ca1):
+    """Compute the table of the gains applied to each cell of the profile (whole array computation)
+
+    Args:
+        same as calc_gain
+
+    Returns:
+        numpy array of the gains to apply to each cell of the profile
+    """
+    i = np.arange(_n_vol)
+    G = convert_code2dB(np.clip(_gain_ca0 + (i * _gain_ca1) / 16., APF04_CODE_MIN_APPLIED, APF04_CODE_MAX_APPLIED))
+    G_max = convert_code2dB(np.clip(_gain_max_ca0 + (i * _gain_max_ca1) / 16., APF04_CODE_MIN_APPLIED, APF04_CODE_MAX_APPLIED))
+    return np.power(10, np.minimum(G, G_max) / 20.)
+
+
+@lru_cache(maxsize=GAIN_TABLE_CACHE_SIZE)
+def gain_table(_n_vol, _gain_ca0, _gain_ca1, _gain_max_ca0, _gain_max_ca1):
+    """Cached version of calc_gain_array.
+        With auto gain, the gain codes take only a few values, so the table is
+        usually computed once. Hit/miss counters are given by gain_table.cache_info().
+
+    Args:
+        same as calc_gain (the arguments must be hashable, e.g. int)
+
+    Returns:
+        read-only numpy array of the gains to apply to each cell of the profile
+    """
+    tab_gain = calc_gain_array(_n_vol, _gain_ca0, _gain_ca1, _gain_max_ca0, _gain_max_ca1)
+    tab_gain.setflags(write=False)
     return tab_gain
 
 
+@lru_cache(maxsize=GAIN_TABLE_CACHE_SIZE)
+def gain_tuple(_n_vol, _gain_ca0, _gain_ca1, _gain_max_ca0, _gain_max_ca1):
+    """Cached table of gain_table as a tuple of floats, for the cell by cell conversions
+        (indexing a tuple is faster than indexing a numpy array).
+
+    Args:
+        same as calc_gain (the arguments must be hashable, e.g. int)
+
+    Returns:
+        tuple of the gains to apply to each cell of the profile
+    """
+    return tuple(gain_table(_n_vol, _gain_ca0, _gain_ca1, _gain_max_ca0, _gain_max_ca1).tolist())
+
+
 def _truncate(value, limit_max, limit_min):
     """Troncate value with min/max limit
 
@@ -0,0 +1,174 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# @copyright  this code is the property of Ubertone.
+# You may use this code for your personal, informational, non-commercial purpose.
+# You may not distribute, transmit, display, reproduce, publish, license, create derivative works from, transfer or sell any information, software, products or services based on this code.
+# @author Stéphane Fischer
+
+import os
+import struct
+import queue
+import threading
+import logging
+from datetime import timezone
+from time import perf_counter
+
+import numpy as np
+
+from .apf04_config_hw import ConfigHw
+from .apf04_exception import apf04_error, apf04_exception
+
+# IQ file layout (little endian) :
+#   file header : IQ_FILE_HEADER + configuration words (ConfigHw.to_list)
+#   blocks      : timestamp (ms since 1970) + n_tir x n_vol x (I, Q) int16, see iq_block_dtype
+IQ_MAGIC = b"APF04IQ\x00"
+IQ_FORMAT_VERSION = 1
+
+# magic, format version, C version, f_sys, number of configuration words, n_tir, n_vol
+IQ_FILE_HEADER = struct.Struct("<8sHhdHHH")
+
+def iq_block_dtype(_n_tir, _n_vol, _byteorder='<'):
+	""" @brief numpy dtype of an IQ block of the IQ files
+	"""
+	return np.dtype([("timestamp", _byteorder+"i8"), ("iq", _byteorder+"i2", (_n_tir, _n_vol, 2))])
+
+def decode_iq(_raw, _n_tir, _n_vol, _byteorder='>', _out=None):
+	""" @brief convert IQ samples (I, Q words of each cell of each shot) in complex numbers
+	@param _raw : bytes-like (as transmitted : big endian) or int16 array (..., n_tir, n_vol, 2)
+	@param _byteorder : byte order of _raw if it is bytes-like
+	@param _out : complex64 array (..., n_tir, n_vol) to fill, allocated if None
+	@return complex64 array (..., n_tir, n_vol)
+
+	The words are converted in a single pass, without intermediate arrays.
+	"""
+	words = _raw if isinstance(_raw, np.ndarray) else np.frombuffer(_raw, dtype=_byteorder+"i2")
+	if words.size == 2*_n_tir*_n_vol:
+		words = words.reshape(_n_tir, _n_vol, 2)
+	else:
+		words = words.reshape(-1, _n_tir, _n_vol, 2)
+	if _out is None:
+		_out = np.empty(words.shape[:-1], dtype=np.complex64)
+	# real and imaginary parts are consecutive float32
+	np.copyto(_out.view(np.float32).reshape(words.shape), words)
+	return _out
+
+def _to_ms(_time):
+	return int(round(_time.replace(tzinfo=timezone.utc).timestamp()*1000))
+
+def read_iq_file(_path):
+	""" @brief open an IQ file
+	@return (ConfigHw, C version, blocks) blocks being a read-only memory map of iq_block_dtype
+	(blocks["iq"] can be converted with decode_iq)
+	"""
+	with open(_path, "rb") as file:
+		head = file.read(IQ_FILE_HEADER.size)
+		if len(head) < IQ_FILE_HEADER.size:
+			raise apf04_error(5003, "not an IQ file (too short)")
+		magic, version, version_c, f_sys, n_words, n_tir, n_vol = IQ_FILE_HEADER.unpack(head)
+		if magic != IQ_MAGIC or version != IQ_FORMAT_VERSION:
+			raise apf04_error(5003, "not an IQ file (format %s version %d)"%(magic, version))
+		config = ConfigHw(f_sys)
+		config.from_list(list(struct.unpack("<%dh"%n_words, file.read(2*n_words))))
+	offset = IQ_FILE_HEADER.size + 2*n_words
+	dtype = iq_block_dtype(n_tir, n_vol)
+	# a block being written when the file was closed is ignored
+	n_blocks = (os.path.getsize(_path) - offset)//dtype.itemsize
+	if not n_blocks:
+		return config, version_c, np.zeros(0, dtype=dtype)
+	return config, version_c, np.memmap(_path, dtype=dtype, mode="r", offset=offset, shape=(n_blocks,))
+
+
+class Apf04IQRecorder ():
+	""" @brief acquisition of IQ blocks written to a file
+
+	The IQ blocks are fetched in buffers of a pool and written to the file by a
+	dedicated thread : a block is written while the next one is measured and
+	transferred. The memory is allocated once (n_buffers blocks).
+
+	The configuration must already be written and selected in the device.
+	"""
+	def __init__(self, _driver, _config, _path, _n_buffers=4):
+		""" @brief create the file
+		@param _driver : Apf04Driver instance (connected, with its address dict, and IQ buffer)
+		@param _config : ConfigHw of the selected configuration
+		@param _path : IQ file (overwritten)
+		@param _n_buffers : number of blocks buffered between the acquisition and the file
+		"""
+		self.driver = _driver
+		self.config = _config
+		self.n_tir = _config.n_tir
+		self.n_vol = _config.n_vol
+		dtype = iq_block_dtype(self.n_tir, self.n_vol)
+		self._free = queue.Queue()
+		self._full = queue.Queue()
+		for _ in range(_n_buffers):
+			self._free.put(np.zeros(1, dtype=dtype))
+
+		config_words = _config.to_bytes()
+		self._file = open(_path, "wb")
+		self._file.write(IQ_FILE_HEADER.pack(IQ_MAGIC, IQ_FORMAT_VERSION, _driver.version_c, _config.f_sys, \
+			len(config_words)//2, self.n_tir, self.n_vol) + config_words)
+		self._writer = threading.Thread(target=self._write, name="apf04_iq_writer", daemon=True)
+		self._writer.start()
+
+		self.blocks = 0
+		self.errors = 0
+		# time spent waiting for a free buffer (the file is slower than the acquisition)
+		self.io_wait_time = 0.
+		# error of the writer thread (the blocks are then dropped)
+		self.error = None
+
+	def record (self, _count):
+		""" @brief measure and write _count IQ blocks
+		@return number of blocks recorded so far (the blocks which failed are skipped)
+		"""
+		for _ in range(_count):
+			start = perf_counter()
+			buffer = self._free.get()
+			self.io_wait_time += perf_counter() - start
+			if self.error is not None:
+				raise apf04_error(5004, "IQ file not written : %s"%self.error)
+			block = buffer[0]
+			try:
+				self.driver.act_meas_IQ()
+				# the words are received directly in the buffer, swapped by the writer thread
+				self.driver.read_IQ_raw(self.n_tir, self.n_vol, block["iq"])
+			except apf04_exception as ae:
+				logging.info("IQ acquisition: %s", ae)
+				self.errors += 1
+				self._free.put(buffer)
+				continue
+			block["timestamp"] = _to_ms(self.driver.timestamp_iq)
+			self._full.put(buffer)
+			self.blocks += 1
+		return self.blocks
+
+	def close (self):
+		""" @brief write the blocks left and close the file
+		"""
+		if self._writer is not None:
+			self._full.put(None)
+			self._writer.join()
+			self._writer = None
+			self._file.close()
+
+	def __enter__(self):
+		return self
+
+	def __exit__(self, *args):
+		self.close()
+
+	def _write (self):
+		while True:
+			buffer = self._full.get()
+			if buffer is None:
+				return
+			# received in big endian
+			buffer["iq"].byteswap(inplace=True)
+			try:
+				self._file.write(buffer.data)
+			except OSError as e:
+				logging.error("IQ file: %s", e)
+				self.error = e
+			self._free.put(buffer)
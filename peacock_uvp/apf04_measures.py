@@ -11,16 +11,40 @@ from array import *
 from struct import calcsize, unpack
 from math import sqrt, pi, pow
 
-from .apf_timestamp import decode_timestamp
-from .apf04_gain import _convert_code2dB_trunc, convert_code2dB_m, convert_code2dB, calc_gain
+import numpy as np
 
+from .apf_timestamp import decode_timestamp, decode_timestamps
+from .apf04_gain import _convert_code2dB_trunc, convert_code2dB_m, convert_code2dB, gain_table, gain_tuple
+
+
+# @brief layout of one cell of a profile (as transmitted, once swapped in little endian)
+CELL_DTYPE = np.dtype([('velocity', '<i2'), ('std', '<i2'), ('amplitude', '<i2'), ('snr', '<i2')])
+
+# code used by the device for a non valid value
+INVALID_CODE = -32768
+
+# @brief scalars of the profile header, in the order of the device memory
+HEADER_SCALARS = ['pitch', 'roll', 'temp', 'sound_speed', 'gain_ca0', 'gain_ca1', 'noise_g_max', 'noise_g_mid']
+
+def profile_dtype(n_vol, _byteorder='<'):
+	""" @brief layout of a raw profile as returned by Apf04Driver.read_profile
+	(timestamp words, header scalars, then n_vol cells)
+	@param n_vol : number of cells in the profile
+	@param _byteorder : byte order of the header scalars and cells ('<' once swapped, '>' as transmitted by the device)
+	"""
+	return np.dtype([('timestamp', '<i2', (3,))] \
+		+ [(name, _byteorder+'i2') for name in HEADER_SCALARS] \
+		+ [('cells', CELL_DTYPE.newbyteorder(_byteorder), (n_vol,))])
 
 # @brief Utilise une frame pour récupérer un profil voulu (format UDT005)
 # # une ligne de profil dans raw UDT005 contient
 # le raw profile contient un header puis le profil codé
 # ce header contient des scalaires qu'il faut aussi enregistrer
 # @param _data : le bloc de données binaire
-def extract_measures (data, config_hw) :
+# @param _as_array : if True, the cells are decoded as a whole with numpy and
+#   the profile values are returned as float arrays (invalid values are NaN
+#   instead of None)
+def extract_measures (data, config_hw, _as_array=False) :
 	size = len(data)
 	data_dict = {
 		"velocity" : [],
@@ -53,6 +77,12 @@ def extract_measures (data, config_hw) :
 	if (size-(head_size+scalars_size))/4/2 != n_vol:
 		raise Exception('volume number', "expected %d volumes, but profile data contains %d"%(n_vol, ((size-(head_size+scalars_size))/4/2)))
 
+	if _as_array:
+		cells = np.frombuffer(data, dtype=CELL_DTYPE, count=n_vol, offset=head_size+scalars_size)
+		tab_gain = gain_table(n_vol, data_dict['gain_ca0'], data_dict['gain_ca1'], blind_ca0, blind_ca1)
+		data_dict.update(conversion_profile_array(cells, sound_speed, n_avg, c_prf, tab_gain))
+		return data_dict
+
 	tab_size = calcsize('h')
 	offset = head_size+scalars_size
 	for i in range(n_vol):
@@ -73,6 +103,41 @@ def extract_measures (data, config_hw) :
 
 	return data_dict
 
+# @brief Decode a batch of profiles recorded with the same configuration
+# @param data : concatenated raw profiles (bytes-like), a sequence of raw profiles
+#   or a structured array of profile_dtype (e.g. a view on a recording)
+# @param config_hw : configuration used for all the profiles
+# @return dict with (n_profiles x n_vol) float64 arrays for velocity, std, amplitude
+#   and snr, and per profile vectors for the timestamp and the header scalars
+def extract_measures_batch (data, config_hw) :
+	if not isinstance(data, (bytes, bytearray, memoryview, np.ndarray)):
+		data = b''.join(data)
+
+	n_vol = config_hw.n_vol
+	dtype = profile_dtype(n_vol)
+	if isinstance(data, np.ndarray) and data.dtype.names:
+		if data.dtype != dtype:
+			raise Exception('volume number', "profiles with %d volumes expected"%n_vol)
+		records = data
+	else:
+		if len(data) % dtype.itemsize:
+			raise Exception('volume number', "data size %d is not a multiple of the size of a profile with %d volumes (%d bytes)"%(len(data), n_vol, dtype.itemsize))
+		records = np.frombuffer(data, dtype=dtype)
+
+	data_dict = {}
+	data_dict["timestamp"] = decode_timestamps(records['timestamp'])
+	for name in HEADER_SCALARS:
+		if name != 'sound_speed':
+			data_dict[name] = records[name].copy()
+
+	# gains take only a few values: one gain table per (gain_ca0, gain_ca1) couple
+	gains, index = np.unique(np.stack((records['gain_ca0'], records['gain_ca1']), axis=1), axis=0, return_inverse=True)
+	tab_gain = np.array([gain_table(n_vol, ca0, ca1, config_hw.blind_ca0, config_hw.blind_ca1) for ca0, ca1 in gains.tolist()]).reshape(len(gains), n_vol)
+
+	data_dict.update(conversion_profile_array(records['cells'], records['sound_speed'][:, np.newaxis], \
+		config_hw.n_avg, config_hw.c_prf, tab_gain[index.reshape(-1)]))
+	return data_dict
+
 def conversion_profile(data_dict, sound_speed, n_vol, n_avg, c_prf, gain_ca0, gain_ca1, blind_ca0, blind_ca1):
 	sat = array('f')
 	ny_jump = array('f')
@@ -80,7 +145,7 @@ def conversion_profile(data_dict, sound_speed, n_vol, n_avg, c_prf, gain_ca0, ga
 	v_ref = 1.25
 	fact_code2velocity = sound_speed / (c_prf * 65535.)
 	# print("factor code to velocity %f"%fact_code2velocity)
-	tab_gain = calc_gain(n_vol, gain_ca0, gain_ca1, blind_ca0, blind_ca1)
+	tab_gain = gain_tuple(n_vol, gain_ca0, gain_ca1, blind_ca0, blind_ca1)
 	for i in range(n_vol):
 		# Velocity standard deviation
 		if data_dict['std'][i] == -32768:
@@ -113,6 +178,29 @@ def conversion_profile(data_dict, sound_speed, n_vol, n_avg, c_prf, gain_ca0, ga
 			sat.append(False)
 		data_dict['amplitude'][i] *= ((v_ref*2)/4096) / sqrt(n_avg) / tab_gain[i]
 
+def conversion_profile_array(cells, sound_speed, n_avg, c_prf, tab_gain):
+	""" @brief same conversion as conversion_profile, done on whole arrays
+	@param cells : structured array of coded cells (see CELL_DTYPE), one profile (n_vol)
+	  or a batch of profiles (n_profiles x n_vol)
+	@param sound_speed : sound speed, scalar or array broadcastable against cells
+	@param tab_gain : gains applied to each cell (see gain_table), broadcastable against cells
+	@return dict of float64 arrays (NaN where the value is not valid)
+	"""
+	v_ref = 1.25
+	fact_code2velocity = sound_speed / (c_prf * 65535.)
+
+	velocity = cells['velocity']
+	std = cells['std']
+	snr = cells['snr']
+	return {
+		"velocity" : np.where(velocity == INVALID_CODE, np.nan, velocity*fact_code2velocity),
+		# the sign of std is the nyquist jump flag
+		"std" : np.where(std == INVALID_CODE, np.nan, np.abs(std.astype(np.float64))*fact_code2velocity),
+		"snr" : np.where(snr == INVALID_CODE, np.nan, snr/10.),
+		# the sign of amplitude is the saturation flag
+		"amplitude" : np.abs(cells['amplitude'].astype(np.float64)) * (((v_ref*2)/4096) / sqrt(n_avg) / tab_gain),
+	}
+
 def conversion_scalar(data_dict):
 
 	# convert temperature to Kelvin
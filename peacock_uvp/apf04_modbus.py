@@ -7,14 +7,23 @@
 # @author Stéphane Fischer, Marie Burckbuchler
 
 import struct # Struct est utilisée pour extraite les données séries  
-import serial # Utilisé pour récuperer les donnée vennant de la liaison Série RS485
+# pyserial (liaison Série RS485) is only imported when a port is opened (see connect) :
+# the I/O paths catch OSError, the base class of serial.SerialException
 from sys import platform
 import traceback
 import logging
-from time import time, sleep
+import select
+from time import time, sleep, perf_counter
 
 from .apf04_exception import apf04_error, apf04_exception
-from .modbus_crc import crc16
+from .modbus_crc import crc16, crc16_update
+
+# time allowed to the device to answer when its processing time is not known (serial timeout)
+DEFAULT_TIMEOUT = 0.5
+# answer latency of the device and of the USB adapter, allowed for each read
+DEFAULT_LATENCY = 0.02
+# minimum period of the polling of an answer later than expected
+POLL_PERIOD = 0.0005
 
 def hex_print (_bytes):
 	""" @brief print a byte array in hexadecimal string
@@ -34,11 +43,11 @@ def autodetect_usb_device() :
 		import serial.tools.list_ports as lPort
 		reslt = lPort.comports()
 		for res in reslt:
-			logging.debug("checking %s / %s"%(res[0],res[2]))
+			logging.debug("checking %s / %s", res[0],res[2])
 			# get USB device id
 			try:
 				device_id = res[2].split("VID:PID=")[1].split(" ")[0]
-				logging.debug("usb_device_id = %s"%device_id)
+				logging.debug("usb_device_id = %s", device_id)
 			except:
 				device_id = None
 			
@@ -60,36 +69,75 @@ def autodetect_usb_device() :
 	
 	return usb_device
 
+def build_read_query (_slave_addr, _addr, _size):
+	""" @brief build the modbus frame reading words (function 3)
+	@param _slave_addr : modbus address of the device
+	@param _addr : data address
+	@param _size : number of words to read
+	@return : frame (bytes)
+	"""
+	query = struct.pack(">BBHh", _slave_addr, 0x03, _addr, _size)
+	return query + struct.pack(">H", crc16(query))
+
+def build_write_query (_slave_addr, _addr, _data):
+	""" @brief build the modbus frame writing words (function 16)
+	@param _slave_addr : modbus address of the device
+	@param _addr : data address
+	@param _data : list of words
+	@return : frame (bytes)
+	"""
+	query = struct.pack(">BBHhB%sh"%len(_data), _slave_addr, 16, _addr, len(_data), 2*len(_data), *_data)
+	return query + struct.pack(">H", crc16(query))
+
 class Apf04Modbus ():
 	"""	@brief Modbus communication layer
 	
 	modbus est en big-endian (défaut)
 	l'adressage est fait en 16 bits.
 	"""
-	def __init__(self, _baudrate=None, _dev=None):
+	def __init__(self, _baudrate=None, _dev=None, _slave_addr=0x04, _ser=None):
 		""" @brief Initialisation de la couche communication de l'instrument
 		@param _baudrate : vitesse de communication, 57600 bits par seconde par defaut
+		@param _dev : serial port (detected automatically if None)
+		@param _slave_addr : device address on modbus (0x04 by default)
+		@param _ser : serial port already opened (see attach_port), _baudrate is then not used
+		  and the port is not detected
 
 		_baudrate peut avoir pour valeur 230400 115200 57600 ...
 		"""
 		# Default device address on modbus
-		self.apf04_addr = 0x04
+		self.apf04_addr = _slave_addr
+		# margin added to the expected time of each answer (see __read_into__)
+		self.latency = DEFAULT_LATENCY
+		# the serial port is closed with the instance unless it is shared (see attach_port)
+		self._own_port = True
 
-		#la lecture et l'écriture de bloc sont segmentées en blocs de 123 mots 
+		# l'écriture de bloc est segmentée en blocs de 123 mots, la lecture en blocs de 125 mots
 		# Modbus limite les blocs à un maximum de 123 mots en ecriture et 125 mots en lecture
 		self.max_seg_size = 123
+		self.max_read_seg_size = 125
+
+		# preallocated buffers used by the read path (no allocation per frame)
+		self._query = bytearray(8)
+		self._head = bytearray(3)
+		self._crc = bytearray(2)
+		# buffer pool used by read_buf_i16_into when the caller gives no buffer
+		self._pool = bytearray()
 
 		logging.debug("Platform is %s", platform)
 
 		self.usb_device = _dev
 
-		if self.usb_device is None :
-			print ("Getting the USB device automatically")
-			self.usb_device = autodetect_usb_device()
+		if _ser is not None:
+			self.attach_port(_ser)
+		else:
+			if self.usb_device is None :
+				print ("Getting the USB device automatically")
+				self.usb_device = autodetect_usb_device()
 
-		logging.debug("usb_device is at %s with baudrate %s"%(self.usb_device, _baudrate))
-		if _baudrate :
-			self.connect(_baudrate)
+			logging.debug("usb_device is at %s with baudrate %s", self.usb_device, _baudrate)
+			if _baudrate :
+				self.connect(_baudrate)
 
 		# In order to reduce serial latency of the linux driver, you may set the ASYNC_LOW_LATENCY flag :
 		# setserial /dev/<tty_name> low_latency
@@ -97,19 +145,30 @@ class Apf04Modbus ():
 		logging.debug("end init")
 
 	def connect (self, _baudrate):
+		import serial
 		try :
 			# Create an instance of the Peacock's driver at a given baudrate
-			self.ser = serial.Serial(self.usb_device, _baudrate, timeout=0.5, \
+			self.ser = serial.Serial(self.usb_device, _baudrate, timeout=DEFAULT_TIMEOUT, \
 					bytesize=8, parity='N', stopbits=1, xonxoff=0, rtscts=0)
-			# serial timeout is set to 500 ms. This can be changed by setting 
-			#   self.ser.timeout to balance between performance and efficiency
-		except serial.serialutil.SerialException : 
+			# serial timeout is set to 500 ms. It is only used by ports which can not tell
+			#   the number of bytes received (see __read_into__)
+		except serial.SerialException : 
 			raise apf04_error (1005, "Unable to connect to the device.")
 
+	def attach_port (self, _ser):
+		""" @brief use a serial port opened elsewhere (e.g. several devices on a RS485 bus)
+		@param _ser : opened serial port (serial.Serial or compatible)
+
+		The port is not closed by this instance.
+		"""
+		self.ser = _ser
+		self._own_port = False
+
 	def __del__(self):
 		""" @brief close serial port if necessary """
 		try : # au cas où le constructeur a planté
-			self.ser.close()
+			if self._own_port:
+				self.ser.close()
 		except :
 			pass
 
@@ -123,7 +182,7 @@ class Apf04Modbus ():
 		# Scan available baudrates for the Peacock UVP
 		for baudrate in [57600, 115200, 230400, 750000]:
 			try:
-				logging.debug("try if baudrate = %d"%baudrate)
+				logging.debug("try if baudrate = %d", baudrate)
 				self.connect(baudrate)
 				# Read the firmware version
 				self.read_i16(0)
@@ -153,37 +212,93 @@ class Apf04Modbus ():
 		if _begin>addr_ram_end:
 			assert _begin!=addr_reg_action and _size!=1, "Warning, access at %d, size= %d bytes not allowed"%(_begin, _size)
 
-	def __read__(self, _size, _timeout=0.0):
+	def frame_time(self, _n_bytes):
+		""" @brief transmission time of bytes on the serial line (8N1 : 10 bits per byte)
+		"""
+		baudrate = getattr(self.ser, "baudrate", None)
+		# ports without baudrate (e.g. in-memory) are instantaneous
+		return 10.*_n_bytes/baudrate if baudrate else 0.
+
+	def __read__(self, _size, _timeout=0.0, _start=None):
 		""" @brief Low level read method
 		@param _size number of bytes to read
+		@param _timeout additional time allowed to the device to answer
+		@param _start expected time (perf_counter) of the first byte, now by default
 		"""
-		if _size == 0:
+		data = bytearray(_size)
+		self.__read_into__(memoryview(data), _timeout, _start)
+		return bytes(data)
+
+	def __read_into__(self, _view, _timeout=0.0, _start=None):
+		""" @brief Low level read method, filling a given buffer
+		@param _view : writable buffer (memoryview) with the size of the data to read
+		@param _timeout additional time allowed to the device to answer
+		@param _start expected time (perf_counter) of the first byte, now by default
+
+		The answer is expected at _start plus its transmission time at the baudrate. It
+		fails at this time plus the latency (self.latency) and _timeout.
+		"""
+		size = len(_view)
+		if size == 0:
 			raise apf04_error(2002, "ask to read null size data." )
 
 		try :
-			read_data = b''
-			start_time = time()
-			# the read of modbus is not interuptible
-			while (True):
-				read_data += self.ser.read(_size)
-				if len (read_data) == _size or time() - start_time > _timeout:
-					break
-
-		except serial.serialutil.SerialException:
-			#self.log("hardware apparently disconnected")
-			#read_data = b''
+			if hasattr(type(self.ser), "in_waiting"):
+				received = self.__wait_into__(_view, _timeout, _start)
+			else:
+				# port which can not tell the number of bytes received : blocking reads with the serial timeout
+				received = 0
+				start_time = time()
+				# the read of modbus is not interuptible
+				while (True):
+					received += self.ser.readinto(_view[received:])
+					if received == size or time() - start_time > _timeout:
+						break
+
+		except OSError:
 			raise apf04_error(1010, "Hardware apparently disconnected." )
 
-		if len (read_data) != _size :
-			if len (read_data) == 0:
+		if received != size :
+			if received == 0:
 				logging.debug ("WARNING timeout, no answer from device")
 				raise apf04_exception(2003, "timeout : device do not answer (please check cable connexion, timeout or baudrate)" )
 			else :
-				logging.debug ("WARNING, uncomplete answer from device (%d/%d)"%(len (read_data), _size))
-				raise apf04_exception(2004, "timeout : uncomplete answer from device (please check timeout or baudrate) (%d/%d)"%(len (read_data), _size))
-
-		return read_data
+				logging.debug("WARNING, uncomplete answer from device (%d/%d)", received, size)
+				raise apf04_exception(2004, "timeout : uncomplete answer from device (please check timeout or baudrate) (%d/%d)"%(received, size))
 
+	def __wait_into__(self, _view, _timeout, _start):
+		""" @brief read the bytes as they are received, until the deadline
+		@return number of bytes read
+		"""
+		size = len(_view)
+		now = perf_counter()
+		expected_end = (now if _start is None else _start) + self.frame_time(size)
+		deadline = max(now, expected_end) + self.latency + _timeout
+		fileno = None
+		received = 0
+		while True:
+			n_bytes = self.ser.in_waiting
+			if n_bytes:
+				received += self.ser.readinto(_view[received:received+min(n_bytes, size-received)])
+				if received == size:
+					return received
+			now = perf_counter()
+			if now >= deadline:
+				return received
+			if not received and fileno is None:
+				try:
+					fileno = self.ser.fileno()
+				except (AttributeError, ValueError):
+					# no file descriptor (e.g. windows)
+					fileno = False
+			if not received and fileno:
+				# woken up by the first byte
+				select.select([fileno], [], [], deadline - now)
+			elif now < expected_end:
+				sleep(min(expected_end, deadline) - now)
+			else:
+				# later than expected : poll with a period growing with the delay
+				sleep(min(max(POLL_PERIOD, self.frame_time(size-received), 0.1*(now-expected_end)), deadline - now))
 
 	############## Read functions ###############################################
 
@@ -213,41 +328,53 @@ class Apf04Modbus ():
 		@param _size : number of word to read
 		@return : byte array
 		"""
-		assert (_size <= self.max_seg_size)  # segment de 125 mots (max en lecture)
+		data = bytearray(2*_size)
+		self.read_seg_16_into(_addr, _size, memoryview(data))
+		return bytes(data)
+
+
+	def read_seg_16_into(self, _addr, _size, _view):
+		""" @brief Low level read (in a single modbus frame) written in a given buffer
+		@param _addr : data address (given in bytes)
+		@param _size : number of word to read
+		@param _view : writable buffer (memoryview) of at least 2*_size bytes, the data are written at its beginning
+		"""
+		assert (_size <= self.max_read_seg_size)  # segment de 125 mots (max en lecture)
 		
-		logging.debug ("reading %d words at %d"%(_size, _addr))
+		logging.debug("reading %d words at %d", _size, _addr)
 		# on utilise la fonction modbus 3 pour la lecture des octets
 		#self.__check_addr_range(_addr, 2 * _size)
 
 		# request read 
-		read_query = struct.pack(">BBHh",self.apf04_addr, 0x03, _addr, _size )
-		read_query += struct.pack(">H",crc16 (read_query) )
-		#print ("read query = ")
-		#hex_print(read_query)
+		struct.pack_into(">BBHh", self._query, 0, self.apf04_addr, 0x03, _addr, _size)
+		struct.pack_into(">H", self._query, 6, crc16(memoryview(self._query)[:6]))
 		try :
-			self.ser.write(read_query)
-		except serial.serialutil.SerialException:
+			sent = perf_counter()
+			self.ser.write(self._query)
+		except OSError:
 			#self.log("hardware apparently disconnected")
 			# TODO traiter les différentes erreurs, se mettre en 3 MBaud sur R0W (bcp de buffer overflow !)
 			raise apf04_error(1010, "Hardware apparently disconnected." )
 
-		# read answer
-		slave_response = self.__read__(3)
-
-		if slave_response[1] != 3:
-			logging.info ("WARNING error while reading %s"%slave_response)
+		# read answer : header, then the data directly at their destination, then the crc
+		head = self._head
+		self.__read_into__(memoryview(head), _start=sent+self.frame_time(len(self._query)))
 
-		slave_response += self.__read__(slave_response[2]+2)
+		if head[1] & 0x80:
+			# exception answer : exception code + crc
+			self.__read__(2)
+			raise apf04_exception(2006, "device answered with exception code %d"%head[2])
+		if head[1] != 3 or head[2] != 2*_size:
+			logging.info("WARNING error while reading %s", head)
+			self.__read__(head[2]+2)
+			raise apf04_exception(2005, "unexpected answer from device (function %d, %d bytes)"%(head[1], head[2]))
 
-		#print ("slave answer = ")
-		#hex_print(slave_response)
+		data = _view[:2*_size]
+		self.__read_into__(data)
+		self.__read_into__(memoryview(self._crc))
 
-		# check crc
-		#print ("%X"%crc16 (slave_response[0:-2]))
-		#print ("%X"%struct.unpack(">H",slave_response[-2:]))
-		assert (crc16 (slave_response[0:-2]) == struct.unpack(">H",slave_response[-2:])[0])
-
-		return slave_response[3:-2]
+		# check crc (the low byte is transmitted first)
+		assert (crc16_update(crc16_update(0xffff, head), data) == self._crc[0] | (self._crc[1] << 8))
 
 
 	def read_buf_i16 (self, _addr , _size):
@@ -258,34 +385,49 @@ class Apf04Modbus ():
 
 		Note : data are transmitted in big endian
 		"""
-		data = b''
+		return bytes(self.read_buf_i16_into(_addr, _size))
+
+
+	def read_buf_i16_into (self, _addr , _size, _buf=None):
+		""" @brief Read buffer, each segment being written at its final offset
+		@param _addr : data address (given in bytes)
+		@param _size : number of word to read
+		@param _buf : writable buffer (bytearray, memoryview ...) of at least 2*_size bytes.
+		  If not given, a buffer pool owned by the instance is used (and overwritten by the next call)
+		@return : memoryview on the data read
+
+		Note : data are transmitted in big endian
+		"""
+		if _buf is None:
+			if len(self._pool) < 2*_size:
+				self._pool = bytearray(2*_size)
+			_buf = self._pool
+		view = memoryview(_buf).cast('B')[:2*_size]
+
 		addr = _addr
+		offset = 0
 		remind = _size
-		logging.debug ("reading %d words at %d"%(_size, _addr))
+		logging.debug("reading %d words at %d", _size, _addr)
 		while remind :
-			logging.debug ("remind = %s ; self.max_seg_size = %s ; div : %s"%(remind, self.max_seg_size, remind/self.max_seg_size))
-			if remind/self.max_seg_size>=1:
-				logging.debug ("read max_seg_size")
-				seg_size=self.max_seg_size
-			else :
-				seg_size = remind
-				logging.debug ("read remind")
-			data+=self.read_seg_16(addr , seg_size)
+			seg_size = min(remind, self.max_read_seg_size)
+			self.read_seg_16_into(addr , seg_size, view[offset:])
 			addr+=seg_size #  addr en mots de 16 bits
+			offset+=2*seg_size
 			remind-=seg_size
-		#print( "__Read_buf : %d readed"%(int(addr - _addr)) )
-		return data
+		return view
 
 
 	############## Write functions ##############################################
 
-	def write_i16 (self, _value, _addr, _timeout=0.0):
+	def write_i16 (self, _value, _addr, _timeout=0.0, _delay=0.0):
 		""" @brief Write one word (signed 16 bits)
 		@param _value : value of the word
 		@param _addr : destination data address (given in bytes)
+		@param _timeout : additional time allowed to the device to answer
+		@param _delay : expected processing time of the device before its answer (e.g. action)
 		"""
 		try:
-			self.write_buf_i16 ([_value], _addr, _timeout)
+			self.write_buf_i16 ([_value], _addr, _timeout, _delay)
 		except apf04_exception as ae:
 			raise ae # apf04_exception are simply raised upper
 		except :
@@ -293,39 +435,37 @@ class Apf04Modbus ():
 			raise apf04_error(3000, "write_i16 : FAIL to write 0%04x at %d\n"%(_value, _addr))
 
 
-	def write_buf_i16 (self, _data, _addr, _timeout=0.0):
+	def write_buf_i16 (self, _data, _addr, _timeout=0.0, _delay=0.0):
 		""" @brief Write buffer 
 		@param _data : list of words (max size : 123 words)
 		@param _addr : data address (given in bytes)
+		@param _timeout : additional time allowed to the device to answer
+		@param _delay : expected processing time of the device before its answer (e.g. action)
 		"""
 		# ATTENTION ici on ne gère pas de boucle sur un "write_seg_16" car on n'a pas besoin d'écrire de gros blocs de données
 		# segmenter en blocs de 123 mots (max en ecriture)
 		assert (len(_data)<=self.max_seg_size)
 		try:
 			# request read 
-			write_query = struct.pack(">BBHhB%sh"%len(_data),self.apf04_addr, 16, _addr, len(_data), 2*len(_data), *_data )
-			write_query += struct.pack(">H",crc16 (write_query) )
+			write_query = build_write_query(self.apf04_addr, _addr, _data)
 
 			try:
 				#print (write_query)
+				sent = perf_counter()
 				self.ser.write(write_query)
-			except serial.serialutil.SerialException:
+			except OSError:
 				logging.error("hardware apparently disconnected")
 				raise apf04_error(3004, "write_buf_i16 : hardware apparently disconnected")
 
 			# read answer
-			slave_response = self.__read__(2, _timeout)
-			# TODO 1 : format de la trame d'erreur et codes d'erreurs effectivement traités
+			slave_response = self.__read__(2, _timeout, sent+self.frame_time(len(write_query))+_delay)
 			if slave_response[1] == 16 :
 				slave_response += self.__read__(6)
 				# TODO sur le principe il faudrait vérifier que le bon nombre de mots a été écrit
 			else:
-				# TODO traiter les erreurs selon doc 
-				size = struct.unpack("B",self.__read__(1))[0]
-				print ("size following : %d"%size)
-				self.__read__(size)
-				print("error while writing")
-				print (slave_response)
+				# exception answer : exception code + crc (the words are not written)
+				code = self.__read__(3)[0]
+				raise apf04_exception(3002, "write_buf_i16 : device answered with exception code %d"%code)
 
 		except apf04_exception as ae:
 			raise ae # apf04_exception are simply raised upper
@@ -0,0 +1,110 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# @copyright  this code is the property of Ubertone.
+# You may use this code for your personal, informational, non-commercial purpose.
+# You may not distribute, transmit, display, reproduce, publish, license, create derivative works from, transfer or sell any information, software, products or services based on this code.
+# @author Stéphane Fischer
+
+import logging
+import queue
+from time import perf_counter
+
+from .apf04_acquisition import Apf04Acquisition, OVERFLOW_BLOCK, MAX_CONSECUTIVE_ERRORS
+from .apf04_measures import extract_measures
+
+class Apf04Pipeline (Apf04Acquisition):
+	""" @brief two stage pipeline : measure/fetch, then decode
+
+	The acquisition thread triggers the measurement of the profile k+1 as soon
+	as the bytes of the profile k are fetched, while the profile k is decoded
+	by a worker thread. The device is therefore kept busy while the host
+	converts the data.
+
+	The decoded profiles are given to the callback, or can be read by
+	iterating on the pipeline.
+	"""
+	def __init__(self, _driver, _config, _callback=None, _decoder=None, _n_slots=64, _overflow=OVERFLOW_BLOCK, _max_errors=MAX_CONSECUTIVE_ERRORS):
+		""" @brief create the pipeline
+		@param _driver : Apf04Driver instance (connected, with its address dict)
+		@param _config : ConfigHw of the selected configuration
+		@param _callback : function called with each decoded profile (if None, iterate on the pipeline)
+		@param _decoder : function converting a raw profile (default : extract_measures in array mode)
+		@param _n_slots : number of raw profiles which can be waiting for the decoding
+		@param _overflow : overflow policy of the raw profiles ring buffer
+		@param _max_errors : number of consecutive errors stopping the acquisition (see Apf04Acquisition)
+		"""
+		Apf04Acquisition.__init__(self, _driver, _config, _n_slots, _overflow, self._decode, _max_errors)
+		self.measures_callback = _callback
+		if _decoder is None:
+			_decoder = lambda data: extract_measures(data, _config, _as_array=True)
+		self.decoder = _decoder
+		self.output = None
+		if _callback is None:
+			# not bounded, so that stopping never waits for the reader
+			self.output = queue.Queue()
+
+		self.decoded = 0
+		self.decode_errors = 0
+		# time spent by the decoding thread (in seconds)
+		self.decode_time = 0.      # converting the profiles
+		self.decode_idle_time = 0. # waiting for a raw profile
+
+	def stats(self):
+		""" @brief achieved rate and time spent by each stage
+		@return dict
+		"""
+		elapsed = self.elapsed
+		return {
+			"profiles" : self.decoded,
+			"elapsed" : elapsed,
+			"profiles_per_s" : self.decoded/elapsed if elapsed else 0.,
+			"trigger_time" : self.trigger_time,
+			"fetch_time" : self.fetch_time,
+			"io_idle_time" : self.io_idle_time,
+			"backoff_time" : self.backoff_time,
+			"decode_time" : self.decode_time,
+			"decode_idle_time" : self.decode_idle_time,
+			"dropped" : self.dropped,
+			"errors" : self.errors,
+			"error" : None if self.error is None else str(self.error),
+			"decode_errors" : self.decode_errors,
+		}
+
+	def __iter__(self):
+		""" @brief iterate on the decoded profiles, until the acquisition is stopped and all the profiles are decoded
+		"""
+		assert self.output is not None, "decoded profiles are given to the callback"
+		while True:
+			measures = self.output.get()
+			if measures is None:
+				return
+			yield measures
+
+	def _dispatch(self):
+		try:
+			while True:
+				t0 = perf_counter()
+				data = self.ring.pop()
+				self.decode_idle_time += perf_counter()-t0
+				if data is None:
+					break
+				self.callback(data)
+		finally:
+			if self.output is not None:
+				self.output.put(None)
+
+	def _decode(self, _data):
+		t0 = perf_counter()
+		try:
+			measures = self.decoder(_data)
+		except Exception as e:
+			logging.error("decoding failed: %s", e)
+			self.decode_errors += 1
+			return
+		self.decode_time += perf_counter()-t0
+		self.decoded += 1
+		if self.output is not None:
+			self.output.put(measures)
+		else:
+			self.measures_callback(measures)
@@ -0,0 +1,68 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# @copyright  this code is the property of Ubertone.
+# You may use this code for your personal, informational, non-commercial purpose.
+# You may not distribute, transmit, display, reproduce, publish, license, create derivative works from, transfer or sell any information, software, products or services based on this code.
+# @author Stéphane Fischer
+
+import struct
+from functools import lru_cache
+
+# Modbus limits the reads to 125 words per frame
+MAX_READ_WORDS = 125
+# last address of the RAM, the registers above (version, action) are read one by one
+ADDR_RAM_END = 0x07FF
+# default number of unused words which can be read to merge two ranges in a single frame
+DEFAULT_MAX_GAP = 8
+
+def plan_reads(_registers, _max_gap=DEFAULT_MAX_GAP, _max_words=MAX_READ_WORDS):
+	""" @brief group registers in the fewest modbus read frames
+	@param _registers : dict name -> address, or name -> (address, number of words)
+	@param _max_gap : maximum number of unused words read between two registers of a frame
+	@param _max_words : maximum number of words in a frame
+	@return list of frames (address, number of words, ((name, offset in the frame, number of words), ...))
+	"""
+	items = []
+	for name, register in _registers.items():
+		if isinstance(register, tuple):
+			items.append((int(register[0]), int(register[1]), name))
+		else:
+			items.append((int(register), 1, name))
+	return _plan(tuple(sorted(items)), _max_gap, _max_words)
+
+@lru_cache(maxsize=64)
+def _plan(_items, _max_gap, _max_words):
+	frames = []
+	start = end = None
+	names = []
+	for addr, size, name in _items:
+		assert size <= _max_words, "register %s is too big for one frame"%name
+		if start is not None and addr <= ADDR_RAM_END and end - 1 <= ADDR_RAM_END \
+			and addr - end <= _max_gap and max(end, addr + size) - start <= _max_words:
+			end = max(end, addr + size)
+		else:
+			if start is not None:
+				frames.append((start, end - start, tuple(names)))
+			start, end, names = addr, addr + size, []
+		names.append((name, addr - start, size))
+	if start is not None:
+		frames.append((start, end - start, tuple(names)))
+	return tuple(frames)
+
+def read_registers(_modbus, _registers, _max_gap=DEFAULT_MAX_GAP):
+	""" @brief read registers with the fewest modbus frames
+	@param _modbus : Apf04Modbus instance
+	@param _registers : dict name -> address, or name -> (address, number of words)
+	@param _max_gap : maximum number of unused words read between two registers of a frame
+	@return dict name -> value (signed 16 bits, tuple of values for multi-words registers)
+	"""
+	values = {}
+	for addr, size, names in plan_reads(_registers, _max_gap, _modbus.max_read_seg_size):
+		words = struct.unpack(">%dh"%size, _modbus.read_seg_16(addr, size))
+		for name, offset, n_words in names:
+			if n_words == 1:
+				values[name] = words[offset]
+			else:
+				values[name] = words[offset:offset+n_words]
+	return values
@@ -0,0 +1,491 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# @copyright  this code is the property of Ubertone.
+# You may use this code for your personal, informational, non-commercial purpose.
+# You may not distribute, transmit, display, reproduce, publish, license, create derivative works from, transfer or sell any information, software, products or services based on this code.
+# @author Stéphane Fischer
+
+import os
+import mmap
+import struct
+import zlib
+import lzma
+from datetime import datetime, timezone
+
+import numpy as np
+
+from .apf04_addr_cmd import get_addr_dict
+from .apf04_config_hw import ConfigHw
+from .apf04_exception import apf04_error
+from .apf04_measures import profile_dtype, extract_measures_batch
+from .apf_timestamp import decode_timestamps
+
+# Recording file layout (little endian) :
+#   file header  : FILE_HEADER + configuration words (ConfigHw.to_list)
+#   chunks       : CHUNK_HEADER + payload (n_profiles raw profiles, as returned by Apf04Driver.read_profile),
+#                  padded to an even size
+# The file header and the chunk headers have even sizes : the profiles of the raw
+# chunks start at even offsets (aligned int16 views of the memory map).
+# The sidecar index (<file>.idx) has one INDEX_ENTRY per chunk. It can be rebuilt
+# from the chunk headers, the data file is the reference.
+MAGIC = b"APF04REC"
+CHUNK_MAGIC = b"CHNK"
+FORMAT_VERSION = 2
+INDEX_SUFFIX = ".idx"
+
+# magic, format version, C version (address map), f_sys, number of configuration words, profile size (bytes)
+FILE_HEADER = struct.Struct("<8sHhdHI")
+# magic, codec, number of profiles, payload size (bytes, without padding), first and last timestamps (ms since 1970), padding to 32 bytes
+CHUNK_HEADER = struct.Struct("<4sBIIqq3x")
+# first and last timestamps (ms since 1970), offset of the chunk header, number of profiles
+INDEX_ENTRY = struct.Struct("<qqQI")
+INDEX_DTYPE = np.dtype([("first", "<i8"), ("last", "<i8"), ("offset", "<u8"), ("n_profiles", "<u4")])
+
+# chunk payload codecs
+CODEC_RAW = 0        # raw profiles
+CODEC_DELTA_ZLIB = 1 # delta of each word between consecutive profiles, stored by column, then zlib
+CODEC_DELTA_LZMA = 2 # same with lzma (slower, smaller)
+CODECS = [CODEC_RAW, CODEC_DELTA_ZLIB, CODEC_DELTA_LZMA]
+
+def chunk_size(_payload_size):
+	""" @brief size of a chunk in the file (header, payload and padding)
+	"""
+	return CHUNK_HEADER.size + _payload_size + (_payload_size & 1)
+
+def timestamps_ms(_words):
+	""" @brief timestamps of raw profiles
+	@param _words : int16 array (n_profiles, profile words), the first 3 words being the encoded timestamp
+	@return int64 array of the timestamps in ms since 1970 (UTC)
+	"""
+	return decode_timestamps(_words[:, :3]).view(np.int64)
+
+def to_ms(_time):
+	""" @brief convert a time (datetime, numpy datetime64 or ms since 1970) in ms since 1970
+	naive datetimes are UTC
+	"""
+	if isinstance(_time, datetime):
+		if _time.tzinfo is None:
+			_time = _time.replace(tzinfo=timezone.utc)
+		return int(round(_time.timestamp()*1000))
+	if isinstance(_time, np.datetime64):
+		return int(_time.astype("datetime64[ms]").astype(np.int64))
+	return int(_time)
+
+def encode_chunk(_payload, _profile_size, _codec, _level=None):
+	""" @brief compress the raw profiles of a chunk
+	@param _payload : concatenated raw profiles (bytes-like)
+	@param _profile_size : size of a profile (bytes)
+	@param _codec : CODEC_RAW, CODEC_DELTA_ZLIB or CODEC_DELTA_LZMA
+	@param _level : compression level (zlib 0-9 / lzma preset 0-9, None : default)
+	@return encoded payload (bytes-like)
+
+	The words of consecutive profiles are close (timestamp, header, same cells) :
+	their differences, grouped by column, compress much better than the raw profiles.
+	Each chunk is encoded alone and can be decoded without the others.
+	"""
+	if _codec == CODEC_RAW:
+		return _payload
+	words = np.frombuffer(_payload, dtype="<i2").reshape(-1, _profile_size//2)
+	delta = np.empty_like(words)
+	delta[0] = words[0]
+	# int16 overflows wrap around, the cumulative sum of the decoder wraps back
+	np.subtract(words[1:], words[:-1], out=delta[1:])
+	data = delta.T.tobytes()
+	if _codec == CODEC_DELTA_ZLIB:
+		return zlib.compress(data, 6 if _level is None else _level)
+	if _codec == CODEC_DELTA_LZMA:
+		return lzma.compress(data, preset=lzma.PRESET_DEFAULT if _level is None else _level)
+	raise apf04_error(4004, "unknown chunk codec %d"%_codec)
+
+def decode_chunk(_payload, _profile_size, _codec):
+	""" @brief decompress the raw profiles of a chunk (see encode_chunk)
+	@return concatenated raw profiles (bytes-like)
+	"""
+	if _codec == CODEC_RAW:
+		return _payload
+	if _codec == CODEC_DELTA_ZLIB:
+		data = zlib.decompress(_payload)
+	elif _codec == CODEC_DELTA_LZMA:
+		data = lzma.decompress(_payload)
+	else:
+		raise apf04_error(4004, "unknown chunk codec %d"%_codec)
+	delta = np.frombuffer(data, dtype="<i2").reshape(_profile_size//2, -1)
+	return np.cumsum(delta, axis=1, dtype=np.int16).T.tobytes()
+
+def _file_header(_config, _version_c, _profile_size):
+	config_words = _config.to_bytes()
+	return FILE_HEADER.pack(MAGIC, FORMAT_VERSION, _version_c, _config.f_sys, len(config_words)//2, _profile_size) + config_words
+
+def _read_file_header(_file):
+	""" @brief read the file header
+	@return (C version, f_sys, configuration words, profile size, header size)
+	"""
+	_file.seek(0)
+	head = _file.read(FILE_HEADER.size)
+	if len(head) < FILE_HEADER.size:
+		raise apf04_error(4001, "not a recording file (too short)")
+	magic, version, version_c, f_sys, n_words, profile_size = FILE_HEADER.unpack(head)
+	if magic != MAGIC or version != FORMAT_VERSION:
+		raise apf04_error(4001, "not a recording file (format %s version %d)"%(magic, version))
+	config_words = struct.unpack("<%dh"%n_words, _file.read(2*n_words))
+	return version_c, f_sys, list(config_words), profile_size, FILE_HEADER.size + 2*n_words
+
+def _scan_chunks(_file, _offset):
+	""" @brief read the chunk headers from an offset
+	@return list of index entries (first, last, offset, n_profiles), offset of the end of the last complete chunk
+	"""
+	entries = []
+	file_size = os.fstat(_file.fileno()).st_size
+	while _offset + CHUNK_HEADER.size <= file_size:
+		_file.seek(_offset)
+		magic, codec, n_profiles, payload_size, first, last = CHUNK_HEADER.unpack(_file.read(CHUNK_HEADER.size))
+		if magic != CHUNK_MAGIC or _offset + chunk_size(payload_size) > file_size:
+			# chunk being written when the recording was interrupted
+			break
+		entries.append((first, last, _offset, n_profiles))
+		_offset += chunk_size(payload_size)
+	return entries, _offset
+
+def _load_index(_file, _path, _header_size):
+	""" @brief read the sidecar index, completed with the chunks it misses
+	@return index entries (numpy array of INDEX_DTYPE), offset of the end of the last complete chunk
+	"""
+	index = np.zeros(0, dtype=INDEX_DTYPE)
+	if os.path.exists(_path+INDEX_SUFFIX):
+		with open(_path+INDEX_SUFFIX, "rb") as index_file:
+			data = index_file.read()
+		# an interrupted write may leave an incomplete entry
+		index = np.frombuffer(data[:len(data)//INDEX_ENTRY.size*INDEX_ENTRY.size], dtype=INDEX_DTYPE)
+
+	offset = _header_size
+	file_size = os.fstat(_file.fileno()).st_size
+	while len(index):
+		_file.seek(int(index["offset"][-1]))
+		head = _file.read(CHUNK_HEADER.size)
+		if len(head) < CHUNK_HEADER.size:
+			# the entry was written, but not its chunk (interrupted before the sync) : checked again from the previous one
+			index = index[:-1]
+			continue
+		if head[:4] != CHUNK_MAGIC:
+			# the index does not match the data file : rebuild it
+			index = np.zeros(0, dtype=INDEX_DTYPE)
+			break
+		end = int(index["offset"][-1]) + chunk_size(CHUNK_HEADER.unpack(head)[3])
+		if end <= file_size:
+			offset = end
+			break
+		# incomplete payload
+		index = index[:-1]
+	entries, end = _scan_chunks(_file, offset)
+	if entries:
+		index = np.concatenate([index, np.array(entries, dtype=INDEX_DTYPE)])
+	return index, end
+
+
+class Apf04RecordingWriter ():
+	""" @brief append raw profiles to a recording file
+
+	The profiles are buffered and written by chunks, the file being only
+	appended. The data file and its index are synced every sync_chunks chunks
+	(and when closing) : a crash loses at most the profiles not synced.
+	Opening an existing recording appends to it (same configuration only).
+	"""
+	def __init__(self, _path, _config, _version_c, _chunk_profiles=64, _sync_chunks=16, _codec=CODEC_RAW, _level=None):
+		""" @brief open the recording
+		@param _path : recording file
+		@param _config : ConfigHw of the profiles
+		@param _version_c : C version of the firmware (address map of the profiles)
+		@param _chunk_profiles : number of profiles per chunk
+		@param _sync_chunks : number of chunks written between two fsync
+		@param _codec : compression of the chunks (see encode_chunk)
+		@param _level : compression level
+		"""
+		assert _codec in CODECS
+		addr = get_addr_dict(_version_c)
+		if addr is None:
+			raise apf04_error(4003, "unknown address map for firmware version %d"%_version_c)
+		self.path = _path
+		self.config = _config
+		self.version_c = _version_c
+		self.profile_size = 2*(3 + addr.SIZE_PROFILE_HEADER + 4*_config.n_vol)
+		self.chunk_profiles = _chunk_profiles
+		self.sync_chunks = _sync_chunks
+		self.codec = _codec
+		self.level = _level
+
+		header = _file_header(_config, _version_c, self.profile_size)
+		self._file = open(_path, "a+b")
+		index = np.zeros(0, dtype=INDEX_DTYPE)
+		if os.fstat(self._file.fileno()).st_size:
+			self._file.seek(0)
+			if self._file.read(len(header)) != header:
+				self._file.close()
+				raise apf04_error(4002, "%s was recorded with another configuration"%_path)
+			index, self._end = _load_index(self._file, _path, len(header))
+			# an incomplete chunk (interrupted recording) is removed
+			self._file.truncate(self._end)
+		else:
+			self._file.write(header)
+			self._end = len(header)
+		# the index is only rewritten if it does not match the data file
+		if _index_size(_path) != index.nbytes:
+			with open(_path+INDEX_SUFFIX, "wb") as index_file:
+				index_file.write(index.tobytes())
+		self._index = open(_path+INDEX_SUFFIX, "ab")
+
+		self._chunk = bytearray(_chunk_profiles*self.profile_size)
+		self._view = memoryview(self._chunk)
+		self._words = np.frombuffer(self._chunk, dtype="<i2").reshape(_chunk_profiles, self.profile_size//2)
+		self._count = 0
+		self._unsynced = 0
+
+		self.profiles = int(index["n_profiles"].sum())
+		self.chunks = len(index)
+
+	def write(self, _data):
+		""" @brief append a raw profile (see Apf04Driver.read_profile)
+		"""
+		assert len(_data) == self.profile_size, "profile size %d, %d expected"%(len(_data), self.profile_size)
+		self._view[self._count*self.profile_size:(self._count+1)*self.profile_size] = _data
+		self._count += 1
+		self.profiles += 1
+		if self._count == self.chunk_profiles:
+			self._write_chunk()
+
+	def flush(self):
+		""" @brief write the buffered profiles (the last chunk may be shorter)
+		"""
+		if self._count:
+			self._write_chunk()
+		self._file.flush()
+		self._index.flush()
+
+	def sync(self):
+		""" @brief write the buffered profiles and sync the files on disk
+		"""
+		self.flush()
+		os.fsync(self._file.fileno())
+		os.fsync(self._index.fileno())
+		self._unsynced = 0
+
+	def close(self):
+		if self._file.closed:
+			return
+		self.sync()
+		self._file.close()
+		self._index.close()
+
+	def __enter__(self):
+		return self
+
+	def __exit__(self, *args):
+		self.close()
+
+	def _write_chunk(self):
+		timestamps = timestamps_ms(self._words[:self._count])
+		payload = encode_chunk(self._view[:self._count*self.profile_size], self.profile_size, self.codec, self.level)
+		self._file.write(CHUNK_HEADER.pack(CHUNK_MAGIC, self.codec, self._count, len(payload), timestamps[0], timestamps[-1]))
+		self._file.write(payload)
+		if len(payload) & 1:
+			self._file.write(b"\x00")
+		# the index entry is written after its chunk
+		self._file.flush()
+		self._index.write(INDEX_ENTRY.pack(timestamps[0], timestamps[-1], self._end, self._count))
+		self._end += chunk_size(len(payload))
+		self._count = 0
+		self.chunks += 1
+		self._unsynced += 1
+		if self._unsynced >= self.sync_chunks:
+			self.sync()
+
+def _index_size(_path):
+	try:
+		return os.path.getsize(_path+INDEX_SUFFIX)
+	except OSError:
+		return -1
+
+
+class Apf04RecordingReader ():
+	""" @brief read a recording file
+
+	Only the chunks overlapping the requested time range are read (and decoded).
+	"""
+	def __init__(self, _path):
+		self.path = _path
+		self._file = open(_path, "rb")
+		self.version_c, f_sys, config_words, self.profile_size, header_size = _read_file_header(self._file)
+		self.config = ConfigHw(f_sys)
+		self.config.from_list(config_words)
+		self.index, self.end = _load_index(self._file, _path, header_size)
+
+	def __len__(self):
+		return int(self.index["n_profiles"].sum())
+
+	def close(self):
+		self._file.close()
+
+	def __enter__(self):
+		return self
+
+	def __exit__(self, *args):
+		self.close()
+
+	def read_chunk(self, _i):
+		""" @brief read the profiles of a chunk
+		@return raw profiles (bytes, n_profiles*profile_size)
+		"""
+		self._file.seek(int(self.index["offset"][_i]))
+		magic, codec, n_profiles, payload_size, first, last = CHUNK_HEADER.unpack(self._file.read(CHUNK_HEADER.size))
+		return decode_chunk(self._file.read(payload_size), self.profile_size, codec)
+
+	def read_range(self, _start=None, _end=None):
+		""" @brief read the profiles measured in a time range
+		@param _start : first time included (datetime, datetime64 or ms since 1970, None : beginning of the recording)
+		@param _end : last time excluded (None : end of the recording)
+		@return raw profiles (bytes, n_profiles*profile_size), e.g. for extract_measures_batch
+		"""
+		start = -2**63 if _start is None else to_ms(_start)
+		end = 2**63-1 if _end is None else to_ms(_end)
+		selected = np.nonzero((self.index["last"] >= start) & (self.index["first"] < end))[0]
+		if not len(selected):
+			return b""
+		data = b"".join(self.read_chunk(i) for i in selected)
+		words = np.frombuffer(data, dtype="<i2").reshape(-1, self.profile_size//2)
+		timestamps = timestamps_ms(words)
+		keep = (timestamps >= start) & (timestamps < end)
+		if keep.all():
+			return data
+		return words[keep].tobytes()
+
+	def __iter__(self):
+		""" @brief iterate on the raw profiles """
+		for i in range(len(self.index)):
+			chunk = self.read_chunk(i)
+			for offset in range(0, len(chunk), self.profile_size):
+				yield chunk[offset:offset+self.profile_size]
+
+
+class RecordingSlice ():
+	""" @brief profiles selected in a memory-mapped recording
+
+	The profiles are zero-copy views on the file (one structured array of
+	profile_dtype per chunk), the data are only copied by to_array and
+	to_measures.
+	"""
+	def __init__(self, _segments, _config):
+		self.segments = [segment for segment in _segments if len(segment)]
+		self.config = _config
+
+	def __len__(self):
+		return sum(len(segment) for segment in self.segments)
+
+	def __iter__(self):
+		for segment in self.segments:
+			yield from segment
+
+	def timestamps(self):
+		""" @brief timestamps of the profiles (datetime64[ms] array) """
+		if not self.segments:
+			return np.zeros(0, dtype="datetime64[ms]")
+		return np.concatenate([decode_timestamps(segment["timestamp"]) for segment in self.segments])
+
+	def to_array(self):
+		""" @brief copy the profiles in a contiguous structured array """
+		if len(self.segments) == 1:
+			return self.segments[0].copy()
+		return np.concatenate(self.segments) if self.segments else np.zeros(0, dtype=profile_dtype(self.config.n_vol))
+
+	def to_measures(self):
+		""" @brief convert the profiles in physical values (see extract_measures_batch) """
+		return extract_measures_batch(self.to_array(), self.config)
+
+
+class Apf04RecordingMap ():
+	""" @brief memory-mapped access to a recording
+
+	The profiles are exposed as zero-copy structured arrays (profile_dtype,
+	the layout expected by extract_measures) : the memory used does not
+	depend on the size of the file, the pages are read by the system when
+	the profiles are accessed.
+
+	The map is a snapshot : the profiles appended after its creation are not seen.
+	"""
+	def __init__(self, _path):
+		self.path = _path
+		self._file = open(_path, "rb")
+		self.version_c, f_sys, config_words, self.profile_size, header_size = _read_file_header(self._file)
+		self.config = ConfigHw(f_sys)
+		self.config.from_list(config_words)
+		self.index, end = _load_index(self._file, _path, header_size)
+		self.dtype = profile_dtype(self.config.n_vol)
+		assert self.dtype.itemsize == self.profile_size
+
+		# the chunks appended later, or incomplete, are not mapped
+		self._mmap = mmap.mmap(self._file.fileno(), end, access=mmap.ACCESS_READ) if end > header_size else None
+		self.chunks = []
+		for offset, n_profiles in zip(self.index["offset"].tolist(), self.index["n_profiles"].tolist()):
+			codec = self._mmap[offset+4]
+			if codec != CODEC_RAW:
+				self.close()
+				raise apf04_error(4004, "compressed chunks (codec %d) can not be memory-mapped, use Apf04RecordingReader"%codec)
+			self.chunks.append(np.ndarray((n_profiles,), dtype=self.dtype, buffer=self._mmap, offset=offset+CHUNK_HEADER.size))
+		# index of the first profile of each chunk
+		self._starts = np.concatenate([[0], np.cumsum(self.index["n_profiles"], dtype=np.int64)])
+
+	def __len__(self):
+		return int(self._starts[-1])
+
+	def __getitem__(self, _key):
+		""" @brief profile (structured record) or profiles (RecordingSlice) by index
+		"""
+		if isinstance(_key, slice):
+			start, stop, step = _key.indices(len(self))
+			assert step == 1, "only contiguous slices are supported"
+			segments = []
+			for i in range(np.searchsorted(self._starts, start, side="right")-1, len(self.chunks)):
+				first = self._starts[i]
+				if first >= stop:
+					break
+				segments.append(self.chunks[i][max(start-first, 0):stop-first])
+			return RecordingSlice(segments, self.config)
+		if _key < 0:
+			_key += len(self)
+		if not 0 <= _key < len(self):
+			raise IndexError(_key)
+		i = np.searchsorted(self._starts, _key, side="right")-1
+		return self.chunks[i][_key-self._starts[i]]
+
+	def select(self, _start=None, _end=None):
+		""" @brief profiles measured in a time range
+		@param _start : first time included (datetime, datetime64 or ms since 1970, None : beginning of the recording)
+		@param _end : last time excluded (None : end of the recording)
+		@return RecordingSlice
+		"""
+		start = -2**63 if _start is None else to_ms(_start)
+		end = 2**63-1 if _end is None else to_ms(_end)
+		segments = []
+		for i in np.nonzero((self.index["last"] >= start) & (self.index["first"] < end))[0]:
+			chunk = self.chunks[i]
+			# the profiles of a chunk are in chronological order
+			timestamps = timestamps_ms(chunk["timestamp"])
+			segments.append(chunk[np.searchsorted(timestamps, start):np.searchsorted(timestamps, end)])
+		return RecordingSlice(segments, self.config)
+
+	def close(self):
+		""" @brief close the file. The mapping is released when the last view is deleted
+		"""
+		self.chunks = []
+		if self._mmap is not None:
+			try:
+				self._mmap.close()
+			except BufferError:
+				# views are still used
+				pass
+		self._file.close()
+
+	def __enter__(self):
+		return self
+
+	def __exit__(self, *args):
+		self.close()
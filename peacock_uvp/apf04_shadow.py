@@ -0,0 +1,72 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# @copyright  this code is the property of Ubertone.
+# You may use this code for your personal, informational, non-commercial purpose.
+# You may not distribute, transmit, display, reproduce, publish, license, create derivative works from, transfer or sell any information, software, products or services based on this code.
+# @author Stéphane Fischer
+
+# default number of unchanged words which are sent again to merge two changed runs in a single frame
+DEFAULT_MAX_GAP = 4
+
+class RegisterShadow ():
+	""" @brief host copy of words of the device RAM
+
+	The shadow holds the last value written to (or read from) each known
+	address. It is only valid as long as nobody else modifies the RAM : it
+	must be invalidated after a reboot of the device or a reconnection.
+	"""
+	def __init__(self):
+		self._words = {}
+
+	def __len__(self):
+		return len(self._words)
+
+	def __contains__(self, _addr):
+		return _addr in self._words
+
+	def get(self, _addr, _size):
+		""" @brief get a block of words
+		@param _addr : address of the first word
+		@param _size : number of words
+		@return list of words or None if one of the words is unknown
+		"""
+		try:
+			return [self._words[addr] for addr in range(_addr, _addr+_size)]
+		except KeyError:
+			return None
+
+	def update(self, _addr, _data):
+		""" @brief store the words written to or read from the device
+		@param _addr : address of the first word
+		@param _data : list of words (signed 16 bits)
+		"""
+		for offset, value in enumerate(_data):
+			self._words[_addr+offset] = value
+
+	def invalidate(self, _addr=None, _size=1):
+		""" @brief forget a block of words (all the words if _addr is None)
+		"""
+		if _addr is None:
+			self._words.clear()
+		else:
+			for addr in range(_addr, _addr+_size):
+				self._words.pop(addr, None)
+
+	def diff(self, _addr, _data, _max_gap=DEFAULT_MAX_GAP, _max_size=123):
+		""" @brief find the words which have to be written
+		@param _addr : address of the first word
+		@param _data : list of words (signed 16 bits)
+		@param _max_gap : maximum number of unchanged words sent again to merge two runs
+		@param _max_size : maximum number of words in a run (modbus frame)
+		@return list of (offset, size) of the runs to write
+		"""
+		runs = []
+		for offset, value in enumerate(_data):
+			if self._words.get(_addr+offset) == value:
+				continue
+			if runs and offset - (runs[-1][0]+runs[-1][1]) <= _max_gap and offset+1 - runs[-1][0] <= _max_size:
+				runs[-1][1] = offset+1 - runs[-1][0]
+			else:
+				runs.append([offset, 1])
+		return [tuple(run) for run in runs]
@@ -0,0 +1,490 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# @copyright  this code is the property of Ubertone.
+# You may use this code for your personal, informational, non-commercial purpose.
+# You may not distribute, transmit, display, reproduce, publish, license, create derivative works from, transfer or sell any information, software, products or services based on this code.
+# @author Stéphane Fischer
+
+import os
+import struct
+import threading
+import logging
+from collections import deque
+from time import perf_counter, sleep
+
+import numpy as np
+
+from .apf04_addr_cmd import *
+from .apf04_config_hw import ConfigHw
+from .modbus_crc import crc16
+
+# size of the RAM shared with modbus (in words)
+RAM_SIZE = 0x0800
+
+# modbus exception codes
+MODBUS_ILLEGAL_FUNCTION = 1
+MODBUS_ILLEGAL_DATA_ADDRESS = 2
+
+# default configuration loaded at startup and by CMD_INIT_SETTINGS
+DEFAULT_SETTINGS = {
+	"f0": 1000000.0,
+	"gain_function": {"a0": 19.97945, "a1": 0.0, "auto": True},
+	"method": "ppc_cont",
+	"n_ech": 50,
+	"n_profile": 1,
+	"n_vol": 120,
+	"phase_coding": True,
+	"prf": 1000.0,
+	"r_dvol": 0.00525,
+	"r_em": 0.00525,
+	"r_vol1": 0.019875,
+	"static_echo_filter": True,
+	"tr_out": "tr1",
+	"v_min": -0.06701762417029068
+}
+
+# processing time of the simulated actions other than the measurements (in seconds). They are
+# independent of the timeouts of the driver (ACTION_TIMEOUT), which are only upper bounds.
+SIMULATED_ACTION_DURATION = {
+	CMD_CHECK_CONFIG: 0.01,
+	CMD_TEST_LED: 1.0,
+	CMD_TEST_I2C: 0.1,
+}
+
+def frame_duration(_n_bytes, _baudrate):
+	""" @brief transmission time of bytes on the serial line (8N1 : 10 bits per byte)
+	"""
+	return 10.*_n_bytes/_baudrate
+
+
+class Apf04Simulator ():
+	""" @brief simulated APF04 : Modbus RTU slave with the RAM layout of the firmware
+
+	The simulator answers modbus frames (function 3 and 16) and runs the
+	actions written in the action register. The duration of the profile
+	measurements is given by ConfigHw.get_bloc_duration() of the selected
+	configuration, and synthetic profiles are written in the RAM.
+
+	The simulator only computes the answers and their processing delay,
+	the transport (LoopbackSerial or PtyServer) adds the transfer time.
+	"""
+	def __init__(self, _f_sys=36e6, _version_c=53, _version_vhdl=1, _slave_addr=0x04, _serial_num=1, _time_scale=1., _seed=0, _addr_profile_count=None, _addr_iq=None, _size_iq=0x4000):
+		""" @brief create a simulated device
+		@param _f_sys : system frequency
+		@param _version_c : firmware version (gives the RAM layout)
+		@param _version_vhdl : VHDL version
+		@param _slave_addr : modbus address of the device
+		@param _time_scale : factor applied to the processing times (0 : instantaneous device)
+		@param _seed : seed of the synthetic profiles
+		@param _addr_profile_count : address of a sequence register counting the profiles measured
+		  (ADDR_PROFILE_COUNT, added to the address dict), None if the firmware has none
+		@param _addr_iq : address of the IQ buffer (ADDR_IQ, added to the address dict with SIZE_IQ),
+		  None if the IQ samples can not be read
+		@param _size_iq : size of the IQ buffer (in words)
+		"""
+		self.f_sys = _f_sys
+		self.slave_addr = _slave_addr
+		self.version_c = _version_c
+		self.version_vhdl = _version_vhdl
+		self.serial_num = _serial_num
+		self.time_scale = _time_scale
+		# processing time of the actions, can be changed to simulate a slower device
+		self.action_duration = dict(SIMULATED_ACTION_DURATION)
+		self.addr = get_addr_dict(_version_c)
+		if _addr_profile_count is not None:
+			self.addr = self.addr.replace(ADDR_PROFILE_COUNT=_addr_profile_count)
+		self.iq = None
+		if _addr_iq is not None:
+			self.addr = self.addr.replace(ADDR_IQ=_addr_iq, SIZE_IQ=_size_iq)
+			self.iq = np.zeros(_size_iq, dtype=np.int16)
+		self.rng = np.random.default_rng(_seed)
+
+		self.ram = np.zeros(RAM_SIZE, dtype=np.int16)
+		self.ram[ADDR_VERSION_C] = _version_c
+		self.ram[ADDR_MODEL_YEAR] = (0x01<<8) + 21
+		self.ram[ADDR_SERIAL_NUM] = _serial_num
+		self.ram[self.addr["ADDR_TANGAGE"]] = 1
+		self.ram[self.addr["ADDR_ROULIS"]] = -2
+		self.ram[self.addr["ADDR_TEMP_MOY"]] = 20
+		self.ram[self.addr["ADDR_SOUND_SPEED_SET"]] = 1480
+		self.init_settings()
+
+		# action in progress (non blocking or auto mode) and its end time (end of the current block in auto mode)
+		self.action = CMD_NULL
+		self.action_end = 0.
+		# number of profiles measured
+		self.n_profiles = 0
+		# number of frames received
+		self.n_frames = 0
+
+	def init_settings(self):
+		""" @brief write the default configuration in the 3 configuration slots
+		"""
+		config = ConfigHw(self.f_sys).set(DEFAULT_SETTINGS)
+		for id_config in range(3):
+			self.write_config(config, id_config)
+		self.ram[self.addr["ADDR_CONFIG_ID"]] = 0
+
+	def write_config(self, _config, _id_config):
+		addr = self.addr["ADDR_CONFIG"]+_id_config*self.addr["OFFSET_CONFIG"]
+		self.ram[addr:addr+self.addr["SIZE_CONFIG"]] = np.array(_config.to_list()).astype(np.int16)
+
+	def current_config(self):
+		""" @brief configuration selected by ADDR_CONFIG_ID
+		"""
+		addr = self.addr["ADDR_CONFIG"]+int(self.ram[self.addr["ADDR_CONFIG_ID"]])*self.addr["OFFSET_CONFIG"]
+		return ConfigHw(self.f_sys).set(self.ram[addr:addr+self.addr["SIZE_CONFIG"]].tolist())
+
+	############## Modbus ###############################################
+
+	def process(self, _frame):
+		""" @brief answer a modbus frame
+		@param _frame : complete request frame (bytes)
+		@return (answer, processing delay in seconds). answer is None if the frame is not for this device or corrupted
+		"""
+		if len(_frame) < 8 or _frame[0] != self.slave_addr:
+			return None, 0.
+		if crc16(_frame[:-2]) != struct.unpack(">H", _frame[-2:])[0]:
+			logging.debug("simulator: wrong crc")
+			return None, 0.
+		self.n_frames += 1
+		self._update()
+
+		function = _frame[1]
+		addr, size = struct.unpack(">HH", _frame[2:6])
+		delay = 0.
+		if function == 3:
+			words = self.read_words(addr, size)
+			if words is None:
+				answer = struct.pack(">BBB", self.slave_addr, 0x83, MODBUS_ILLEGAL_DATA_ADDRESS)
+			else:
+				answer = struct.pack(">BBB", self.slave_addr, 3, 2*size) + words.astype('>i2').tobytes()
+		elif function == 16:
+			values = np.frombuffer(_frame[7:7+2*size], dtype='>i2')
+			if addr == ADDR_ACTION and size == 1:
+				delay = self.action_cmd(int(values[0]))
+				answer = _frame[:6]
+			elif addr + size <= RAM_SIZE:
+				self.ram[addr:addr+size] = values
+				answer = _frame[:6]
+			else:
+				answer = struct.pack(">BBB", self.slave_addr, 0x90, MODBUS_ILLEGAL_DATA_ADDRESS)
+		else:
+			answer = struct.pack(">BBB", self.slave_addr, function | 0x80, MODBUS_ILLEGAL_FUNCTION)
+
+		return answer + struct.pack(">H", crc16(answer)), delay*self.time_scale
+
+	def read_words(self, _addr, _size):
+		""" @brief content of the memory seen by modbus
+		@return int16 array or None if the address range is not allowed
+		"""
+		if _addr == ADDR_VERSION_VHDL and _size == 1:
+			return np.array([self.version_vhdl], dtype=np.int16)
+		if _addr == ADDR_ACTION and _size == 1:
+			return np.array([self.action], dtype=np.int16)
+		if self.iq is not None and _addr >= self.addr["ADDR_IQ"]:
+			offset = _addr - self.addr["ADDR_IQ"]
+			if offset + _size > len(self.iq):
+				return None
+			return self.iq[offset:offset+_size]
+		if _addr + _size > RAM_SIZE:
+			return None
+		return self.ram[_addr:_addr+_size]
+
+	############## Actions ###############################################
+
+	def action_cmd(self, _cmd):
+		""" @brief run an action
+		@return processing time before the answer (in seconds, without time scale)
+		"""
+		logging.debug("simulator: action %d", _cmd)
+		if _cmd == CMD_STOP:
+			# the block in progress is finished first
+			delay = 0.
+			if self.action in [CMD_PROFILE_NON_BLOCKING, CMD_START_AUTO] and self.time_scale:
+				delay = max(0., self.action_end - perf_counter())/self.time_scale
+			self.action = CMD_NULL
+			return delay
+		if _cmd == CMD_PROFILE_BLOCKING:
+			duration = self.current_config().get_bloc_duration()
+			self.measure_profile()
+			return duration
+		if _cmd in [CMD_PROFILE_NON_BLOCKING, CMD_START_AUTO]:
+			self.action = _cmd
+			self.action_end = perf_counter() + self.current_config().get_bloc_duration()*self.time_scale
+			return 0.
+		if _cmd == CMD_PROFILE_IQ:
+			config = self.current_config()
+			self.measure_iq()
+			return config.get_bloc_duration()/config.n_avg
+		if _cmd == CMD_INIT_SETTINGS:
+			self.init_settings()
+		elif _cmd == CMD_TEST_I2C:
+			self.ram[self.addr["ADDR_TEMP_MOY"]] = 20 + self.rng.integers(-1, 2)
+		return self.action_duration.get(_cmd, 0.)
+
+	def _update(self):
+		""" @brief end the action in progress if its duration has elapsed
+		"""
+		if self.action == CMD_PROFILE_NON_BLOCKING and perf_counter() >= self.action_end:
+			self.measure_profile()
+			self.action = CMD_NULL
+		elif self.action == CMD_START_AUTO and perf_counter() >= self.action_end:
+			# the blocks follow one another, each profile overwrites the previous one
+			# (with an instantaneous device, a block ends at each frame)
+			step = self.current_config().get_bloc_duration()*self.time_scale
+			n_blocks = int((perf_counter() - self.action_end)//step) + 1 if step else 1
+			self.n_profiles += n_blocks - 1
+			self.measure_profile()
+			self.action_end += n_blocks*step
+
+	def measure_profile(self):
+		""" @brief write a synthetic profile in the RAM
+		"""
+		config = self.current_config()
+		n_vol = config.n_vol
+		addr = self.addr["ADDR_PROFILE_HEADER"]
+		ram = self.ram
+		# header : pitch, roll, temp, sound speed, gains and noise
+		ram[self.addr["ADDR_SOUND_SPEED"]] = ram[self.addr["ADDR_SOUND_SPEED_SET"]]
+		ram[self.addr["ADDR_GAIN_CA0"]] = config.gain_ca0
+		ram[self.addr["ADDR_GAIN_CA1"]] = config.gain_ca1
+		ram[self.addr["ADDR_NOISE_GMAX"]] = 100 + self.rng.integers(0, 10)
+		ram[self.addr["ADDR_NOISE_GMID"]] = 10 + self.rng.integers(0, 3)
+
+		# cells : velocity, std, amplitude, snr
+		cells = ram[addr+self.addr["SIZE_PROFILE_HEADER"]:addr+self.addr["SIZE_PROFILE_HEADER"]+4*n_vol].reshape(-1, 4)
+		depth = np.arange(n_vol)
+		cells[:, 0] = 8000*np.sin(depth*np.pi/n_vol) + self.rng.normal(0, 300, n_vol)
+		cells[:, 1] = 500 + self.rng.integers(0, 200, n_vol)
+		cells[:, 2] = 2000*np.exp(-depth/n_vol) + self.rng.integers(0, 100, n_vol)
+		cells[:, 3] = 300 - depth + self.rng.integers(-20, 20, n_vol)
+		self.n_profiles += 1
+		if "ADDR_PROFILE_COUNT" in self.addr:
+			self.ram[self.addr["ADDR_PROFILE_COUNT"]] = (self.n_profiles + 0x8000)%0x10000 - 0x8000
+
+
+	def measure_iq(self):
+		""" @brief write synthetic IQ samples (I, Q of each cell of each shot) in the IQ buffer
+		"""
+		if self.iq is None:
+			return
+		config = self.current_config()
+		n_tir, n_vol = config.n_tir, config.n_vol
+		if 2*n_tir*n_vol > len(self.iq):
+			return
+		# echo decreasing with the depth, with a Doppler phase shift from one shot to the next
+		depth = np.arange(n_vol)
+		phase = np.outer(np.arange(n_tir), 0.5*np.sin(depth*np.pi/n_vol)) + self.rng.uniform(0, 2*np.pi, n_vol)
+		signal = 8000*np.exp(-depth/n_vol)*np.exp(1j*phase) \
+			+ self.rng.normal(0, 100, (n_tir, n_vol)) + 1j*self.rng.normal(0, 100, (n_tir, n_vol))
+		iq = self.iq[:2*n_tir*n_vol].reshape(n_tir, n_vol, 2)
+		iq[..., 0] = signal.real
+		iq[..., 1] = signal.imag
+
+
+class LoopbackSerial ():
+	""" @brief in-process replacement of serial.Serial connected to simulated devices
+
+	The answers are received with the timing of a real serial line : processing
+	delay of the device, then one byte each 10/baudrate seconds (scaled by time_scale).
+	Several simulators with different addresses can share the line (RS485 multi-drop).
+	"""
+	def __init__(self, _simulators, _baudrate=750000, _timeout=0.5, _time_scale=1.):
+		""" @brief connect the simulated line
+		@param _simulators : Apf04Simulator or list of Apf04Simulator
+		@param _baudrate : simulated speed of the serial line
+		@param _timeout : read timeout (same meaning as serial.Serial.timeout)
+		@param _time_scale : factor applied to the transfer times (0 : instantaneous line)
+		"""
+		if isinstance(_simulators, Apf04Simulator):
+			_simulators = [_simulators]
+		self.simulators = _simulators
+		self.baudrate = _baudrate
+		self.timeout = _timeout
+		self.time_scale = _time_scale
+		self.is_open = True
+
+		# answers waiting to be read : [time of arrival of the first byte, bytes]
+		self._rx = deque()
+		self._cond = threading.Condition()
+		# statistics
+		self.bytes_written = 0
+		self.bytes_read = 0
+
+	def _byte_time(self):
+		return frame_duration(1, self.baudrate)*self.time_scale
+
+	def _available(self, _now):
+		""" number of bytes received at _now """
+		byte_time = self._byte_time()
+		n = 0
+		for start, data in self._rx:
+			if _now < start:
+				break
+			received = len(data) if byte_time == 0 else min(len(data), int((_now - start)/byte_time)+1)
+			n += received
+			if received < len(data):
+				break
+		return n
+
+	def _take(self, _view):
+		""" move the first bytes waiting to _view """
+		offset = 0
+		while offset < len(_view):
+			chunk = self._rx[0]
+			n = min(len(chunk[1]), len(_view) - offset)
+			_view[offset:offset+n] = chunk[1][:n]
+			offset += n
+			if n == len(chunk[1]):
+				self._rx.popleft()
+			else:
+				del chunk[1][:n]
+				chunk[0] += n*self._byte_time()
+
+	@property
+	def in_waiting(self):
+		with self._cond:
+			return self._available(perf_counter())
+
+	def write(self, _data):
+		frame = bytes(_data)
+		self.bytes_written += len(frame)
+		end_of_request = perf_counter() + len(frame)*self._byte_time()
+		for simulator in self.simulators:
+			answer, delay = simulator.process(frame)
+			if answer is not None:
+				with self._cond:
+					# time of arrival of the first byte of the answer, after the bytes already waiting
+					start = end_of_request + delay + self._byte_time()
+					if self._rx:
+						last_start, last = self._rx[-1]
+						start = max(start, last_start + len(last)*self._byte_time())
+					self._rx.append([start, bytearray(answer)])
+					self._cond.notify_all()
+				break
+		# the request is sent at the line speed
+		if self.time_scale:
+			sleep(max(0., end_of_request - perf_counter()))
+		return len(frame)
+
+	def read(self, _size=1):
+		data = bytearray(_size)
+		n = self.readinto(data)
+		return bytes(data[:n])
+
+	def readinto(self, _buf):
+		size = len(_buf)
+		deadline = None if self.timeout is None else perf_counter() + self.timeout
+		received = 0
+		while received < size:
+			with self._cond:
+				now = perf_counter()
+				n = min(self._available(now), size - received)
+				if n:
+					self._take(memoryview(_buf)[received:received+n])
+					received += n
+					continue
+				if deadline is not None and now >= deadline:
+					break
+				if self._rx:
+					wait = self._rx[0][0] - now
+				else:
+					wait = None
+				if deadline is not None:
+					wait = deadline - now if wait is None else min(wait, deadline - now)
+			if wait is None:
+				with self._cond:
+					if not self._rx:
+						self._cond.wait()
+			elif wait > 0:
+				sleep(wait)
+		self.bytes_read += received
+		return received
+
+	def reset_input_buffer(self):
+		with self._cond:
+			self._rx.clear()
+
+	def close(self):
+		self.is_open = False
+
+
+class PtyServer ():
+	""" @brief expose simulated devices on a pseudo terminal (POSIX only)
+
+	The path of the pseudo terminal can be given as device to Apf04Driver or
+	serial.Serial. The frames are served by a thread, with the timing of a
+	serial line at the given baudrate.
+	"""
+	def __init__(self, _simulators, _baudrate=750000):
+		""" @brief open the pseudo terminal and start serving
+		@param _simulators : Apf04Simulator or list of Apf04Simulator
+		@param _baudrate : simulated speed of the serial line (for the timing of the answers)
+		"""
+		import tty
+		if isinstance(_simulators, Apf04Simulator):
+			_simulators = [_simulators]
+		self.simulators = _simulators
+		self.baudrate = _baudrate
+		self._master, self._slave = os.openpty()
+		tty.setraw(self._slave)
+		self.path = os.ttyname(self._slave)
+		self._thread = threading.Thread(target=self._serve, name="apf04_simulator", daemon=True)
+		self._thread.start()
+
+	def close(self):
+		""" @brief close the pseudo terminal, the serving thread ends
+		"""
+		os.close(self._slave)
+		self._thread.join(1.)
+
+	def _serve(self):
+		parser = FrameParser()
+		try:
+			while True:
+				data = os.read(self._master, 512)
+				if not data:
+					break
+				for frame in parser.feed(data):
+					start = perf_counter() + frame_duration(len(frame), self.baudrate)
+					for simulator in self.simulators:
+						answer, delay = simulator.process(frame)
+						if answer is not None:
+							sleep(max(0., start + delay - perf_counter()))
+							os.write(self._master, answer)
+							# the line is busy while the answer is transmitted
+							sleep(frame_duration(len(answer), self.baudrate))
+							break
+		except OSError:
+			# slave side closed
+			pass
+		finally:
+			os.close(self._master)
+
+
+class FrameParser ():
+	""" @brief split a byte stream into modbus request frames (function 3 and 16)
+	"""
+	def __init__(self):
+		self.buf = bytearray()
+
+	def feed(self, _data):
+		""" @brief add received bytes
+		@return list of complete frames
+		"""
+		self.buf += _data
+		frames = []
+		while len(self.buf) >= 2:
+			if self.buf[1] == 16:
+				if len(self.buf) < 7:
+					break
+				size = 9 + self.buf[6]
+			else:
+				size = 8
+			if len(self.buf) < size:
+				break
+			frames.append(bytes(self.buf[:size]))
+			del self.buf[:size]
+		return frames
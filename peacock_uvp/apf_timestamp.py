@@ -7,11 +7,14 @@
 # @author Stéphane Fischer
 
 from datetime import datetime, timezone, timedelta
-from time import mktime
 from struct import pack, unpack, calcsize
 
+import numpy as np
+
 # temps ZERO (Ubertone Epoch)
 UBT_EPOCH = datetime(2020, 1, 1, tzinfo=timezone.utc)
+# Ubertone Epoch in ms since 1970 (for the arrays of timestamps)
+UBT_EPOCH_MS = int(UBT_EPOCH.timestamp())*1000
 
 def encode_timestamp(_datetime):
 	"""Encode timestamp in words
@@ -26,15 +29,18 @@ def encode_timestamp(_datetime):
 	  - 01/01/2020 starting from version 2.01
 	"""
 	
-	timestamp = mktime(_datetime.timetuple()) + _datetime.microsecond/1e6 - mktime(UBT_EPOCH.timetuple())
+	# naive datetimes are UTC (the local time zone is not used)
+	if _datetime.tzinfo is None:
+		_datetime = _datetime.replace(tzinfo=timezone.utc)
+	delta = _datetime - UBT_EPOCH
+	seconds = delta.days*86400 + delta.seconds
 	#       timestamp (epoch)    2*int16  Epoch en secondes MSB + LSB (*)
 	#       timestamp extension  int16    En millisecondes
 	
 	# DIRECTIVE WARNING : attention à ne pas mélanger int16 et int32. En effet la machine est susceptible d'aligner les données sur 32 bits.
 	#   du coup un pack "hih" vas donner le premier short (16 bits) suivi par 0x0000 puis le second entier (int32) !!!
 	# TODO forcer l'endianness ?
-	return pack("hhh", int((int(timestamp)>>15)&0x0000FFFF), int(int(timestamp)&0x00007FFF),\
-										  int(1000.*(timestamp%1)))
+	return pack("hhh", (seconds>>15)&0x0000FFFF, seconds&0x00007FFF, delta.microseconds//1000)
 
 def decode_timestamp(_encoded_datetime):
 	"""Extract timestamp from a byte array
@@ -48,3 +54,37 @@ def decode_timestamp(_encoded_datetime):
 	timestamp_size = calcsize('hhh')
 	nsec_pF, nsec_pf, msec = unpack('hhh', _encoded_datetime[0:timestamp_size])
 	return UBT_EPOCH+timedelta(seconds=(int(nsec_pF)<<15)|nsec_pf, milliseconds=msec), timestamp_size
+
+def encode_timestamps(_times, _out=None):
+	"""Encode an array of timestamps in words (same words as encode_timestamp)
+
+	Args:
+		_times: array of times (datetime64, or ms since 1970), UTC
+		_out: int16 array (..., 3) to fill, allocated if None
+
+	Returns:
+		int16 array (..., 3) : seconds since ubertone's epoch MSB + LSB (15 bits), milliseconds
+	"""
+	times = np.asarray(_times)
+	if times.dtype.kind == 'M':
+		times = times.astype('datetime64[ms]').view(np.int64)
+	seconds, msec = np.divmod(times - UBT_EPOCH_MS, 1000)
+	if _out is None:
+		_out = np.empty(seconds.shape + (3,), dtype=np.int16)
+	_out[..., 0] = (seconds >> 15) & 0xFFFF
+	_out[..., 1] = seconds & 0x7FFF
+	_out[..., 2] = msec
+	return _out
+
+def decode_timestamps(_words):
+	"""Decode an array of encoded timestamps (same result as decode_timestamp)
+
+	Args:
+		_words: int16 array (..., 3), e.g. the timestamp field of profile_dtype
+
+	Returns:
+		datetime64[ms] array (UTC)
+	"""
+	words = np.asarray(_words)
+	seconds = (words[..., 0].astype(np.int64) << 15) | words[..., 1]
+	return (seconds*1000 + words[..., 2] + UBT_EPOCH_MS).view('datetime64[ms]')
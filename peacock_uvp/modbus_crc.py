@@ -38,9 +38,21 @@ def crc16(data):
 	https://crccalc.com/
 	https://www.lammertbies.nl/comm/info/crc-calculation
 	"""
-	crc = 0xffff
+	crc = crc16_update(0xffff, data)
+	swapped = ((crc << 8) & 0xff00) | ((crc >> 8) & 0x00ff)
+	return swapped
+
+
+def crc16_update(crc, data):
+	""" Updates a running crc16 with the passed in data, so that
+	a frame received in several parts can be checked without
+	being concatenated.
+	:param crc: The current crc value (0xffff at the frame start)
+	:param data: The data to add to the crc
+	:returns: The updated crc (not swapped, the low byte is
+	transmitted first)
+	"""
 	for a in data:
 		idx = __crc16_table[(crc ^ a) & 0xff]
 		crc = ((crc >> 8) & 0xff) ^ idx
-	swapped = ((crc << 8) & 0xff00) | ((crc >> 8) & 0x00ff)
-	return swapped
+	return crc
@@ -0,0 +1,141 @@
+# -*- coding: UTF_8 -*-
+
+import unittest
+# Add path to the lib folder
+import sys, os
+lib_path = os.path.abspath(__file__).split('/peacock_uvp_py_api')[0]+'/peacock_uvp_py_api'
+sys.path.insert(0, lib_path)
+#-------------------------------------
+
+import struct
+import threading
+from time import sleep
+
+from peacock_uvp.apf04_acquisition import ProfileRingBuffer, Apf04Acquisition, \
+	OVERFLOW_DROP_OLDEST, OVERFLOW_DROP_NEWEST, OVERFLOW_BLOCK
+from peacock_uvp.apf04_pipeline import Apf04Pipeline
+from peacock_uvp.apf04_config_hw import ConfigHw
+from peacock_uvp.apf04_exception import apf04_exception
+
+
+class FakeDriver ():
+	""" returns numbered profiles """
+	addr = {"SIZE_PROFILE_HEADER": 8}
+
+	def __init__(self, _n_vol):
+		self.count = 0
+		self.size = 3 + 8 + 4*_n_vol
+
+	def act_meas_profile(self, _timeout=0.):
+		sleep(0.001)
+
+	def read_profile(self, _n_vol):
+		self.count += 1
+		return struct.pack("<%dh"%self.size, self.count, *[0]*(self.size-1))
+
+
+class FailingDriver (FakeDriver):
+	""" fails the measurements in a given range """
+	def __init__(self, _n_vol, _failures):
+		FakeDriver.__init__(self, _n_vol)
+		self.failures = _failures
+		self.calls = 0
+
+	def act_meas_profile(self, _timeout=0.):
+		self.calls += 1
+		if self.calls in self.failures:
+			raise apf04_exception(2003, "timeout")
+
+
+# The main test class
+class TestAcquisition(unittest.TestCase):
+	def test_ring_buffer(self):
+		for overflow, expected in [(OVERFLOW_DROP_OLDEST, [b'c', b'd', b'e']), (OVERFLOW_DROP_NEWEST, [b'a', b'b', b'c'])]:
+			ring = ProfileRingBuffer(3, 4, overflow)
+			for data in [b'a', b'b', b'c', b'd', b'e']:
+				ring.push(data)
+			self.assertEqual(ring.dropped, 2)
+			self.assertEqual([ring.pop(0) for _ in range(3)], expected)
+			self.assertIsNone(ring.pop(0))
+
+		ring = ProfileRingBuffer(1, 4, OVERFLOW_BLOCK)
+		ring.push(b'a')
+		self.assertFalse(ring.push(b'b', 0.01))
+		threading.Timer(0.01, ring.pop).start()
+		self.assertTrue(ring.push(b'c', 1.))
+		self.assertEqual(ring.pop(), b'c')
+
+	def test_acquisition(self):
+		config = ConfigHw(36e6)
+		config.n_vol = 10
+		driver = FakeDriver(config.n_vol)
+		received = []
+		acq = Apf04Acquisition(driver, config, _n_slots=4, _overflow=OVERFLOW_BLOCK, _callback=received.append)
+		with acq:
+			sleep(0.05)
+		self.assertIsNone(acq.error)
+		self.assertGreater(acq.acquired, 0)
+		self.assertLessEqual(acq.dropped, 1) # profile fetched while stopping
+		self.assertEqual(acq.acquired + acq.dropped, driver.count)
+		self.assertEqual([struct.unpack("<h", data[:2])[0] for data in received], list(range(1, acq.acquired+1)))
+
+	def test_restart(self):
+		config = ConfigHw(36e6)
+		config.n_vol = 10
+		driver = FakeDriver(config.n_vol)
+		acq = Apf04Acquisition(driver, config, _n_slots=1000)
+		with acq:
+			sleep(0.02)
+		first = list(acq)
+		self.assertTrue(first)
+		# started again : the profiles are stored
+		with acq:
+			sleep(0.02)
+		second = list(acq)
+		self.assertTrue(second)
+		self.assertEqual(acq.acquired, len(first) + len(second))
+		self.assertEqual(acq.acquired + acq.dropped, driver.count)
+
+	def test_errors(self):
+		config = ConfigHw(36e6)
+		config.n_vol = 10
+		# occasional errors : the acquisition goes on after a backoff
+		driver = FailingDriver(config.n_vol, range(2, 5))
+		acq = Apf04Acquisition(driver, config, _n_slots=1000, _max_errors=4)
+		with acq:
+			sleep(0.15)
+		self.assertIsNone(acq.error)
+		self.assertEqual(acq.errors, 3)
+		self.assertGreater(acq.backoff_time, 0.06)
+		self.assertGreater(acq.acquired, 1)
+
+		# the device does not answer any more : the acquisition stops
+		driver = FailingDriver(config.n_vol, range(2, 1000))
+		pipeline = Apf04Pipeline(driver, config, _decoder=len, _max_errors=4)
+		with pipeline:
+			sleep(0.15)
+			self.assertFalse(pipeline.running)
+		self.assertEqual(driver.calls, 5)
+		stats = pipeline.stats()
+		self.assertEqual(stats["errors"], 4)
+		self.assertIsNotNone(stats["error"])
+		self.assertGreater(stats["backoff_time"], 0.06)
+
+	def test_pipeline(self):
+		config = ConfigHw(36e6)
+		config.n_vol = 10
+		driver = FakeDriver(config.n_vol)
+		pipeline = Apf04Pipeline(driver, config, _decoder=lambda data: struct.unpack("<h", data[:2])[0])
+		with pipeline:
+			sleep(0.05)
+		self.assertEqual(list(pipeline), list(range(1, pipeline.acquired+1)))
+		stats = pipeline.stats()
+		self.assertEqual(stats["profiles"], pipeline.acquired)
+		self.assertGreater(stats["profiles_per_s"], 0)
+		self.assertGreater(stats["trigger_time"], 0)
+		self.assertGreater(stats["decode_idle_time"], 0)
+
+
+# We need this to be able to run the tests outside a test framework.
+if __name__ == '__main__':
+	unittest.main()
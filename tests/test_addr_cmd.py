@@ -0,0 +1,56 @@
+# -*- coding: UTF_8 -*-
+
+import unittest
+# Add path to the lib folder
+import sys, os
+lib_path = os.path.abspath(__file__).split('/peacock_uvp_py_api')[0]+'/peacock_uvp_py_api'
+sys.path.insert(0, lib_path)
+#-------------------------------------
+
+import copy
+import pickle
+
+from peacock_uvp.apf04_addr_cmd import get_addr_dict, AddrMap
+from peacock_uvp.apf04_driver import Apf04Driver
+
+
+# The main test class
+class TestAddrCmd(unittest.TestCase):
+	def test_addr_map(self):
+		addr = get_addr_dict(53)
+		self.assertIsInstance(addr, AddrMap)
+		self.assertEqual(addr.ADDR_CONFIG, 0x0011)
+		self.assertEqual(addr["ADDR_PROFILE_DATA"], 0x02CB)
+		self.assertEqual(addr["SIZE_CONFIG"], 17)
+		self.assertEqual(dict(addr)["ADDR_CONFIG_ID"], 0x0010)
+		with self.assertRaises(AttributeError):
+			addr.ADDR_CONFIG = 0
+		with self.assertRaises(TypeError):
+			addr["ADDR_CONFIG"] = 0
+		self.assertEqual(addr.replace(ADDR_CONFIG=1).ADDR_CONFIG, 1)
+		self.assertEqual(addr.ADDR_CONFIG, 0x0011)
+
+	def test_copy_pickle(self):
+		addr = get_addr_dict(53)
+		for other in [copy.copy(addr), copy.deepcopy(addr), pickle.loads(pickle.dumps(addr))]:
+			self.assertIsInstance(other, AddrMap)
+			self.assertEqual(other, addr)
+			self.assertEqual(other.ADDR_CONFIG, 0x0011)
+			self.assertEqual(hash(other), hash(addr))
+		with self.assertRaises(AttributeError):
+			addr._other
+
+	def test_cache(self):
+		self.assertIs(get_addr_dict(53), get_addr_dict(53))
+		# versions 47 to 52 share the same map
+		self.assertIs(get_addr_dict(48), get_addr_dict(52))
+		self.assertIsNone(get_addr_dict(12))
+
+	def test_driver(self):
+		apf = Apf04Driver(None, 36e6, "fake", {"ADDR_CONFIG":"0x0011", "SIZE_CONFIG":17})
+		self.assertEqual(apf.addr.ADDR_CONFIG, 0x0011)
+		self.assertEqual(apf.addr.SIZE_CONFIG, 17)
+
+
+if __name__ == '__main__':
+	unittest.main()
@@ -0,0 +1,112 @@
+# -*- coding: UTF_8 -*-
+
+import unittest
+# Add path to the lib folder
+import sys, os
+lib_path = os.path.abspath(__file__).split('/peacock_uvp_py_api')[0]+'/peacock_uvp_py_api'
+sys.path.insert(0, lib_path)
+#-------------------------------------
+
+import asyncio
+import struct
+from datetime import datetime
+from time import perf_counter
+
+from peacock_uvp.apf04_async import Apf04AsyncDriver, open_memory_connection
+from peacock_uvp.apf04_exception import apf04_exception
+from peacock_uvp.apf04_addr_cmd import get_addr_dict
+from peacock_uvp.modbus_crc import crc16
+
+
+class FakeRam ():
+	""" answers to modbus frames, the memory is initialized with word value = address
+	"""
+	def __init__(self, _delays=()):
+		self.ram = list(range(0x800))
+		# delays of the first answers (then the delay of the connection)
+		self.delays = list(_delays)
+
+	def __call__(self, _frame):
+		slave, function, addr, size = struct.unpack(">BBHH", _frame[:6])
+		if function == 3:
+			words = [self.ram[a] if a < len(self.ram) else a for a in range(addr, addr+size)]
+			answer = struct.pack(">BBB%dH"%size, slave, 3, 2*size, *words)
+		else:
+			if addr < len(self.ram):
+				self.ram[addr:addr+size] = struct.unpack(">%dH"%size, _frame[7:7+2*size])
+			answer = _frame[:6]
+		answer += struct.pack(">H", crc16(answer))
+		if self.delays:
+			return answer, self.delays.pop(0)
+		return answer
+
+
+# The main test class
+class TestApf04Async(unittest.TestCase):
+	def test_read_write(self):
+		async def run():
+			apf = Apf04AsyncDriver(*open_memory_connection(FakeRam()), 36e6, get_addr_dict(53))
+			self.assertEqual(await apf.read_buf_i16(10, 300), struct.pack(">300H", *range(10, 310)))
+			await apf.write_buf_i16(list(range(100, 160)), 4)
+			self.assertEqual(await apf.read_list_i16(4, 60), tuple(range(100, 160)))
+			await apf.act_meas_profile()
+			self.assertEqual(await apf.read_version(), (-2, 0))
+		asyncio.run(run())
+
+	def test_concurrent_devices(self):
+		async def run():
+			n_vol = 50
+			# each answer takes 10 ms : the requests of the devices interleave
+			devices = [Apf04AsyncDriver(*open_memory_connection(FakeRam(), 0.01), 36e6, get_addr_dict(53)) for _ in range(4)]
+			async def measure(apf):
+				await apf.act_meas_profile()
+				apf.timestamp_profile = datetime(2021, 5, 3)
+				return await apf.read_profile(n_vol)
+			start = perf_counter()
+			await measure(devices[0])
+			sequential = perf_counter() - start
+			start = perf_counter()
+			profiles = await asyncio.gather(*[measure(apf) for apf in devices])
+			self.assertLess(perf_counter() - start, 2*sequential)
+			size = 8 + 4*n_vol
+			header = get_addr_dict(53)["ADDR_PROFILE_HEADER"]
+			for raw in profiles:
+				self.assertEqual(raw[6:], struct.pack("<%dH"%size, *range(header, header+size)))
+		asyncio.run(run())
+
+	def test_long_bloc(self):
+		async def run():
+			ram = FakeRam()
+			apf = Apf04AsyncDriver(*open_memory_connection(ram), 36e6, get_addr_dict(53))
+			config = apf.new_config()
+			config.n_tir, config.n_avg, config.div_f0, config.c_prf = 30, 20, 1, 18000
+			await apf.write_config(config, 1)
+			await apf.select_config(1)
+			self.assertEqual(apf.bloc_duration(), 0.6)
+			# unchanged words are not written again
+			self.assertEqual(await apf.write_cached(config.to_list(), apf.config_addr(1)), 0)
+			# the answer comes at the end of the block, later than the answer margin alone
+			ram.delays = [0.65]
+			start = perf_counter()
+			await apf.act_meas_profile()
+			self.assertGreater(perf_counter() - start, 0.6)
+		asyncio.run(run())
+
+	def test_late_answer(self):
+		async def run():
+			# the first answer arrives after the timeout, before the answer of the next request
+			latency = 0.1
+			apf = Apf04AsyncDriver(*open_memory_connection(FakeRam([latency+0.05, latency-0.02])), 36e6, get_addr_dict(53))
+			apf.latency = latency
+			with self.assertRaises(apf04_exception) as context:
+				await apf.read_i16(10)
+			self.assertEqual(context.exception.code, 2003)
+			# the late answer is not taken as the answer of the next requests
+			self.assertEqual(await apf.read_i16(20), 20)
+			self.assertEqual(await apf.read_list_i16(30, 3), (30, 31, 32))
+		asyncio.run(run())
+
+
+# We need this to be able to run the tests outside a test framework.
+if __name__ == '__main__':
+	unittest.main()
@@ -0,0 +1,108 @@
+# -*- coding: UTF_8 -*-
+
+import unittest
+# Add path to the lib folder
+import sys, os
+lib_path = os.path.abspath(__file__).split('/peacock_uvp_py_api')[0]+'/peacock_uvp_py_api'
+sys.path.insert(0, lib_path)
+#-------------------------------------
+
+from time import sleep, perf_counter
+
+import numpy as np
+
+from peacock_uvp.apf04_driver import Apf04Driver
+from peacock_uvp.apf04_addr_cmd import get_addr_dict
+from peacock_uvp.apf04_auto_mode import Apf04AutoStream
+from peacock_uvp.apf04_measures import extract_measures
+from peacock_uvp.apf04_exception import apf04_exception
+from peacock_uvp.apf04_simulator import Apf04Simulator, LoopbackSerial, DEFAULT_SETTINGS
+
+ADDR_PROFILE_COUNT = 706
+
+
+class TaggedSimulator (Apf04Simulator):
+	""" simulator writing the block number in the velocities and in the header """
+	def measure_profile(self):
+		super().measure_profile()
+		config = self.current_config()
+		addr = self.addr["ADDR_PROFILE_HEADER"]+self.addr["SIZE_PROFILE_HEADER"]
+		self.ram[addr:addr+4*config.n_vol:4] = self.n_profiles
+		self.ram[self.addr["ADDR_NOISE_GMAX"]] = self.n_profiles
+
+
+def simulated_driver(_simulator, _baudrate=750000, _settings=None):
+	apf = Apf04Driver(None, 36e6, "simulator")
+	apf.ser = LoopbackSerial(_simulator, _baudrate)
+	apf.addr = _simulator.addr
+	apf.read_version()
+	if _settings is not None:
+		apf.write_config(apf.new_config().set(dict(DEFAULT_SETTINGS, **_settings)), 0)
+	apf.select_config(0)
+	return apf, apf.read_config(0)
+
+
+# The main test class
+class TestAutoMode(unittest.TestCase):
+	def check_stream(self, _simulator, _frames_per_profile):
+		apf, config = simulated_driver(_simulator)
+		profiles = []
+		with Apf04AutoStream(apf, config) as stream:
+			frames = _simulator.n_frames
+			for data in stream:
+				profiles.append(data)
+				if len(profiles) == 4:
+					break
+			frames = _simulator.n_frames - frames
+			# slow consumer : the profiles overwritten are counted (wakes up at the start
+			# of the second block after the next one, so that the read ends in this block)
+			sleep(stream._next - perf_counter() + 1.1*stream.period)
+			profiles.append(stream.read_next())
+		self.assertEqual(stream.received, 5)
+		self.assertEqual(stream.missed, 1)
+		self.assertGreaterEqual(_simulator.n_profiles, 6)
+		self.assertEqual(len(set(profiles)), 5)
+		self.assertLessEqual(frames, (4+stream.rereads)*_frames_per_profile + stream.polls)
+		data = extract_measures(profiles[0], config)
+		self.assertEqual(len(data["velocity"]), config.n_vol)
+
+	def test_sequence_register(self):
+		simulator = Apf04Simulator(_addr_profile_count=ADDR_PROFILE_COUNT)
+		# the sequence register is read with the profile : 4 frames for 120 cells, and once more after them
+		self.check_stream(simulator, 5)
+
+	def test_content(self):
+		# the header is read again after the profile
+		self.check_stream(Apf04Simulator(), 5)
+
+	def check_single_block(self, _simulator):
+		# slow line : a profile is read in about half a block
+		apf, config = simulated_driver(_simulator, 115200, {"n_vol": 60, "n_profile": 2})
+		profiles = []
+		with Apf04AutoStream(apf, config) as stream:
+			self.assertGreater(stream.read_duration, 0.3*stream.period)
+			for i in range(8):
+				# reads at any time of the blocks (the next block is missed)
+				sleep((1+(0.3*i)%1)*stream.period)
+				profiles.append(stream.read_next())
+		self.assertGreater(stream.rereads, 0)
+		for data in profiles:
+			velocity = extract_measures(data, config)["velocity"]
+			self.assertEqual(len(np.unique(velocity)), 1)
+
+	def test_single_block_sequence_register(self):
+		self.check_single_block(TaggedSimulator(_addr_profile_count=ADDR_PROFILE_COUNT))
+
+	def test_single_block_content(self):
+		self.check_single_block(TaggedSimulator())
+
+	def test_read_too_slow(self):
+		apf, config = simulated_driver(Apf04Simulator(), 115200)
+		with self.assertRaises(apf04_exception) as context:
+			Apf04AutoStream(apf, config)
+		self.assertEqual(context.exception.code, 2008)
+
+
+# We need this to be able to run the tests outside a test framework.
+if __name__ == '__main__':
+	unittest.main()
@@ -0,0 +1,100 @@
+# -*- coding: UTF_8 -*-
+
+import unittest
+# Add path to the lib folder
+import sys, os
+lib_path = os.path.abspath(__file__).split('/peacock_uvp_py_api')[0]+'/peacock_uvp_py_api'
+sys.path.insert(0, lib_path)
+#-------------------------------------
+
+from time import perf_counter, sleep
+
+from peacock_uvp.apf04_bus import Apf04Bus, Apf04Poller
+from peacock_uvp.apf04_simulator import Apf04Simulator, LoopbackSerial
+
+
+def simulated_bus(_slave_addrs, _baudrate=750000, _time_scale=1.):
+	simulators = [Apf04Simulator(_slave_addr=slave_addr, _serial_num=slave_addr, _time_scale=_time_scale) for slave_addr in _slave_addrs]
+	bus = Apf04Bus("simulator", _baudrate, 36e6, _slave_addrs, LoopbackSerial(simulators, _baudrate))
+	bus.read_configs()
+	return bus
+
+
+# The main test class
+class TestBus(unittest.TestCase):
+	def test_measure(self):
+		bus = simulated_bus([4, 5, 6])
+		for slave_addr, device in bus.devices.items():
+			self.assertEqual(device.serial_num, slave_addr)
+		bloc_duration = bus.devices[4].config.get_bloc_duration()
+
+		start = perf_counter()
+		profiles = bus.measure()
+		duration = perf_counter() - start
+		self.assertEqual(sorted(profiles), [4, 5, 6])
+		for data in profiles.values():
+			self.assertEqual(len(data), 2*(3+8+4*bus.devices[4].config.n_vol))
+		# the measurements overlap
+		self.assertLess(duration, 3*bloc_duration)
+
+	def test_caller_port(self):
+		line = LoopbackSerial(Apf04Simulator(), 750000)
+		bus = Apf04Bus(None, 750000, 36e6, [4], line)
+		self.assertEqual(bus.devices[4].version_c, 53)
+		del bus
+		# the port given is not closed with the bus
+		self.assertTrue(line.is_open)
+
+	def test_non_blocking(self):
+		bus = simulated_bus([4, 5])
+		device, other = bus.devices[4], bus.devices[5]
+		bloc_duration = device.config.get_bloc_duration()
+
+		end = device.act_start_profile()
+		self.assertAlmostEqual(end - perf_counter(), bloc_duration, delta=0.01)
+		self.assertFalse(device.poll_profile())
+		# the line is free during the measurement
+		self.assertEqual(other.read_version(), (1, 53))
+		self.assertLess(perf_counter(), end)
+		device.wait_profile()
+		self.assertTrue(device.poll_profile())
+		self.assertEqual(len(device.read_profile(device.config.n_vol)), 2*(3+8+4*device.config.n_vol))
+
+		# cancellation
+		device.act_start_profile()
+		device.act_stop()
+		self.assertTrue(device.poll_profile())
+
+	def test_poll_action(self):
+		# the device is slower than expected
+		bus = simulated_bus([4], _time_scale=1.5)
+		device = bus.devices[4]
+		bloc_duration = device.config.get_bloc_duration()
+
+		# by default the measurement is taken as finished at its expected end
+		end = device.act_start_profile()
+		device.wait_profile()
+		self.assertLess(perf_counter() - end, 0.2*bloc_duration)
+		device.act_stop()
+
+		# the end read in the device
+		device.poll_action = True
+		end = device.act_start_profile()
+		device.wait_profile()
+		self.assertGreater(perf_counter() - end, 0.4*bloc_duration)
+		self.assertTrue(device.poll_profile())
+
+	def test_poller(self):
+		received = []
+		buses = [simulated_bus([4, 5]), simulated_bus([4, 7])]
+		poller = Apf04Poller(buses, lambda bus, slave_addr, data: received.append((buses.index(bus), slave_addr)))
+		with poller:
+			sleep(0.3)
+		self.assertTrue(all(cycles > 0 for cycles in poller.cycles))
+		self.assertEqual(poller.profiles, [2*cycles for cycles in poller.cycles])
+		self.assertEqual(set(received), {(0, 4), (0, 5), (1, 4), (1, 7)})
+
+
+# We need this to be able to run the tests outside a test framework.
+if __name__ == '__main__':
+	unittest.main()
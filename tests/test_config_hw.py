@@ -0,0 +1,63 @@
+# -*- coding: UTF_8 -*-
+
+import unittest
+# Add path to the lib folder
+import sys, os
+lib_path = os.path.abspath(__file__).split('/peacock_uvp_py_api')[0]+'/peacock_uvp_py_api'
+sys.path.insert(0, lib_path)
+#-------------------------------------
+
+import copy
+import pickle
+from struct import unpack
+
+from peacock_uvp.apf04_config_hw import ConfigHw, CONFIG_FIELDS
+
+from test_measures import load_config
+
+
+# The main test class
+class TestConfigHw(unittest.TestCase):
+	def test_attributes(self):
+		config = load_config()
+		words = config.to_list()
+		self.assertEqual(len(words), len(CONFIG_FIELDS))
+		for name, word in zip(CONFIG_FIELDS, words):
+			self.assertEqual(getattr(config, name), word)
+
+		config.n_vol = 42
+		self.assertEqual(config.to_list()[CONFIG_FIELDS.index("n_vol")], 42)
+		# the list is a copy
+		config.to_list()[0] = -1
+		self.assertNotEqual(config.div_f0, -1)
+		with self.assertRaises(AttributeError):
+			config.unknown = 0
+
+		other = ConfigHw(config.f_sys)
+		other.from_list(config.to_list())
+		self.assertEqual(other, config)
+		self.assertEqual(other.burst_mode, config.burst_mode)
+
+	def test_bytes(self):
+		config = load_config()
+		self.assertEqual(list(unpack("<%dh"%len(CONFIG_FIELDS), config.to_bytes())), config.to_list())
+		self.assertIs(config.to_bytes(), config.to_bytes())
+		config.gain_ca0 += 1
+		self.assertEqual(unpack("<%dh"%len(CONFIG_FIELDS), config.to_bytes())[CONFIG_FIELDS.index("gain_ca0")], config.gain_ca0)
+
+	def test_hash(self):
+		config = load_config()
+		other = copy.deepcopy(config)
+		self.assertEqual(other, config)
+		self.assertEqual(hash(other), hash(config))
+		self.assertEqual(pickle.loads(pickle.dumps(config)), config)
+
+		cache = {config: "config"}
+		self.assertEqual(cache[other], "config")
+		other.n_avg += 1
+		self.assertNotEqual(other, config)
+		self.assertNotIn(other, cache)
+
+
+if __name__ == '__main__':
+	unittest.main()
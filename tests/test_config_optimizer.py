@@ -0,0 +1,88 @@
+# -*- coding: UTF_8 -*-
+
+import unittest
+# Add path to the lib folder
+import sys, os
+lib_path = os.path.abspath(__file__).split('/peacock_uvp_py_api')[0]+'/peacock_uvp_py_api'
+sys.path.insert(0, lib_path)
+#-------------------------------------
+
+import numpy as np
+
+from peacock_uvp.apf04_config_optimizer import evaluate_settings, optimize_settings, pareto_front, \
+	candidate_config, transfer_time, DEFAULT_OBJECTIVES
+from peacock_uvp.apf04_simulator import DEFAULT_SETTINGS, frame_duration
+
+F_SYS = 36e6
+
+GRID = {
+	"f0": [0.5e6, 1e6, 2e6, 3e6],
+	"prf": np.linspace(200, 4000, 12),
+	"n_vol": [20, 50, 120, 250],
+	"r_dvol": [0.002, 0.005, 0.01],
+	"n_ech": [16, 32, 64],
+}
+
+
+# The main test class
+class TestConfigOptimizer(unittest.TestCase):
+	def test_quantization(self):
+		candidates = evaluate_settings(DEFAULT_SETTINGS, GRID, F_SYS, 750000, 1480)
+		self.assertEqual(len(candidates), 4*12*4*3*3)
+		for candidate in candidates[::37]:
+			config = candidate_config(candidate, DEFAULT_SETTINGS, F_SYS, 1480)
+			self.assertEqual([config.div_f0, config.c_prf, config.n_tir, config.n_em, config.n_vol, config.c_vol1, config.c_dvol, config.n_avg], \
+				[candidate[key] for key in ["div_f0", "c_prf", "n_tir", "n_em", "n_vol_code", "c_vol1", "c_dvol", "n_avg"]])
+			self.assertAlmostEqual(config.get_bloc_duration(), candidate["bloc_duration"])
+
+	def test_transfer_time(self):
+		# trigger (write 1 word) + 2 read frames of 125 and 83 words
+		n_bytes = 11 + 8 + 2*8 + (5+250) + (5+166)
+		self.assertAlmostEqual(transfer_time(50, 115200), frame_duration(n_bytes, 115200))
+
+	def test_pareto(self):
+		candidates = evaluate_settings(DEFAULT_SETTINGS, GRID, F_SYS, 115200, 1480)
+		candidates = candidates[candidates["valid"]]
+		front = pareto_front(candidates)
+		scores = np.stack([sign*candidates[field] for field, sign in DEFAULT_OBJECTIVES], axis=1)
+		for i in range(len(candidates)):
+			dominated = np.all(scores >= scores[i], axis=1) & np.any(scores > scores[i], axis=1)
+			# the candidates of the front are not dominated, the others are (or equal to one of the front)
+			if i in front:
+				self.assertFalse(dominated.any())
+			else:
+				self.assertTrue(dominated.any() or any((scores[j] == scores[i]).all() for j in front))
+		# same front when the candidates are compared to the front (no dominance grid), by small blocks
+		self.assertEqual(sorted(pareto_front(candidates, _block_size=16, _max_grid_size=0)), sorted(front))
+		self.assertEqual(sorted(pareto_front(candidates, _block_size=16)), sorted(front))
+
+	def test_pareto_random(self):
+		# objective 0 with few distinct values, the candidates span several blocks
+		rng = np.random.default_rng(1)
+		objectives = [('a', 1), ('b', -1), ('c', 1)]
+		for _ in range(50):
+			candidates = np.zeros(200, dtype=[('a', 'f8'), ('b', 'f8'), ('c', 'f8')])
+			candidates['a'] = rng.integers(0, 3, len(candidates))
+			candidates['b'] = rng.integers(0, 5, len(candidates))
+			candidates['c'] = rng.normal(size=len(candidates))
+			scores = np.stack([sign*candidates[field] for field, sign in objectives], axis=1)
+			expected = [i for i in range(len(candidates)) \
+				if not (np.all(scores >= scores[i], axis=1) & np.any(scores > scores[i], axis=1)).any() \
+				and not (scores[:i] == scores[i]).all(axis=1).any()]
+			for kwargs in [{}, {"_block_size": 16}, {"_block_size": 16, "_max_grid_size": 0}]:
+				self.assertEqual(sorted(pareto_front(candidates, objectives, **kwargs)), expected)
+		# default objectives
+		candidates = evaluate_settings(DEFAULT_SETTINGS, GRID, F_SYS, 115200, 1480)
+		candidates = candidates[candidates["valid"]]
+		self.assertEqual(sorted(pareto_front(candidates, _block_size=32)), sorted(pareto_front(candidates, _max_grid_size=0)))
+
+	def test_optimize(self):
+		front = optimize_settings(DEFAULT_SETTINGS, GRID, F_SYS, 115200, 1480, _constraints={"range_max": (0.5, None), "profile_rate": (5, None)})
+		self.assertTrue(len(front))
+		self.assertTrue((front["range_max"] >= 0.5).all())
+		self.assertTrue((front["profile_rate"] >= 5).all())
+		self.assertTrue((np.diff(front["profile_rate"]) <= 0).all())
+
+
+if __name__ == '__main__':
+	unittest.main()
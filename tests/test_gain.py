@@ -8,7 +8,19 @@ sys.path.insert(0, lib_path)
 #-------------------------------------
 
 
-from peacock_uvp.apf04_gain import convert_code2dB, convert_dB2code
+from math import pow
+
+from peacock_uvp.apf04_gain import convert_code2dB, convert_dB2code, _convert_code2dB_trunc, calc_gain, gain_table, gain_tuple
+
+
+def calc_gain_reference(_n_vol, _gain_ca0, _gain_ca1, _gain_max_ca0, _gain_max_ca1):
+	# cell by cell computation of the gain table
+	tab_gain = []
+	for i in range(_n_vol):
+		G = _convert_code2dB_trunc(_gain_ca0 + (i * _gain_ca1) / 16.)
+		G_max = _convert_code2dB_trunc(_gain_max_ca0 + (i * _gain_max_ca1) / 16.)
+		tab_gain.append(pow(10, min(G, G_max) / 20.))
+	return tab_gain
 
 
 # The main test class
@@ -23,6 +35,26 @@ class TestGain(unittest.TestCase):
 			# check the opposit function 
 			assert (int(convert_dB2code(gdb)) == gc) 
 
+	def test_gain_table(self):
+		print ("### test gain table :")
+		for args in [(120, 600, 12, 1241, 0), (50, -200, 40, 900, -10), (200, 1300, 0, 1241, 0), (1, 0, 0, 0, 0)]:
+			ref = calc_gain_reference(*args)
+			tab = calc_gain(*args)
+			assert (len(tab) == len(ref))
+			for g, g_ref in zip(tab, ref):
+				assert (abs(g - g_ref) <= 1e-15*g_ref)
+
+	def test_gain_table_cache(self):
+		gain_table.cache_clear()
+		tab = gain_table(120, 600, 12, 1241, 0)
+		assert (gain_table(120, 600, 12, 1241, 0) is tab)
+		assert (not tab.flags.writeable)
+		info = gain_table.cache_info()
+		assert (info.hits == 1 and info.misses == 1)
+		tab = gain_tuple(120, 600, 12, 1241, 0)
+		assert (gain_tuple(120, 600, 12, 1241, 0) is tab)
+		assert (list(tab) == calc_gain(120, 600, 12, 1241, 0))
+
 		
 # We need this to be able to run the tests outside a test framework.
 if __name__ == '__main__':
@@ -0,0 +1,47 @@
+# -*- coding: UTF_8 -*-
+
+import unittest
+# Add path to the lib folder
+import sys, os
+lib_path = os.path.abspath(__file__).split('/peacock_uvp_py_api')[0]+'/peacock_uvp_py_api'
+sys.path.insert(0, lib_path)
+#-------------------------------------
+
+import json
+import logging
+import subprocess
+
+# maximum time to import the modules of the package (numpy being already imported), in seconds
+IMPORT_TIME_BUDGET = 0.2
+
+# run in a fresh interpreter : the modules are not imported yet
+IMPORT_SCRIPT = """
+import sys, json, logging
+from time import perf_counter
+import numpy
+start = perf_counter()
+import peacock_uvp.apf04_measures
+import peacock_uvp.apf04_driver
+duration = perf_counter() - start
+print(json.dumps({"duration": duration, "serial": "serial" in sys.modules,
+	"handlers": len(logging.getLogger().handlers), "level": logging.getLogger().level}))
+"""
+
+# The main test class
+class TestImport(unittest.TestCase):
+	def test_import(self):
+		root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+		output = subprocess.run([sys.executable, "-c", IMPORT_SCRIPT], cwd=root, \
+			stdout=subprocess.PIPE, check=True).stdout
+		# nothing else is printed
+		result = json.loads(output)
+		# pyserial is only needed to open a port
+		self.assertFalse(result["serial"])
+		# the logging configuration is left to the application
+		self.assertEqual(result["handlers"], 0)
+		self.assertEqual(result["level"], logging.WARNING)
+		self.assertLess(result["duration"], IMPORT_TIME_BUDGET)
+
+
+if __name__ == '__main__':
+	unittest.main()
@@ -0,0 +1,85 @@
+# -*- coding: UTF_8 -*-
+
+import unittest
+# Add path to the lib folder
+import sys, os
+lib_path = os.path.abspath(__file__).split('/peacock_uvp_py_api')[0]+'/peacock_uvp_py_api'
+sys.path.insert(0, lib_path)
+#-------------------------------------
+
+import tempfile
+
+import numpy as np
+
+from peacock_uvp.apf04_driver import Apf04Driver
+from peacock_uvp.apf04_iq import decode_iq, read_iq_file, Apf04IQRecorder
+from peacock_uvp.apf04_exception import apf04_error
+from peacock_uvp.apf04_simulator import Apf04Simulator, LoopbackSerial, DEFAULT_SETTINGS
+
+ADDR_IQ = 0x1000
+
+
+def simulated_driver(_simulator, _n_vol=50):
+	apf = Apf04Driver(None, 36e6, "simulator")
+	apf.ser = LoopbackSerial(_simulator, 750000, _time_scale=0.)
+	apf.addr = _simulator.addr
+	apf.read_version()
+	config = apf.new_config().set(dict(DEFAULT_SETTINGS, n_vol=_n_vol))
+	apf.write_config(config, 0)
+	apf.select_config(0)
+	return apf, config
+
+
+# The main test class
+class TestIQ(unittest.TestCase):
+	def test_decode(self):
+		iq = np.arange(2*3*4, dtype=np.int16).reshape(3, 4, 2)
+		expected = iq[..., 0] + 1j*iq[..., 1]
+		data = decode_iq(iq.astype('>i2').tobytes(), 3, 4)
+		self.assertEqual(data.dtype, np.complex64)
+		self.assertTrue((data == expected).all())
+		# several blocks
+		blocks = np.stack([iq, -iq])
+		self.assertTrue((decode_iq(blocks, 3, 4) == np.stack([expected, -expected])).all())
+
+	def test_read(self):
+		simulator = Apf04Simulator(_time_scale=0., _addr_iq=ADDR_IQ)
+		apf, config = simulated_driver(simulator)
+		apf.act_meas_IQ()
+		data = apf.read_IQ(config.n_tir, config.n_vol)
+		self.assertEqual(data.shape, (config.n_tir, config.n_vol))
+		iq = simulator.iq[:2*config.n_tir*config.n_vol].reshape(config.n_tir, config.n_vol, 2)
+		self.assertTrue((data.real == iq[..., 0]).all())
+		self.assertTrue((data.imag == iq[..., 1]).all())
+
+		with self.assertRaises(apf04_error):
+			apf.read_IQ(config.n_tir, 1000)
+
+	def test_no_iq_buffer(self):
+		apf, config = simulated_driver(Apf04Simulator(_time_scale=0.))
+		with self.assertRaises(apf04_error):
+			apf.read_IQ(config.n_tir, config.n_vol)
+
+	def test_recorder(self):
+		simulator = Apf04Simulator(_time_scale=0., _addr_iq=ADDR_IQ)
+		apf, config = simulated_driver(simulator)
+		with tempfile.TemporaryDirectory() as directory:
+			path = os.path.join(directory, "record.iq")
+			with Apf04IQRecorder(apf, config, path, _n_buffers=2) as recorder:
+				self.assertEqual(recorder.record(5), 5)
+			file_config, version_c, blocks = read_iq_file(path)
+			self.assertEqual(file_config, config)
+			self.assertEqual(version_c, 53)
+			self.assertEqual(len(blocks), 5)
+			self.assertTrue((np.diff(blocks["timestamp"]) >= 0).all())
+			data = decode_iq(blocks["iq"], config.n_tir, config.n_vol)
+			self.assertEqual(data.shape, (5, config.n_tir, config.n_vol))
+			iq = simulator.iq[:2*config.n_tir*config.n_vol].reshape(config.n_tir, config.n_vol, 2)
+			self.assertTrue((data[-1].real == iq[..., 0]).all())
+			self.assertFalse((data[0] == data[-1]).all())
+			del blocks
+
+
+# We need this to be able to run the tests outside a test framework.
+if __name__ == '__main__':
+	unittest.main()
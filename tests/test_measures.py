@@ -0,0 +1,84 @@
+# -*- coding: UTF_8 -*-
+
+import unittest
+# Add path to the lib folder
+import sys, os
+lib_path = os.path.abspath(__file__).split('/peacock_uvp_py_api')[0]+'/peacock_uvp_py_api'
+sys.path.insert(0, lib_path)
+#-------------------------------------
+
+import json
+import pathlib
+import random
+from datetime import datetime
+from struct import pack
+
+import numpy as np
+
+from peacock_uvp.apf04_config_hw import ConfigHw
+from peacock_uvp.apf04_measures import extract_measures, extract_measures_batch
+from peacock_uvp.apf_timestamp import encode_timestamp
+
+
+def load_config():
+	model_path = str(pathlib.Path(__file__).parent.absolute()) \
+		+ '/test_apf04_json_models'
+	with open(model_path+'/settings.json') as json_file:
+		settings = json.loads(json_file.read())
+	return ConfigHw(36e6).set(settings["configs"]["num1"])
+
+def make_profile(config, seed=0, gain_ca0=600, gain_ca1=12):
+	""" build a raw profile (as returned by Apf04Driver.read_profile) with random cells
+	"""
+	rnd = random.Random(seed)
+	cells = [rnd.randint(-32768, 32767) for _ in range(4*config.n_vol)]
+	# force some invalid values
+	cells[0:4] = [-32768]*4
+	return encode_timestamp(datetime(2021, 5, 3, 12, 30, 15, 250000)) \
+		+ pack('<8h', 2, -3, 21, 1480, gain_ca0, gain_ca1, 11, 7) \
+		+ pack('<%dh'%len(cells), *cells)
+
+
+# The main test class
+class TestMeasures(unittest.TestCase):
+	def test_array_decode(self):
+		config = load_config()
+		for seed in range(5):
+			raw = make_profile(config, seed)
+			ref = extract_measures(raw, config)
+			res = extract_measures(raw, config, _as_array=True)
+
+			for key in ["timestamp", "pitch", "roll", "temp", "gain_ca0", "gain_ca1", "noise_g_max", "noise_g_mid"]:
+				self.assertEqual(ref[key], res[key])
+
+			for key in ["velocity", "std", "amplitude", "snr"]:
+				self.assertEqual(len(res[key]), config.n_vol)
+				self.assertEqual(str(res[key].dtype), "float64")
+				for expected, value in zip(ref[key], res[key].tolist()):
+					if expected is None:
+						self.assertNotEqual(value, value) # NaN
+					else:
+						self.assertEqual(expected, value)
+
+	def test_batch_decode(self):
+		config = load_config()
+		raws = [make_profile(config, seed, gain_ca0=600+seed%2, gain_ca1=seed%3) for seed in range(7)]
+
+		for data in [raws, b''.join(raws)]:
+			res = extract_measures_batch(data, config)
+			self.assertEqual(res["velocity"].shape, (len(raws), config.n_vol))
+			for i, raw in enumerate(raws):
+				ref = extract_measures(raw, config, _as_array=True)
+				self.assertEqual(res["timestamp"][i].item(), ref["timestamp"].replace(tzinfo=None))
+				for key in ["pitch", "roll", "temp", "gain_ca0", "gain_ca1", "noise_g_max", "noise_g_mid"]:
+					self.assertEqual(res[key][i], ref[key])
+				for key in ["velocity", "std", "amplitude", "snr"]:
+					self.assertTrue(np.array_equal(res[key][i], ref[key], equal_nan=True))
+
+		with self.assertRaises(Exception):
+			extract_measures_batch(raws[0][:-2], config)
+
+
+# We need this to be able to run the tests outside a test framework.
+if __name__ == '__main__':
+	unittest.main()
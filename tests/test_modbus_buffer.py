@@ -0,0 +1,98 @@
+# -*- coding: UTF_8 -*-
+
+import unittest
+# Add path to the lib folder
+import sys, os
+lib_path = os.path.abspath(__file__).split('/peacock_uvp_py_api')[0]+'/peacock_uvp_py_api'
+sys.path.insert(0, lib_path)
+#-------------------------------------
+
+import struct
+from datetime import datetime
+
+import numpy as np
+
+from peacock_uvp.apf04_modbus import Apf04Modbus
+from peacock_uvp.apf04_driver import Apf04Driver
+from peacock_uvp.apf04_addr_cmd import get_addr_dict
+from peacock_uvp.apf_timestamp import encode_timestamp
+from peacock_uvp.modbus_crc import crc16
+
+
+class FakeSerial ():
+	""" answers to modbus read requests (function 3) with word value = address
+	"""
+	def __init__(self):
+		self.answer = b''
+		self.frames = 0
+
+	def write(self, _query):
+		addr, size = struct.unpack(">HH", bytes(_query[2:6]))
+		answer = struct.pack(">BBB%dH"%size, 0x04, 3, 2*size, *range(addr, addr+size))
+		self.answer += answer + struct.pack(">H", crc16(answer))
+		self.frames += 1
+
+	def read(self, _size):
+		data, self.answer = self.answer[:_size], self.answer[_size:]
+		return data
+
+	def readinto(self, _buf):
+		data = self.read(len(_buf))
+		_buf[:len(data)] = data
+		return len(data)
+
+	def close(self):
+		pass
+
+
+# The main test class
+class TestApf04ModbusBuffer(unittest.TestCase):
+	def setUp(self):
+		self.apf = Apf04Modbus(_dev="fake")
+		self.apf.ser = FakeSerial()
+
+	def test_read_seg(self):
+		self.assertEqual(self.apf.read_seg_16(10, 3), struct.pack(">3H", 10, 11, 12))
+
+	def test_read_buf_into(self):
+		size = 300
+		expected = struct.pack(">%dH"%size, *range(5, 5+size))
+		self.assertEqual(self.apf.read_buf_i16(5, size), expected)
+
+		# caller supplied buffer
+		buf = bytearray(2*size+10)
+		view = self.apf.read_buf_i16_into(5, size, buf)
+		self.assertEqual(bytes(view), expected)
+		self.assertEqual(bytes(buf[:2*size]), expected)
+
+		# pooled buffer is reused from one call to another
+		view = self.apf.read_buf_i16_into(5, size)
+		pool = self.apf._pool
+		self.apf.read_buf_i16_into(7, size)
+		self.assertIs(self.apf._pool, pool)
+		self.assertEqual(self.apf.ser.frames, 12)
+
+	def test_read_profile(self):
+		apf = Apf04Driver(None, 36e6, "fake", get_addr_dict(53))
+		apf.ser = FakeSerial()
+		apf.timestamp_profile = datetime(2021, 5, 3, 12, 30, 15, 250000)
+		n_vol = 120
+		size = apf.addr["SIZE_PROFILE_HEADER"] + 4*n_vol
+
+		# reference : swap with struct
+		data = apf.read_buf_i16(apf.addr["ADDR_PROFILE_HEADER"], size)
+		expected = encode_timestamp(apf.timestamp_profile) \
+			+ struct.pack('<%sh'%size, *struct.unpack('>%sh'%size, data))
+		self.assertEqual(apf.read_profile(n_vol), expected)
+
+		raw, dtype = apf.read_profile(n_vol, _swap=False)
+		self.assertEqual(raw[6:], data)
+		self.assertEqual(dtype.itemsize, len(raw))
+		record = np.frombuffer(raw, dtype=dtype)[0]
+		self.assertEqual(record['pitch'], apf.addr["ADDR_PROFILE_HEADER"])
+		self.assertEqual(record['cells']['snr'][-1], apf.addr["ADDR_PROFILE_HEADER"] + size - 1)
+
+
+# We need this to be able to run the tests outside a test framework.
+if __name__ == '__main__':
+	unittest.main()
@@ -0,0 +1,51 @@
+# -*- coding: UTF_8 -*-
+
+import unittest
+# Add path to the lib folder
+import sys, os
+lib_path = os.path.abspath(__file__).split('/peacock_uvp_py_api')[0]+'/peacock_uvp_py_api'
+sys.path.insert(0, lib_path)
+#-------------------------------------
+
+from peacock_uvp.apf04_read_plan import plan_reads, read_registers
+from peacock_uvp.apf04_addr_cmd import ADDR_VERSION_C, ADDR_VERSION_VHDL, ADDR_ACTION
+from peacock_uvp.apf04_simulator import Apf04Simulator
+
+from test_simulator import simulated_driver
+
+
+# The main test class
+class TestReadPlan(unittest.TestCase):
+	def test_plan(self):
+		frames = plan_reads({"a":0x10, "b":0x12, "c":0x11, "d":0x40})
+		self.assertEqual(frames, ((0x10, 3, (("a", 0, 1), ("c", 1, 1), ("b", 2, 1))), (0x40, 1, (("d", 0, 1),))))
+		# gap allowed
+		self.assertEqual(len(plan_reads({"a":0x10, "b":0x40}, _max_gap=0x30)), 1)
+		# registers out of the RAM are read one by one
+		self.assertEqual(len(plan_reads({"c":ADDR_VERSION_C, "vhdl":ADDR_VERSION_VHDL, "action":ADDR_ACTION})), 3)
+		# frame size limit
+		frames = plan_reads({"a":(0, 100), "b":(100, 100)})
+		self.assertEqual([(addr, size) for addr, size, names in frames], [(0, 100), (100, 100)])
+
+	def test_read(self):
+		simulator = Apf04Simulator(_time_scale=0.)
+		apf = simulated_driver(simulator)
+		apf.write_buf_i16([1, -2, 3, 4, 5], 0x100)
+
+		n_frames = simulator.n_frames
+		values = read_registers(apf, {"a":0x100, "b":0x101, "c":(0x102, 3)})
+		self.assertEqual(values, {"a":1, "b":-2, "c":(3, 4, 5)})
+		self.assertEqual(simulator.n_frames - n_frames, 1)
+
+		n_frames = simulator.n_frames
+		sensors = apf.read_sensors()
+		self.assertEqual(simulator.n_frames - n_frames, 1)
+		self.assertEqual(sensors, {"pitch":apf.read_pitch(), "roll":apf.read_roll(), "temp":apf.read_temp()})
+
+		n_frames = simulator.n_frames
+		self.assertEqual(apf.read_version(), (1, 53))
+		self.assertEqual(simulator.n_frames - n_frames, 2)
+
+
+if __name__ == '__main__':
+	unittest.main()
@@ -0,0 +1,195 @@
+# -*- coding: UTF_8 -*-
+
+import unittest
+# Add path to the lib folder
+import sys, os
+lib_path = os.path.abspath(__file__).split('/peacock_uvp_py_api')[0]+'/peacock_uvp_py_api'
+sys.path.insert(0, lib_path)
+#-------------------------------------
+
+import tempfile
+from datetime import datetime, timedelta
+
+import numpy as np
+
+from peacock_uvp.apf04_recording import Apf04RecordingWriter, Apf04RecordingReader, Apf04RecordingMap, INDEX_SUFFIX, \
+	CODECS, CODEC_DELTA_ZLIB, encode_chunk, decode_chunk
+from peacock_uvp.apf04_measures import extract_measures_batch
+from peacock_uvp.apf04_exception import apf04_error
+from peacock_uvp.apf_timestamp import encode_timestamp
+
+from test_measures import load_config, make_profile
+
+START = datetime(2021, 5, 3, 12, 0, 0)
+
+def make_profiles(config, n, first=0):
+	""" raw profiles measured every second """
+	return [encode_timestamp(START + timedelta(seconds=i)) + make_profile(config, i)[6:] for i in range(first, first+n)]
+
+
+# The main test class
+class TestRecording(unittest.TestCase):
+	def setUp(self):
+		self.tmp = tempfile.TemporaryDirectory()
+		self.path = os.path.join(self.tmp.name, "record.apf")
+		self.config = load_config()
+
+	def tearDown(self):
+		self.tmp.cleanup()
+
+	def test_write_read(self):
+		profiles = make_profiles(self.config, 100)
+		with Apf04RecordingWriter(self.path, self.config, 53, _chunk_profiles=16) as writer:
+			for data in profiles:
+				writer.write(data)
+		self.assertEqual(writer.chunks, 7)
+
+		with Apf04RecordingReader(self.path) as reader:
+			self.assertEqual(len(reader), 100)
+			self.assertEqual(reader.config, self.config)
+			self.assertEqual(reader.version_c, 53)
+			self.assertEqual(list(reader), profiles)
+			self.assertEqual(reader.read_range(), b"".join(profiles))
+			self.assertEqual(reader.read_range(START + timedelta(seconds=20), START + timedelta(seconds=37)), b"".join(profiles[20:37]))
+			self.assertEqual(reader.read_range(START + timedelta(seconds=200)), b"")
+
+			data = extract_measures_batch(reader.read_range(START, START + timedelta(seconds=10)), reader.config)
+			self.assertEqual(data["velocity"].shape, (10, self.config.n_vol))
+
+	def test_append(self):
+		profiles = make_profiles(self.config, 40)
+		with Apf04RecordingWriter(self.path, self.config, 53, _chunk_profiles=16) as writer:
+			for data in profiles[:20]:
+				writer.write(data)
+		size = os.path.getsize(self.path)
+		with Apf04RecordingWriter(self.path, self.config, 53, _chunk_profiles=16) as writer:
+			self.assertEqual(writer.profiles, 20)
+			for data in profiles[20:]:
+				writer.write(data)
+		with open(self.path, "rb") as f:
+			# the file is only appended
+			self.assertEqual(f.read(size)[-len(profiles[19]):], profiles[19])
+		with Apf04RecordingReader(self.path) as reader:
+			self.assertEqual(list(reader), profiles)
+
+		config = load_config()
+		config.n_vol += 1
+		with self.assertRaises(apf04_error):
+			Apf04RecordingWriter(self.path, config, 53)
+
+	def test_recovery(self):
+		profiles = make_profiles(self.config, 48)
+		with Apf04RecordingWriter(self.path, self.config, 53, _chunk_profiles=16) as writer:
+			for data in profiles[:32]:
+				writer.write(data)
+		# interrupted recording : incomplete chunk, index lost
+		with open(self.path, "ab") as f:
+			f.write(b"CHNK\x00\x10")
+		os.remove(self.path + INDEX_SUFFIX)
+
+		with Apf04RecordingReader(self.path) as reader:
+			self.assertEqual(list(reader), profiles[:32])
+		with Apf04RecordingWriter(self.path, self.config, 53, _chunk_profiles=16) as writer:
+			for data in profiles[32:]:
+				writer.write(data)
+		with Apf04RecordingReader(self.path) as reader:
+			self.assertEqual(len(reader.index), 3)
+			self.assertEqual(list(reader), profiles)
+
+	def test_truncated_chunk(self):
+		profiles = make_profiles(self.config, 48)
+		with Apf04RecordingWriter(self.path, self.config, 53, _chunk_profiles=16) as writer:
+			for data in profiles:
+				writer.write(data)
+		# interrupted before the sync : the index has the last chunk, its payload is incomplete
+		index_size = os.path.getsize(self.path + INDEX_SUFFIX)
+		with open(self.path, "r+b") as f:
+			f.truncate(os.path.getsize(self.path) - 100)
+
+		with Apf04RecordingReader(self.path) as reader:
+			self.assertEqual(len(reader.index), 2)
+			self.assertEqual(len(reader), 32)
+			self.assertEqual(list(reader), profiles[:32])
+			self.assertEqual(reader.read_range(), b"".join(profiles[:32]))
+		self.assertEqual(os.path.getsize(self.path + INDEX_SUFFIX), index_size)
+		with Apf04RecordingWriter(self.path, self.config, 53, _chunk_profiles=16) as writer:
+			self.assertEqual(writer.profiles, 32)
+			for data in profiles[32:]:
+				writer.write(data)
+		with Apf04RecordingReader(self.path) as reader:
+			self.assertEqual(len(reader.index), 3)
+			self.assertEqual(list(reader), profiles)
+
+	def test_map(self):
+		profiles = make_profiles(self.config, 100)
+		with Apf04RecordingWriter(self.path, self.config, 53, _chunk_profiles=16) as writer:
+			for data in profiles:
+				writer.write(data)
+
+		with Apf04RecordingMap(self.path) as recording:
+			self.assertEqual(len(recording), 100)
+			self.assertEqual(recording[37].tobytes(), profiles[37])
+			self.assertEqual(recording[-1].tobytes(), profiles[-1])
+
+			# slices are views on the file
+			view = recording[10:50]
+			self.assertEqual(len(view), 40)
+			self.assertEqual(len(view.segments), 4)
+			for segment in view.segments:
+				self.assertFalse(segment.flags.owndata)
+				self.assertFalse(segment.flags.writeable)
+				# the int16 fields are aligned
+				self.assertTrue(segment["cells"]["velocity"].flags.aligned)
+			self.assertEqual(view.to_array().tobytes(), b"".join(profiles[10:50]))
+
+			view = recording.select(START + timedelta(seconds=20), START + timedelta(seconds=37))
+			self.assertEqual(len(view), 17)
+			self.assertEqual(view.timestamps()[0], np.datetime64(START + timedelta(seconds=20), "ms"))
+			measures = view.to_measures()
+			expected = extract_measures_batch(b"".join(profiles[20:37]), self.config)
+			np.testing.assert_array_equal(measures["velocity"], expected["velocity"])
+			np.testing.assert_array_equal(measures["timestamp"], expected["timestamp"])
+
+			self.assertEqual(len(recording.select(START + timedelta(seconds=200))), 0)
+
+	def test_map_truncated_chunk(self):
+		profiles = make_profiles(self.config, 48)
+		with Apf04RecordingWriter(self.path, self.config, 53, _chunk_profiles=16) as writer:
+			for data in profiles:
+				writer.write(data)
+		with open(self.path, "r+b") as f:
+			f.truncate(os.path.getsize(self.path) - 100)
+		with Apf04RecordingMap(self.path) as recording:
+			self.assertEqual(len(recording), 32)
+			self.assertEqual(recording[10:40].to_array().tobytes(), b"".join(profiles[10:32]))
+
+	def test_codec(self):
+		profiles = make_profiles(self.config, 20)
+		payload = b"".join(profiles)
+		for codec in CODECS:
+			encoded = encode_chunk(payload, len(profiles[0]), codec)
+			self.assertEqual(bytes(decode_chunk(encoded, len(profiles[0]), codec)), payload)
+		# differences out of the int16 range
+		payload = np.array([[32767, -32768], [-32768, 32767], [0, 0]], dtype="<i2").tobytes()
+		for codec in CODECS:
+			self.assertEqual(bytes(decode_chunk(encode_chunk(payload, 4, codec), 4, codec)), payload)
+
+	def test_compressed(self):
+		profiles = make_profiles(self.config, 100)
+		with Apf04RecordingWriter(self.path, self.config, 53, _chunk_profiles=16, _codec=CODEC_DELTA_ZLIB) as writer:
+			for data in profiles[:50]:
+				writer.write(data)
+		# chunks with different codecs in the same recording
+		with Apf04RecordingWriter(self.path, self.config, 53, _chunk_profiles=16) as writer:
+			for data in profiles[50:]:
+				writer.write(data)
+
+		with Apf04RecordingReader(self.path) as reader:
+			self.assertEqual(list(reader), profiles)
+			self.assertEqual(reader.read_range(START + timedelta(seconds=20), START + timedelta(seconds=70)), b"".join(profiles[20:70]))
+		with self.assertRaises(apf04_error):
+			Apf04RecordingMap(self.path)
+
+
+if __name__ == '__main__':
+	unittest.main()
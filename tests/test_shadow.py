@@ -0,0 +1,131 @@
+# -*- coding: UTF_8 -*-
+
+import unittest
+# Add path to the lib folder
+import sys, os
+lib_path = os.path.abspath(__file__).split('/peacock_uvp_py_api')[0]+'/peacock_uvp_py_api'
+sys.path.insert(0, lib_path)
+#-------------------------------------
+
+import struct
+
+from peacock_uvp.apf04_shadow import RegisterShadow
+from peacock_uvp.apf04_exception import apf04_exception
+from peacock_uvp.apf04_simulator import Apf04Simulator, LoopbackSerial, MODBUS_ILLEGAL_DATA_ADDRESS
+from peacock_uvp.modbus_crc import crc16
+
+from test_simulator import simulated_driver
+
+
+class LockedSimulator (Apf04Simulator):
+	""" simulator rejecting the writes in a locked address range """
+	locked = range(0)
+
+	def process(self, _frame):
+		if len(_frame) > 8 and _frame[1] == 16 and struct.unpack(">H", _frame[2:4])[0] in self.locked:
+			answer = struct.pack(">BBB", self.slave_addr, 0x90, MODBUS_ILLEGAL_DATA_ADDRESS)
+			return answer + struct.pack(">H", crc16(answer)), 0.
+		return Apf04Simulator.process(self, _frame)
+
+
+# The main test class
+class TestShadow(unittest.TestCase):
+	def test_diff(self):
+		shadow = RegisterShadow()
+		self.assertEqual(shadow.diff(0x10, [1, 2, 3]), [(0, 3)])
+		shadow.update(0x10, list(range(20)))
+		self.assertEqual(shadow.diff(0x10, list(range(20))), [])
+		data = list(range(20))
+		data[2] = data[4] = data[15] = -1
+		self.assertEqual(shadow.diff(0x10, data), [(2, 3), (15, 1)])
+		self.assertEqual(shadow.diff(0x10, data, _max_gap=0), [(2, 1), (4, 1), (15, 1)])
+		shadow.invalidate(0x12, 2)
+		self.assertIsNone(shadow.get(0x10, 5))
+		self.assertEqual(shadow.get(0x14, 2), [4, 5])
+
+	def test_driver(self):
+		simulator = Apf04Simulator(_time_scale=0.)
+		apf = simulated_driver(simulator)
+		config = apf.read_config(0)
+
+		# first write : all the words are sent
+		n_frames = simulator.n_frames
+		apf.write_config(config, 1)
+		apf.select_config(1)
+		self.assertEqual(simulator.n_frames - n_frames, 2)
+
+		# nothing changed
+		n_frames = simulator.n_frames
+		apf.write_config(config, 1)
+		apf.select_config(1)
+		self.assertEqual(apf.read_config(1, _cached=True), config)
+		self.assertEqual(simulator.n_frames - n_frames, 0)
+
+		# one parameter changed : one frame
+		config.n_vol = 40
+		n_frames = simulator.n_frames
+		apf.write_config(config, 1)
+		self.assertEqual(simulator.n_frames - n_frames, 1)
+
+		# the configuration checked is read again from the device
+		apf.act_check_config()
+		n_frames = simulator.n_frames
+		self.assertEqual(apf.read_config(1), config)
+		self.assertEqual(simulator.n_frames - n_frames, 1)
+
+		apf.write_sound_speed(1500)
+		n_frames = simulator.n_frames
+		apf.write_sound_speed(1500)
+		self.assertEqual(simulator.n_frames - n_frames, 0)
+
+		# after a reconnection
+		apf.invalidate_shadow()
+		apf.refresh_shadow()
+		n_frames = simulator.n_frames
+		apf.write_config(config, 1)
+		apf.select_config(1)
+		apf.write_sound_speed(1500)
+		self.assertEqual(simulator.n_frames - n_frames, 0)
+
+	def test_device_changed(self):
+		simulator = Apf04Simulator(_time_scale=0.)
+		apf = simulated_driver(simulator)
+		config = apf.read_config(0)
+		apf.write_config(config, 1)
+
+		# configuration modified by another host : read_config reads the device
+		addr = apf.config_addr(1)
+		simulator.ram[addr+4] += 1
+		self.assertNotEqual(apf.read_config(1), config)
+		self.assertEqual(apf.read_config(1, _cached=True), apf.config)
+
+		# the shadow is forgotten when the port is opened again
+		apf.attach_port(LoopbackSerial(simulator))
+		self.assertEqual(len(apf.shadow), 0)
+		n_frames = simulator.n_frames
+		apf.write_config(config, 1)
+		self.assertEqual(simulator.n_frames - n_frames, 1)
+		self.assertEqual(apf.read_config(1), config)
+
+	def test_rejected_write(self):
+		simulator = LockedSimulator(_time_scale=0.)
+		apf = simulated_driver(simulator)
+		config = apf.read_config(0)
+		config.n_vol = 40
+		addr = apf.addr.ADDR_CONFIG + 2*apf.addr.OFFSET_CONFIG
+		simulator.locked = range(addr, addr+apf.addr.SIZE_CONFIG)
+		with self.assertRaises(apf04_exception) as context:
+			apf.write_config(config, 2)
+		self.assertEqual(context.exception.code, 3002)
+		self.assertNotEqual(apf.read_config(2), config)
+
+		# the words rejected are written again
+		simulator.locked = range(0)
+		n_frames = simulator.n_frames
+		apf.write_config(config, 2)
+		self.assertEqual(simulator.n_frames - n_frames, 1)
+		self.assertEqual(apf.read_config(2), config)
+
+
+if __name__ == '__main__':
+	unittest.main()
@@ -0,0 +1,170 @@
+# -*- coding: UTF_8 -*-
+
+import unittest
+# Add path to the lib folder
+import sys, os
+lib_path = os.path.abspath(__file__).split('/peacock_uvp_py_api')[0]+'/peacock_uvp_py_api'
+sys.path.insert(0, lib_path)
+#-------------------------------------
+
+from time import time, sleep
+
+from peacock_uvp.apf04_driver import Apf04Driver, MIN_MARGIN
+from peacock_uvp.apf04_measures import extract_measures
+from peacock_uvp.apf04_addr_cmd import get_addr_dict, ACTION_TIMEOUT, CMD_CHECK_CONFIG, ADDR_ACTION
+from peacock_uvp.apf04_exception import apf04_exception
+from peacock_uvp.apf04_simulator import Apf04Simulator, LoopbackSerial, PtyServer, FrameParser
+from peacock_uvp.apf04_modbus import build_read_query, build_write_query
+
+
+def simulated_driver(_simulators, _baudrate=750000, _time_scale=0.):
+	apf = Apf04Driver(None, 36e6, "simulator")
+	apf.ser = LoopbackSerial(_simulators, _baudrate, _time_scale=_time_scale)
+	apf.addr = get_addr_dict(apf.read_version()[1])
+	return apf
+
+
+# The main test class
+class TestSimulator(unittest.TestCase):
+	def test_driver(self):
+		apf = simulated_driver(Apf04Simulator(_time_scale=0.))
+		self.assertEqual(apf.read_version(), (1, 53))
+
+		config = apf.read_config(0)
+		config.n_vol = 50
+		apf.write_config(config, 2)
+		apf.select_config(2)
+		apf.act_check_config()
+		self.assertEqual(apf.read_config(2), config)
+
+		apf.write_buf_i16(list(range(60)), 0x100)
+		self.assertEqual(apf.read_list_i16(0x100, 60), tuple(range(60)))
+
+		apf.act_meas_profile()
+		data = extract_measures(apf.read_profile(config.n_vol), config)
+		self.assertEqual(len(data["velocity"]), 50)
+		self.assertEqual(data["gain_ca0"], config.gain_ca0)
+
+		with self.assertRaises(apf04_exception):
+			apf.read_i16(0x900)
+
+	def test_timing(self):
+		simulator = Apf04Simulator()
+		apf = simulated_driver(simulator, 750000, 1.)
+		config = apf.read_config(0)
+		start = time()
+		apf.act_meas_profile()
+		apf.read_profile(config.n_vol)
+		self.assertGreater(time() - start, config.get_bloc_duration())
+
+	def test_deadline(self):
+		# the processing time of the measurement is known from the selected configuration
+		apf = simulated_driver(Apf04Simulator(), 750000, 1.)
+		config = apf.read_config(0)
+		apf.select_config(0)
+		self.assertEqual(apf.bloc_duration(), config.get_bloc_duration())
+		apf.act_meas_profile()
+		self.assertEqual(len(apf.read_profile(config.n_vol)), 2*(3+8+4*config.n_vol))
+
+		# missing device : detected after the latency, not after the serial timeout
+		apf.apf04_addr = 9
+		start = time()
+		with self.assertRaises(apf04_exception):
+			apf.read_i16(0)
+		self.assertLess(time() - start, 0.1)
+
+		# device slower than expected : detected after the margin given
+		apf = simulated_driver(Apf04Simulator(_time_scale=3.), 750000, 1.)
+		apf.read_config(0)
+		apf.select_config(0)
+		start = time()
+		with self.assertRaises(apf04_exception):
+			apf.act_meas_profile(0.2*config.get_bloc_duration())
+		self.assertLess(time() - start, 2*config.get_bloc_duration())
+		# by default, after MIN_MARGIN for a short block
+		apf = simulated_driver(Apf04Simulator(_time_scale=20.), 750000, 1.)
+		apf.read_config(0)
+		apf.select_config(0)
+		start = time()
+		with self.assertRaises(apf04_exception):
+			apf.act_meas_profile()
+		self.assertGreater(time() - start, MIN_MARGIN)
+		self.assertLess(time() - start, config.get_bloc_duration() + MIN_MARGIN + 0.1)
+
+	def test_action_timeout(self):
+		simulator = Apf04Simulator()
+		apf = simulated_driver(simulator, 750000, 1.)
+		apf.act_check_config()
+		# device slower than the upper bound of the driver
+		simulator.action_duration[CMD_CHECK_CONFIG] = ACTION_TIMEOUT[CMD_CHECK_CONFIG] + 0.1
+		with self.assertRaises(apf04_exception):
+			apf.act_check_config()
+		sleep(0.2)
+		apf.ser.reset_input_buffer()
+		apf.action_timeout[CMD_CHECK_CONFIG] = ACTION_TIMEOUT[CMD_CHECK_CONFIG] + 0.2
+		apf.act_check_config()
+
+	def test_stop(self):
+		# a stop during a long block is answered at the end of the block
+		apf = simulated_driver(Apf04Simulator(), 750000, 1.)
+		config = apf.read_config(0)
+		config.n_avg = 20
+		apf.write_config(config, 0)
+		apf.select_config(0)
+		duration = apf.bloc_duration()
+		self.assertGreater(duration, 0.5)
+		apf.act_start_profile()
+		start = time()
+		apf.act_stop()
+		self.assertGreater(time() - start, 0.8*duration)
+
+	def test_multidrop(self):
+		simulators = [Apf04Simulator(_slave_addr=addr, _serial_num=addr, _time_scale=0.) for addr in [4, 5]]
+		apf = simulated_driver(simulators)
+		for addr in [4, 5]:
+			apf.apf04_addr = addr
+			apf.read_version()
+			self.assertEqual(apf.serial_num, addr)
+
+	def test_late_answer_timing(self):
+		simulator = Apf04Simulator()
+		simulator.action_duration[CMD_CHECK_CONFIG] = 0.1
+		line = LoopbackSerial(simulator)
+		# an answer not read yet, then an answer delayed by the device
+		line.write(build_read_query(4, 10, 3))
+		n_bytes = 5 + 2*3
+		sleep(0.01)
+		self.assertEqual(line.in_waiting, n_bytes)
+		start = time()
+		line.write(build_write_query(4, ADDR_ACTION, [CMD_CHECK_CONFIG]))
+		# the delayed answer does not follow the first one immediately
+		sleep(0.05)
+		self.assertEqual(line.in_waiting, n_bytes)
+		self.assertEqual(len(line.read(n_bytes + 8)), n_bytes + 8)
+		self.assertGreater(time() - start, 0.1)
+
+	def test_frame_parser(self):
+		frames = [build_read_query(4, 10, 3), build_write_query(4, 0x100, [1, 2, 3]), build_read_query(4, 0, 1)]
+		stream = b''.join(frames)
+		parser = FrameParser()
+		received = []
+		for i in range(0, len(stream), 5):
+			received += parser.feed(stream[i:i+5])
+		self.assertEqual(received, frames)
+
+	@unittest.skipUnless(hasattr(os, "openpty"), "pseudo terminals not available")
+	def test_pty(self):
+		server = PtyServer(Apf04Simulator(_time_scale=0.))
+		try:
+			apf = Apf04Driver(750000, 36e6, server.path, get_addr_dict(53))
+			self.assertEqual(apf.read_version(), (1, 53))
+			apf.act_meas_profile()
+			self.assertEqual(len(apf.read_profile(120)), 2*(3+8+4*120))
+			apf.ser.close()
+		finally:
+			server.close()
+
+
+# We need this to be able to run the tests outside a test framework.
+if __name__ == '__main__':
+	unittest.main()
@@ -0,0 +1,65 @@
+# -*- coding: UTF_8 -*-
+
+import unittest
+# Add path to the lib folder
+import sys, os
+lib_path = os.path.abspath(__file__).split('/peacock_uvp_py_api')[0]+'/peacock_uvp_py_api'
+sys.path.insert(0, lib_path)
+#-------------------------------------
+
+import time
+from datetime import datetime, timedelta, timezone
+
+import numpy as np
+
+from peacock_uvp.apf_timestamp import encode_timestamp, decode_timestamp, encode_timestamps, decode_timestamps, UBT_EPOCH
+
+class TestTimestamp(unittest.TestCase):
+
+	def setUp(self):
+		rng = np.random.default_rng(3)
+		# from 2020 to ~2054, with ms
+		self.ms = rng.integers(0, (1<<30)*1000, 1000)
+		self.times = [UBT_EPOCH + timedelta(milliseconds=int(ms)) for ms in self.ms]
+
+	def test_encode(self):
+		words = encode_timestamps(np.array([t.replace(tzinfo=None) for t in self.times], dtype='datetime64[ms]'))
+		self.assertEqual(words.dtype, np.int16)
+		self.assertEqual(words.shape, (len(self.times), 3))
+		for t, w in zip(self.times, words):
+			self.assertEqual(w.tobytes(), encode_timestamp(t))
+
+	def test_decode(self):
+		words = np.frombuffer(b"".join(encode_timestamp(t) for t in self.times), dtype=np.int16).reshape(-1, 3)
+		decoded = decode_timestamps(words)
+		self.assertEqual(decoded.dtype, np.dtype('datetime64[ms]'))
+		expected = np.array([decode_timestamp(w.tobytes())[0].replace(tzinfo=None) for w in words], dtype='datetime64[ms]')
+		np.testing.assert_array_equal(decoded, expected)
+
+	def test_round_trip_out(self):
+		out = np.zeros((2, len(self.ms), 3), dtype=np.int16)
+		times = (self.ms + int(UBT_EPOCH.timestamp())*1000).reshape(1, -1)
+		self.assertIs(encode_timestamps(times, out[1:]).base, out)
+		np.testing.assert_array_equal(decode_timestamps(out[1]).view(np.int64), times[0])
+
+	@unittest.skipUnless(hasattr(time, "tzset"), "time.tzset not available")
+	def test_naive_utc(self):
+		t = datetime(2023, 7, 14, 12, 30, 15, 250000)
+		tz = os.environ.get("TZ")
+		try:
+			encoded = set()
+			for name in ["UTC", "Europe/Paris", "America/New_York"]:
+				os.environ["TZ"] = name
+				time.tzset()
+				encoded.add(encode_timestamp(t))
+		finally:
+			if tz is None:
+				del os.environ["TZ"]
+			else:
+				os.environ["TZ"] = tz
+			time.tzset()
+		self.assertEqual(len(encoded), 1)
+		self.assertEqual(decode_timestamp(encoded.pop())[0], t.replace(tzinfo=timezone.utc))
+
+if __name__ == '__main__':
+	unittest.main()